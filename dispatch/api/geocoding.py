@@ -0,0 +1,312 @@
+import asyncio
+import re
+import threading
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils.module_loading import import_string
+from geopy.exc import GeocoderQueryError, GeopyError
+from geopy.geocoders import Nominatim
+
+from metrics.asynchronous import run_in_pool
+from metrics.cache import get_dataset_version
+from metrics.models import AddressStats
+from .models import GeocodedAddress
+
+Location = namedtuple('Location', ['latitude', 'longitude'])
+
+# City suffixes that are dropped so "X" and "X, San Francisco, CA" share a key
+CITY_SUFFIX = re.compile(r'(,\s*san francisco)?(,\s*ca(lifornia)?)?(\s+\d{5})?$')
+
+class GeocoderError(Exception):
+    """
+    Raised when the network geocoder can't answer right now, e.g. it timed
+    out, rate limited the request or is down. Unlike an address without a
+    result, these are not cached so the address is tried again later.
+    """
+
+def normalize_address(address):
+    """
+    Returns the cache key for an address: lowercase, single spaced, without
+    periods and without the San Francisco city/state suffix.
+    """
+    address = re.sub(r'\s+', ' ', address.lower().replace('.', '')).strip()
+    return CITY_SUFFIX.sub('', address).strip(' ,')
+
+class NominatimGeocoder:
+    """
+    Network geocoder backed by OpenStreetMap Nominatim. A single client is
+    shared by all requests.
+    """
+
+    def __init__(self):
+        self.geolocator = Nominatim(
+            scheme='http', timeout=getattr(settings, 'GEOCODER_TIMEOUT', 10)
+        )
+
+    def geocode(self, address):
+        """
+        Returns the Location for an address, or None if it can't be resolved.
+        Raises a GeocoderError if Nominatim can't answer right now.
+        """
+        try:
+            location = self.geolocator.geocode(address)
+        except GeocoderQueryError:
+            # The query itself was rejected, so it won't resolve later either
+            return None
+        except GeopyError as e:
+            # Timeouts, rate limits and outages
+            raise GeocoderError(str(e)) from e
+
+        if location:
+            return Location(location.latitude, location.longitude)
+
+        return None
+
+class Gazetteer:
+    """
+    Offline geocoder built from the addresses already in the calls table,
+    using the averaged latitude and longitude of each address from the
+    AddressStats rollup.
+    """
+
+    def __init__(self):
+        self.locations = None
+        self.version = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        """
+        Returns a dictionary of normalized address to Location.
+        """
+        addresses = AddressStats.objects.values_list('address', 'latitude', 'longitude')
+
+        return {
+            normalize_address(address): Location(float(latitude), float(longitude))
+            for address, latitude, longitude in addresses.iterator()
+        }
+
+    def get(self, key):
+        """
+        Returns the Location for a normalized address, or None if unknown.
+        """
+        # Reload the addresses after the dataset changes
+        version, updated = get_dataset_version()
+
+        if self.locations is None or self.version != version:
+            with self.lock:
+                if self.locations is None or self.version != version:
+                    self.locations = self.load()
+                    self.version = version
+
+        return self.locations.get(key)
+
+    def clear(self):
+        """
+        Drops the loaded addresses so they are rebuilt on the next lookup.
+        """
+        self.locations = None
+
+class CachedGeocoder:
+    """
+    Geocoder that resolves an address from, in order: an in-process LRU
+    cache, the offline gazetteer, the persisted GeocodedAddress table and
+    finally the network backend. Results from slower tiers are stored in the
+    faster ones, and each tier keeps a hit counter.
+    """
+
+    # Marker for addresses known to be unresolvable
+    NOT_FOUND = Location(None, None)
+
+    def __init__(self, backend, gazetteer=None, cache_size=1024):
+        self.backend = backend
+        self.gazetteer = gazetteer
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.counters = {
+            "lru_hits": 0,
+            "gazetteer_hits": 0,
+            "database_hits": 0,
+            "misses": 0,
+            "not_found": 0,
+            "errors": 0
+        }
+
+    def count(self, counter):
+        """
+        Increments one of the hit/miss counters.
+        """
+        with self.lock:
+            self.counters[counter] += 1
+
+    def remember(self, key, location):
+        """
+        Adds a result to the LRU cache, evicting the least recently used.
+        """
+        with self.lock:
+            self.cache[key] = location
+            self.cache.move_to_end(key)
+
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def lookup(self, key):
+        """
+        Returns the cached result for a key from the LRU cache, gazetteer or
+        database, or None when the backend has to be queried.
+        """
+        with self.lock:
+            location = self.cache.get(key)
+            if location is not None:
+                self.cache.move_to_end(key)
+                self.counters["lru_hits"] += 1
+                return location
+
+        if self.gazetteer is not None:
+            location = self.gazetteer.get(key)
+            if location is not None:
+                self.count("gazetteer_hits")
+                return location
+
+        cached = GeocodedAddress.objects.filter(address=key).first()
+        if cached:
+            self.count("database_hits")
+            if cached.latitude is None:
+                return self.NOT_FOUND
+
+            return Location(cached.latitude, cached.longitude)
+
+        return None
+
+    def store(self, key, location):
+        """
+        Persists a backend result in the GeocodedAddress table.
+        """
+        # Another request may have stored the same address meanwhile
+        try:
+            with transaction.atomic():
+                GeocodedAddress.objects.create(
+                    address=key,
+                    latitude=location.latitude,
+                    longitude=location.longitude
+                )
+        except IntegrityError:
+            pass
+
+    def resolve(self, key, location):
+        """
+        Remembers a result and returns it, or None if the address can't be
+        resolved.
+        """
+        self.remember(key, location)
+
+        if location.latitude is None:
+            self.count("not_found")
+            return None
+
+        return location
+
+    def geocode(self, address):
+        """
+        Returns the Location for an address, or None if it can't be resolved.
+        Raises a GeocoderError, without caching anything, if the backend
+        can't answer right now.
+        """
+        key = normalize_address(address)
+        location = self.lookup(key)
+
+        if location is None:
+            self.count("misses")
+
+            try:
+                location = self.backend.geocode(address) or self.NOT_FOUND
+            except GeocoderError:
+                self.count("errors")
+                raise
+
+            self.store(key, location)
+
+        return self.resolve(key, location)
+
+    async def geocode_async(self, address):
+        """
+        Coroutine version of geocode for async views. The cache tiers are
+        looked up in the shared thread pool, but the backend request runs in
+        the geocoder's own pool, so slow requests never hold the threads
+        other views query the database with. Requests not answered within
+        GEOCODER_TIMEOUT seconds raise a GeocoderError.
+        """
+        key = normalize_address(address)
+        location = await run_in_pool(self.lookup, key)
+
+        if location is None:
+            self.count("misses")
+            loop = asyncio.get_running_loop()
+
+            try:
+                location = await asyncio.wait_for(
+                    loop.run_in_executor(get_geocoder_executor(), self.backend.geocode, address),
+                    getattr(settings, 'GEOCODER_TIMEOUT', 10)
+                ) or self.NOT_FOUND
+            except asyncio.TimeoutError:
+                self.count("errors")
+                raise GeocoderError('Geocoder timed out.')
+            except GeocoderError:
+                self.count("errors")
+                raise
+
+            await run_in_pool(self.store, key, location)
+
+        return self.resolve(key, location)
+
+    def stats(self):
+        """
+        Returns a copy of the hit/miss counters and the LRU cache size.
+        """
+        with self.lock:
+            stats = dict(self.counters)
+            stats["lru_size"] = len(self.cache)
+
+        return stats
+
+_geocoder = None
+_geocoder_executor = None
+
+def get_geocoder_executor():
+    """
+    Returns the thread pool for network geocoder requests, of
+    GEOCODER_THREAD_POOL_SIZE threads. Its threads never query the
+    database.
+    """
+    global _geocoder_executor
+
+    if _geocoder_executor is None:
+        _geocoder_executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'GEOCODER_THREAD_POOL_SIZE', 8),
+            thread_name_prefix='geocoder-pool'
+        )
+
+    return _geocoder_executor
+
+def get_geocoder():
+    """
+    Returns the shared geocoder. The network backend can be swapped with the
+    GEOCODER_BACKEND setting (a dotted path to a class with a geocode method
+    that raises GeocoderError when it can't answer),
+    and the gazetteer disabled with GEOCODER_USE_GAZETTEER = False.
+    """
+    global _geocoder
+
+    if _geocoder is None:
+        backend = import_string(getattr(
+            settings, 'GEOCODER_BACKEND', 'api.geocoding.NominatimGeocoder'
+        ))
+        gazetteer = Gazetteer() if getattr(settings, 'GEOCODER_USE_GAZETTEER', True) else None
+        _geocoder = CachedGeocoder(
+            backend(), gazetteer, getattr(settings, 'GEOCODER_CACHE_SIZE', 1024)
+        )
+
+    return _geocoder
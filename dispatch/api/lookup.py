@@ -0,0 +1,310 @@
+import math
+import os
+import threading
+
+import numpy as np
+from django.conf import settings
+from django.db import connection
+
+from metrics.cache import get_dataset_version
+from metrics.models import Call
+from .nearby import METERS_PER_DEGREE, MINUTES_PER_DAY, nearby_unit_types
+
+HOURS_PER_DAY = 24
+
+# (min longitude, min latitude, max longitude, max latitude) of San Francisco,
+# including the islands
+CITY_BOUNDS = (-122.53, 37.69, -122.34, 37.84)
+
+def cell_degrees(cell_meters, latitude, rows):
+    """
+    Returns the (width, height) in degrees of grid cells that are square in
+    meters at the middle latitude of a grid of rows starting at latitude.
+    """
+    height = cell_meters / METERS_PER_DEGREE
+    middle = latitude + rows * height / 2
+    return height / math.cos(math.radians(middle)), height
+
+def grid_shape(bounds, cell_meters):
+    """
+    Returns the (rows, columns, cell width, cell height) of a grid of square
+    cells covering the bounds.
+    """
+    xmin, ymin, xmax, ymax = bounds
+    rows = int((ymax - ymin) * METERS_PER_DEGREE / cell_meters) + 1
+    cell_width, cell_height = cell_degrees(cell_meters, ymin, rows)
+    columns = int((xmax - xmin) / cell_width) + 1
+
+    return rows, columns, cell_width, cell_height
+
+class UnitTypeIndex:
+    """
+    Memory-resident lookup table for nearby unit_type predictions: a
+    histogram of unit_type counts for every grid cell and hour of the day.
+    A prediction sums the histograms of the cells whose centers lie within
+    the radius over the hours in the time window, so it costs a number of
+    array operations proportional to the cells covered and never touches
+    the database.
+
+    The grid covers fixed bounds around the city and only occupied cells are
+    stored: the sorted cell numbers, and for each cell a range of (hour,
+    unit_type, count) entries, like a compressed sparse row matrix.
+    """
+
+    def __init__(self, cells, offsets, hours, types, counts, unit_types, bounds,
+            cell_meters, version=None):
+        """
+        @param cells: The sorted numbers (row * columns + column) of the
+        occupied cells.
+        @param offsets: The start of each cell's entries, followed by the
+        number of entries.
+        @param hours: The hour of the day of each entry.
+        @param types: The unit type code of each entry.
+        @param counts: The call count of each entry.
+        @param unit_types: The unit_type values indexed by the type codes.
+        @param bounds: The (min longitude, min latitude, max longitude, max
+        latitude) of the grid.
+        @param cell_meters: The edge length of a cell in meters.
+        @param version: The dataset version the index was built at.
+        """
+        self.cells = cells
+        self.offsets = offsets
+        self.hours = hours
+        self.types = types
+        self.counts = counts
+        self.unit_types = list(unit_types)
+        self.bounds = tuple(bounds)
+        self.origin = self.bounds[:2]
+        self.cell_meters = cell_meters
+        self.version = version
+        self.rows, self.columns, self.cell_width, self.cell_height = grid_shape(
+            self.bounds, cell_meters
+        )
+
+    @classmethod
+    def build(cls, cell_meters=100, version=None, bounds=None):
+        """
+        Returns an index built from the calls table with one aggregate query
+        for the counts per cell, hour and unit_type. Calls outside the bounds,
+        such as the (0, 0) or (90, -120) points of badly geocoded records,
+        are left out.
+        @param bounds: The grid bounds; the UNIT_TYPE_INDEX_BOUNDS setting by
+        default.
+        """
+        bounds = tuple(bounds or getattr(settings, 'UNIT_TYPE_INDEX_BOUNDS', CITY_BOUNDS))
+        xmin, ymin, xmax, ymax = bounds
+        rows, columns, cell_width, cell_height = grid_shape(bounds, cell_meters)
+        table = connection.ops.quote_name(Call._meta.db_table)
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT received_minute / 60, '
+                'LEAST(FLOOR((ST_Y(point) - %s) / %s)::integer, %s), '
+                'LEAST(FLOOR((ST_X(point) - %s) / %s)::integer, %s), '
+                'unit_type, COUNT(*) FROM {0} '
+                'WHERE point && ST_MakeEnvelope(%s, %s, %s, %s, 4326) '
+                'AND received_minute IS NOT NULL '
+                'AND unit_type IS NOT NULL GROUP BY 1, 2, 3, 4'.format(table),
+                [ymin, cell_height, rows - 1, xmin, cell_width, columns - 1,
+                    xmin, ymin, xmax, ymax]
+            )
+            entries = cursor.fetchall()
+
+        unit_types = sorted({entry[3] for entry in entries})
+        codes = {unit_type: code for code, unit_type in enumerate(unit_types)}
+
+        if entries:
+            hours, row, column, unit_type, count = zip(*entries)
+        else:
+            hours, row, column, unit_type, count = [], [], [], [], []
+
+        # Entries sorted by cell, and each cell's first entry
+        keys = np.array(row, dtype=np.int64) * columns + np.array(column, dtype=np.int64)
+        order = np.argsort(keys, kind='stable')
+        cells, starts = np.unique(keys[order], return_index=True)
+
+        return cls(
+            cells, np.append(starts, len(keys)).astype(np.int64),
+            np.array(hours, dtype=np.uint8)[order],
+            np.array([codes[u] for u in unit_type], dtype=np.uint16)[order],
+            np.array(count, dtype=np.uint32)[order],
+            unit_types, bounds, cell_meters, version
+        )
+
+    def save(self, path):
+        """
+        Writes the index to a compressed NumPy archive.
+        """
+        with open(path, 'wb') as f:
+            np.savez_compressed(
+                f,
+                cells=self.cells,
+                offsets=self.offsets,
+                hours=self.hours,
+                types=self.types,
+                counts=self.counts,
+                unit_types=np.array(self.unit_types, dtype=str),
+                bounds=np.array(self.bounds, dtype=np.float64),
+                cell_meters=np.array(self.cell_meters, dtype=np.float64),
+                version=np.array(-1 if self.version is None else self.version, dtype=np.int64)
+            )
+
+    @classmethod
+    def open(cls, path):
+        """
+        Returns the index stored at a path by save().
+        """
+        with np.load(path) as data:
+            version = int(data['version'])
+
+            return cls(
+                data['cells'], data['offsets'], data['hours'], data['types'],
+                data['counts'], [str(u) for u in data['unit_types']],
+                data['bounds'].tolist(), float(data['cell_meters']),
+                None if version < 0 else version
+            )
+
+    @property
+    def nbytes(self):
+        """
+        The memory used by the index arrays in bytes.
+        """
+        return sum(a.nbytes for a in (self.cells, self.offsets, self.hours, self.types, self.counts))
+
+    @property
+    def size(self):
+        """
+        The number of calls counted in the index.
+        """
+        return int(self.counts.sum(dtype=np.int64))
+
+    def hour_buckets(self, minute, delta_minutes):
+        """
+        Returns the hours of the day whose middle lies in the window of
+        delta_minutes around the minute, wrapping around midnight, so the
+        window is approximated by whole hours.
+        """
+        if delta_minutes * 2 >= MINUTES_PER_DAY:
+            return list(range(HOURS_PER_DAY))
+
+        middles = np.arange(HOURS_PER_DAY) * 60 + 30
+        offsets = (middles - (minute - delta_minutes)) % MINUTES_PER_DAY
+        hours = np.flatnonzero(offsets < delta_minutes * 2)
+
+        # Very short windows still count the hour they fall in
+        return hours.tolist() or [(minute // 60) % HOURS_PER_DAY]
+
+    def histogram(self, location, radius, minute, delta_minutes):
+        """
+        Returns the unit_type counts of the cells within radius meters of the
+        location during the hours around the minute of the day.
+        """
+        rows, columns, types = self.rows, self.columns, len(self.unit_types)
+        y = (location.latitude - self.origin[1]) / self.cell_height
+        x = (location.longitude - self.origin[0]) / self.cell_width
+        reach = radius / self.cell_meters
+
+        # The square of cells around the circle, clipped to the grid
+        row_start, row_end = max(math.floor(y - reach), 0), min(math.floor(y + reach) + 1, rows)
+        column_start, column_end = max(math.floor(x - reach), 0), min(math.floor(x + reach) + 1, columns)
+
+        if row_start >= row_end or column_start >= column_end:
+            return np.zeros(types, dtype=np.int64)
+
+        # Cells whose centers are within the radius
+        centers_y = np.arange(row_start, row_end)[:, None] + 0.5
+        centers_x = np.arange(column_start, column_end)[None, :] + 0.5
+        inside = (centers_y - y) ** 2 + (centers_x - x) ** 2 <= reach ** 2
+
+        # The occupied cells among them
+        keys = (
+            np.arange(row_start, row_end)[:, None] * columns + np.arange(column_start, column_end)[None, :]
+        )[inside]
+        positions = np.searchsorted(self.cells, keys[np.isin(keys, self.cells)])
+
+        # The entries of those cells in the hours of the window
+        starts, ends = self.offsets[positions], self.offsets[positions + 1]
+        lengths = ends - starts
+        # Concatenated ranges of entry positions
+        entries = np.arange(lengths.sum()) + np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+
+        selected = np.zeros(HOURS_PER_DAY, dtype=bool)
+        selected[self.hour_buckets(minute, delta_minutes)] = True
+        entries = entries[selected[self.hours[entries]]]
+
+        return np.bincount(
+            self.types[entries], weights=self.counts[entries], minlength=types
+        ).astype(np.int64)
+
+    def predict(self, location, radius, minute, delta_minutes):
+        """
+        Returns the most common unit_type and its approximate count like the
+        first row of nearby_unit_types, or None if no calls are near.
+        """
+        histogram = self.histogram(location, radius, minute, delta_minutes)
+
+        if not histogram.size or not histogram.any():
+            return None
+
+        best = int(histogram.argmax())
+        return {"unit_type": self.unit_types[best], "count": int(histogram[best])}
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_unit_type_index():
+    """
+    Returns the shared unit_type index, or None if the UNIT_TYPE_INDEX
+    setting is off. The index is reloaded when the dataset version changes,
+    from the file at UNIT_TYPE_INDEX_PATH when it matches the current
+    version and otherwise from the database.
+    """
+    global _index
+
+    if not getattr(settings, 'UNIT_TYPE_INDEX', False):
+        return None
+
+    version, updated = get_dataset_version()
+
+    if _index is None or _index.version != version:
+        with _index_lock:
+            if _index is None or _index.version != version:
+                _index = open_unit_type_index(version)
+
+    return _index
+
+def open_unit_type_index(version):
+    """
+    Returns the index file at UNIT_TYPE_INDEX_PATH if it was built at the
+    given dataset version, cell size and bounds, otherwise an index built
+    from the database.
+    """
+    path = getattr(settings, 'UNIT_TYPE_INDEX_PATH', None)
+    cell_meters = getattr(settings, 'UNIT_TYPE_INDEX_CELL_METERS', 100)
+    bounds = tuple(getattr(settings, 'UNIT_TYPE_INDEX_BOUNDS', CITY_BOUNDS))
+
+    if path and os.path.exists(path):
+        try:
+            index = UnitTypeIndex.open(path)
+        except (OSError, ValueError, KeyError):
+            index = None
+
+        if (index is not None and index.version == version and
+                index.cell_meters == cell_meters and index.bounds == bounds):
+            return index
+
+    return UnitTypeIndex.build(cell_meters, version=version, bounds=bounds)
+
+def top_unit_type(location, radius, minute, delta_minutes):
+    """
+    Returns the most common unit_type and its count near the location and
+    time of day. Radii up to UNIT_TYPE_INDEX_MAX_RADIUS meters are answered
+    from the unit_type index when it's enabled, larger ones by the spatial
+    query.
+    """
+    index = get_unit_type_index()
+
+    if index is not None and radius <= getattr(settings, 'UNIT_TYPE_INDEX_MAX_RADIUS', 3219):
+        return index.predict(location, radius, minute, delta_minutes)
+
+    return nearby_unit_types(location, radius, minute, delta_minutes).first()
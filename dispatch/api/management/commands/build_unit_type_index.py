@@ -0,0 +1,40 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.lookup import UnitTypeIndex
+from metrics.cache import get_dataset_version
+
+class Command(BaseCommand):
+    """
+    Management command for writing the unit_type lookup index file that web
+    workers load on startup.
+    """
+    help = 'Builds the grid cell x hour unit_type index used by the nearby API.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?',
+            help='Output file (default: the UNIT_TYPE_INDEX_PATH setting).'
+        )
+
+    def handle(self, *args, **options):
+        path = options['path'] or getattr(settings, 'UNIT_TYPE_INDEX_PATH', None)
+        if not path:
+            raise CommandError('No path given and UNIT_TYPE_INDEX_PATH is not set.')
+
+        start = time.time()
+        version, updated = get_dataset_version()
+        index = UnitTypeIndex.build(
+            getattr(settings, 'UNIT_TYPE_INDEX_CELL_METERS', 100), version=version
+        )
+        index.save(path)
+
+        self.stdout.write(self.style.SUCCESS(
+            'Wrote index of {0} calls ({1} of {2} x {3} cells occupied, {4} unit types, '
+            '{5:.1f} MB in memory) at version {6} to {7} in {8:.1f}s.'.format(
+                index.size, len(index.cells), index.rows, index.columns,
+                len(index.unit_types), index.nbytes / 1e6, version, path, time.time() - start
+            )
+        ))
@@ -0,0 +1,94 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.geocoding import Location
+from api.lookup import open_unit_type_index
+from api.nearby import nearby_unit_types
+from metrics.cache import get_dataset_version
+from metrics.models import Call
+
+METERS_PER_MILE = 1609.34
+
+class Command(BaseCommand):
+    """
+    Management command comparing the unit_type index predictions with the
+    exact spatial query at sampled call locations and times.
+    """
+    help = 'Reports the accuracy and speed of the unit_type index against the exact query.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--samples', type=int, default=200,
+            help='Number of random calls used as query locations and times.'
+        )
+        parser.add_argument(
+            '--radius', type=float, action='append',
+            help='Radius in miles; may be repeated (default: 0.25, 0.5, 1 and 2).'
+        )
+        parser.add_argument(
+            '--delta-hours', type=float, default=2,
+            help='Time of day window around each call, as in the nearby API.'
+        )
+
+    def handle(self, *args, **options):
+        radii = options['radius'] or [0.25, 0.5, 1, 2]
+        delta_minutes = int(options['delta_hours'] * 60)
+
+        version, updated = get_dataset_version()
+        start = time.perf_counter()
+        index = open_unit_type_index(version)
+        self.stdout.write('Index of {0} calls loaded in {1:.0f} ms.'.format(
+            index.size, (time.perf_counter() - start) * 1000
+        ))
+
+        samples = list(
+            Call.objects.filter(
+                point__isnull=False, received_minute__isnull=False
+            ).order_by('?').values_list(
+                'latitude', 'longitude', 'received_minute'
+            )[:max(options['samples'], 1)]
+        )
+
+        if not samples:
+            self.stdout.write('No calls with a location and time to sample.')
+            return
+
+        self.stdout.write('{0:>8}{1:>10}{2:>14}{3:>14}{4:>12}'.format(
+            'miles', 'match', 'count error', 'index ms', 'exact ms'
+        ))
+
+        for miles in radii:
+            radius = miles * METERS_PER_MILE
+            matches = compared = 0
+            errors = []
+            index_time = exact_time = 0.0
+
+            for latitude, longitude, minute in samples:
+                location = Location(float(latitude), float(longitude))
+
+                start = time.perf_counter()
+                approximate = index.predict(location, radius, minute, delta_minutes)
+                index_time += time.perf_counter() - start
+
+                start = time.perf_counter()
+                exact = nearby_unit_types(location, radius, minute, delta_minutes).first()
+                exact_time += time.perf_counter() - start
+
+                if not exact or not exact["count"]:
+                    continue
+
+                compared += 1
+                if approximate and approximate["count"] and approximate["unit_type"] == exact["unit_type"]:
+                    matches += 1
+
+                approximate_count = approximate["count"] if approximate else 0
+                errors.append(abs(approximate_count - exact["count"]) / exact["count"])
+
+            self.stdout.write('{0:>8.2f}{1:>9.1f}%{2:>13.1f}%{3:>14.3f}{4:>12.2f}'.format(
+                miles,
+                100.0 * matches / max(compared, 1),
+                100.0 * sum(errors) / max(len(errors), 1),
+                index_time * 1000 / len(samples),
+                exact_time * 1000 / len(samples)
+            ))
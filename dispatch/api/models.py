@@ -1,3 +1,12 @@
 from django.db import models
 
-# Create your models here.
+class GeocodedAddress(models.Model):
+    """
+    Model for a persisted geocoder result, keyed by normalized address.
+    Addresses the geocoder could not resolve are stored without coordinates
+    so they are not looked up again.
+    """
+    address = models.TextField(unique=True)
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
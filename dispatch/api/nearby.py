@@ -0,0 +1,140 @@
+import math
+
+from django.contrib.gis.geos import Point, Polygon
+from django.contrib.gis.measure import D
+from django.db import connection
+from django.db.models import Count, Q
+
+from metrics.models import Call
+
+MINUTES_PER_DAY = 24 * 60
+METERS_PER_DEGREE = 111320 # Meters per degree of latitude
+
+def minute_range(minute, delta_minutes):
+    """
+    Returns the (start, end) minutes of the day within delta_minutes of the
+    given minute, or None when the window covers the whole day. start is
+    greater than end when the window wraps around midnight.
+    """
+    if delta_minutes * 2 >= MINUTES_PER_DAY:
+        return None
+
+    return (
+        (minute - delta_minutes) % MINUTES_PER_DAY,
+        (minute + delta_minutes) % MINUTES_PER_DAY
+    )
+
+def minute_range_filter(minute, delta_minutes):
+    """
+    Returns a Q object matching calls received within delta_minutes of the
+    given minute of the day, wrapping around midnight. Returns an empty Q
+    when the window covers the whole day.
+    """
+    window = minute_range(minute, delta_minutes)
+
+    if window is None:
+        return Q()
+
+    start, end = window
+
+    # A window crossing midnight, e.g. 23:00 +/- 2h, matches 21:00-23:59
+    # and 00:00-01:00.
+    if start > end:
+        return Q(received_minute__gte=start) | Q(received_minute__lte=end)
+
+    return Q(received_minute__gte=start, received_minute__lte=end)
+
+def bounding_extent(location, radius):
+    """
+    Returns the (xmin, ymin, xmax, ymax) degrees bounding the circle of
+    radius meters around the location.
+    """
+    lat_delta = radius / METERS_PER_DEGREE
+    lng_delta = radius / (METERS_PER_DEGREE * max(math.cos(math.radians(location.latitude)), 0.01))
+
+    return (
+        location.longitude - lng_delta, location.latitude - lat_delta,
+        location.longitude + lng_delta, location.latitude + lat_delta
+    )
+
+def bounding_box(location, radius):
+    """
+    Returns a polygon bounding the circle of radius meters around the
+    location, used to let the spatial index narrow candidates before the
+    exact distance test.
+    """
+    box = Polygon.from_bbox(bounding_extent(location, radius))
+    box.srid = 4326
+    return box
+
+def nearby_unit_types(location, radius, minute, delta_minutes):
+    """
+    Returns unit_type counts, most common first, for calls within radius
+    meters of the location that were received within delta_minutes of the
+    minute of the day.
+    """
+    source_location = Point(location.longitude, location.latitude, srid=4326)
+
+    return Call.objects.filter(
+        minute_range_filter(minute, delta_minutes),
+        point__bboverlaps=bounding_box(location, radius),
+        point__distance_lte=(source_location, D(m=radius))
+    ).values('unit_type').annotate(
+        count=Count('unit_type')
+    ).order_by('-count')
+
+def batch_nearby_unit_types(queries):
+    """
+    Returns the most common unit_type and its count for each of many nearby
+    queries, answered by a single statement: the queries are unnested into
+    rows and each is matched against the calls table with a LATERAL join,
+    using the same bounding box, distance and time of day tests as
+    nearby_unit_types.
+    @param queries: A list of (location, radius, minute, delta_minutes)
+    tuples.
+    @return: A list, in the order of the queries, of (unit_type, count)
+    tuples, or None where no calls matched.
+    """
+    if not queries:
+        return []
+
+    # One array per column, unnested side by side into query rows
+    columns = [[] for _ in range(11)]
+
+    for ordinal, (location, radius, minute, delta_minutes) in enumerate(queries):
+        window = minute_range(minute, delta_minutes)
+        values = (ordinal, location.latitude, location.longitude, radius) + \
+            bounding_extent(location, radius) + \
+            (window is None,) + (window or (0, 0))
+
+        for column, value in zip(columns, values):
+            column.append(value)
+
+    sql = (
+        'SELECT q.ordinal, m.unit_type, m.count '
+        'FROM unnest(%s::integer[], %s::float8[], %s::float8[], %s::float8[], '
+        '%s::float8[], %s::float8[], %s::float8[], %s::float8[], '
+        '%s::boolean[], %s::integer[], %s::integer[]) '
+        'AS q(ordinal, latitude, longitude, radius, xmin, ymin, xmax, ymax, '
+        'all_day, start_minute, end_minute) '
+        'LEFT JOIN LATERAL ('
+        'SELECT c.unit_type, COUNT(c.unit_type) AS count FROM {table} c '
+        'WHERE c.point && ST_MakeEnvelope(q.xmin, q.ymin, q.xmax, q.ymax, 4326) '
+        'AND ST_DistanceSphere(c.point, ST_SetSRID(ST_MakePoint(q.longitude, q.latitude), 4326)) <= q.radius '
+        'AND (q.all_day '
+        'OR (q.start_minute <= q.end_minute AND c.received_minute BETWEEN q.start_minute AND q.end_minute) '
+        'OR (q.start_minute > q.end_minute AND (c.received_minute >= q.start_minute OR c.received_minute <= q.end_minute))) '
+        'GROUP BY c.unit_type ORDER BY count DESC LIMIT 1'
+        ') m ON true'
+    ).format(table=connection.ops.quote_name(Call._meta.db_table))
+
+    results = [None] * len(queries)
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, columns)
+
+        for ordinal, unit_type, count in cursor.fetchall():
+            if count:
+                results[ordinal] = (unit_type, count)
+
+    return results
@@ -0,0 +1,64 @@
+import json
+
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, StreamingHttpResponse
+
+def wants_stream(request):
+    """
+    Returns whether a request asked for a streamed response with
+    stream=true and can be given one. Django's ASGI handler iterates
+    streamed content on the event loop, where the queries producing it
+    can't run, so requests served under ASGI are never streamed.
+    """
+    return request.GET.get('stream') == 'true' and not isinstance(request, ASGIRequest)
+
+def iter_json(prefix, items, suffix, chunk_size=1000):
+    """
+    Yields a JSON document in encoded chunks: the prefix, the items as the
+    elements of an array, then the suffix. Items are encoded chunk_size at a
+    time so the whole array is never held in memory.
+    @param prefix: The document text up to and including the array's "[".
+    @param items: An iterable of JSON serializable array elements.
+    @param suffix: The document text from the array's "]" to the end.
+    """
+    encoder = DjangoJSONEncoder(separators=(',', ':'))
+    yield prefix.encode('utf-8')
+
+    chunk = []
+    first = True
+
+    for item in items:
+        chunk.append(encoder.encode(item))
+
+        if len(chunk) >= chunk_size:
+            yield ((',' if not first else '') + ','.join(chunk)).encode('utf-8')
+            chunk = []
+            first = False
+
+    if chunk:
+        yield ((',' if not first else '') + ','.join(chunk)).encode('utf-8')
+
+    yield suffix.encode('utf-8')
+
+def json_array_response(request, prefix, items, suffix):
+    """
+    Returns a response for a JSON document wrapping an array, streamed
+    incrementally when wants_stream() is True for the request. Otherwise
+    the items are read in full while the view runs.
+    """
+    chunks = iter_json(prefix, items, suffix)
+
+    if wants_stream(request):
+        return StreamingHttpResponse(chunks, content_type='application/json')
+
+    return HttpResponse(b''.join(chunks), content_type='application/json')
+
+def json_prefix(document, key):
+    """
+    Returns the prefix and suffix around the array at the given key of a
+    JSON object, for use with iter_json. The key must be last in the object.
+    """
+    text = json.dumps(dict(document, **{key: []}))
+    prefix, suffix = text.rsplit('[]', 1)
+    return prefix + '[', ']' + suffix
@@ -1,3 +1,94 @@
-from django.test import TestCase
+import json
+from decimal import Decimal
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib.gis.geos import MultiPolygon, Polygon
+from django.test import TransactionTestCase
+from django.urls import reverse
+
+from dispatch.asgi import application
+from metrics.cache import get_response_cache
+from metrics.models import AddressStats, Neighborhood
+
+def asgi_get(path, query_string=''):
+    """
+    Sends a GET request through the project's ASGI application, as served by
+    uvicorn in production. Returns the status code and the whole body.
+    """
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode('utf-8'),
+        'query_string': query_string.encode('utf-8'),
+        'root_path': '',
+        'headers': [(b'host', b'testserver')],
+        'client': ('127.0.0.1', 50000),
+        'server': ('testserver', 80),
+    }
+    async_to_sync(application)(scope, receive, send)
+
+    status = next(m['status'] for m in messages if m['type'] == 'http.response.start')
+    body = b''.join(m.get('body', b'') for m in messages if m['type'] == 'http.response.body')
+    return status, body
+
+class StreamedResponseTests(TransactionTestCase):
+    """
+    Checks the views that stream JSON arrays with stream=true answer when
+    served through the ASGI application, whose handler iterates streamed
+    content on the event loop.
+    """
+
+    def setUp(self):
+        get_response_cache().clear(shared=True)
+
+        AddressStats.objects.bulk_create([
+            AddressStats(
+                address='{0} MARKET ST'.format(i), calls=10 + i, incidents=5 + i,
+                latitude=Decimal('37.77'), longitude=Decimal('-122.42')
+            )
+            for i in range(5)
+        ])
+        Neighborhood.objects.create(
+            name='Mission',
+            geometry=MultiPolygon(
+                Polygon(((-122.43, 37.75), (-122.40, 37.75), (-122.40, 37.77),
+                    (-122.43, 37.77), (-122.43, 37.75))),
+                srid=4326
+            )
+        )
+
+    def test_address_frequency(self):
+        status, body = asgi_get(reverse('api-address-frequency'), 'stream=true')
+
+        self.assertEqual(status, 200)
+        data = json.loads(body)["data"]
+        self.assertEqual([d["address"] for d in data], [
+            '4 MARKET ST', '3 MARKET ST', '2 MARKET ST', '1 MARKET ST', '0 MARKET ST'
+        ])
+
+    def test_address_frequency_streams_under_wsgi(self):
+        response = self.client.get(reverse('api-address-frequency'), {'stream': 'true'})
+
+        self.assertTrue(response.streaming)
+        self.assertEqual(len(json.loads(b''.join(response.streaming_content))["data"]), 5)
+
+    def test_neighborhood_calls(self):
+        status, body = asgi_get(reverse('api-calls-neighborhood'), 'name=Mission&stream=true')
+
+        self.assertEqual(status, 200)
+        document = json.loads(body)
+        self.assertEqual(document["neighborhood"], 'Mission')
+        self.assertEqual(document["data"], [])
+        self.assertIsNone(document["next_offset"])
@@ -0,0 +1,183 @@
+import hashlib
+import os
+import shutil
+
+from django.conf import settings
+from django.db import connection
+
+from metrics.filters import get_list_param, parse_date_param
+from metrics.models import Call
+
+# Half the width of the Web Mercator (EPSG:3857) world in meters
+MERCATOR_ORIGIN = 20037508.342789244
+
+# Tile extent and buffer in tile coordinate units
+TILE_EXTENT = 4096
+TILE_BUFFER = 64
+
+MAX_ZOOM = 22
+
+# Lowest zoom served; a tile below it would hold most of the city's calls.
+# Lower zooms are better served by the heatmap grid.
+MIN_ZOOM = 12
+
+# Most calls in one tile, newest first
+MAX_FEATURES = 10000
+
+def get_zoom_range():
+    """
+    Returns the (min, max) zoom levels served, with the minimum from the
+    TILE_MIN_ZOOM setting.
+    """
+    return getattr(settings, 'TILE_MIN_ZOOM', MIN_ZOOM), MAX_ZOOM
+
+def tile_envelope(z, x, y):
+    """
+    Returns the (xmin, ymin, xmax, ymax) Web Mercator bounds of a tile.
+    """
+    size = 2 * MERCATOR_ORIGIN / (2 ** z)
+    xmin = -MERCATOR_ORIGIN + x * size
+    ymax = MERCATOR_ORIGIN - y * size
+
+    return xmin, ymax - size, xmin + size, ymax
+
+def get_tile_filters(params):
+    """
+    Returns the normalized tile filters from the call_type_group, battalion,
+    start_date and end_date request parameters. Raises a ValueError for
+    invalid dates.
+    """
+    return {
+        "call_type_group": sorted(get_list_param(params, 'call_type_group')),
+        "battalion": sorted(get_list_param(params, 'battalion')),
+        "start_date": parse_date_param(params, 'start_date'),
+        "end_date": parse_date_param(params, 'end_date')
+    }
+
+def render_tile(z, x, y, filters):
+    """
+    Returns the Mapbox Vector Tile bytes for the calls in a tile, with one
+    "calls" layer of points. Dense tiles keep the newest TILE_MAX_FEATURES
+    calls.
+    """
+    envelope = tile_envelope(z, x, y)
+    where = []
+    params = list(envelope) + list(envelope)
+
+    for field in ('call_type_group', 'battalion'):
+        if filters[field]:
+            where.append('{0} = ANY(%s)'.format(field))
+            params.append(filters[field])
+
+    if filters["start_date"]:
+        where.append('call_date >= %s')
+        params.append(filters["start_date"])
+
+    if filters["end_date"]:
+        where.append('call_date <= %s')
+        params.append(filters["end_date"])
+
+    sql = (
+        'SELECT ST_AsMVT(tile, \'calls\', {extent}, \'geom\') FROM ('
+        'SELECT ST_AsMVTGeom(ST_Transform(point, 3857), '
+        'ST_MakeEnvelope(%s, %s, %s, %s, 3857), {extent}, {buffer}, true) AS geom, '
+        'id, call_type, call_type_group, unit_type, battalion, call_date::text AS call_date '
+        'FROM {table} '
+        'WHERE point && ST_Transform(ST_MakeEnvelope(%s, %s, %s, %s, 3857), 4326) {filters} '
+        'ORDER BY call_date DESC LIMIT %s'
+        ') AS tile WHERE geom IS NOT NULL'
+    ).format(
+        extent=TILE_EXTENT, buffer=TILE_BUFFER,
+        table=connection.ops.quote_name(Call._meta.db_table),
+        filters=''.join(' AND ' + w for w in where)
+    )
+
+    params.append(getattr(settings, 'TILE_MAX_FEATURES', MAX_FEATURES))
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        tile = cursor.fetchone()[0]
+
+    return bytes(tile) if tile else b''
+
+class TileCache:
+    """
+    On-disk cache of rendered tiles. Tiles are stored under a directory per
+    dataset version, and directories of older versions are removed the
+    first time a tile is stored for a newer version.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.purged_version = None
+
+    def get_path(self, version, filters, z, x, y):
+        """
+        Returns the file path of a tile.
+        """
+        key = hashlib.sha1(repr(sorted(filters.items())).encode('utf-8')).hexdigest()[:16]
+        return os.path.join(
+            self.directory, str(version), key, str(z), str(x), '{0}.mvt'.format(y)
+        )
+
+    def get(self, path):
+        """
+        Returns the cached tile bytes at a path, or None.
+        """
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def set(self, path, version, tile):
+        """
+        Stores tile bytes at a path, written to a temporary file and renamed
+        so readers never see a partial tile.
+        """
+        if self.purged_version is None or self.purged_version < version:
+            self.purge(version)
+
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+
+            with open(temp_path, 'wb') as f:
+                f.write(tile)
+
+            os.replace(temp_path, path)
+        except OSError:
+            # The cache is best effort; the tile is still served
+            pass
+
+    def purge(self, version):
+        """
+        Removes the tiles of the dataset versions older than a version. A
+        worker still on an older version, which it caches for a few seconds,
+        must not remove a newer version's tiles.
+        """
+        self.purged_version = version
+
+        if not os.path.isdir(self.directory):
+            return
+
+        for name in os.listdir(self.directory):
+            if name.isdigit() and int(name) < version:
+                shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+
+_tile_cache = None
+
+def get_tile_cache():
+    """
+    Returns the shared tile cache, or None if TILE_CACHE_DIR is not set.
+    """
+    global _tile_cache
+
+    directory = getattr(settings, 'TILE_CACHE_DIR', None)
+    if not directory:
+        return None
+
+    if _tile_cache is None:
+        _tile_cache = TileCache(directory)
+
+    return _tile_cache
@@ -1,14 +1,31 @@
+from django.conf import settings
 from django.shortcuts import render
 from django.views.generic import View
-from django.http import JsonResponse
-from django.db.models import Avg, Count, F
-from metrics.models import Call
-from geopy.geocoders import Nominatim
-from django.contrib.gis import geos
-from django.contrib.gis.measure import D
-from datetime import datetime, timedelta
-
-class NearbyView(View):
+from django.http import HttpResponse, JsonResponse
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt
+from metrics.cache import get_dataset_version
+from metrics.asynchronous import AsyncView, run_in_pool
+from metrics.columnar import get_snapshot
+from metrics.cube import query_cube
+from metrics.filters import filter_calls
+from metrics.models import AddressStats, Call, GridCell, Neighborhood
+from metrics.rollups import cell_size, get_zoom_levels
+from datetime import datetime
+import asyncio
+import json
+import math
+
+from .geocoding import GeocoderError, get_geocoder, normalize_address
+from .lookup import top_unit_type
+from .nearby import batch_nearby_unit_types
+from .streaming import json_array_response, json_prefix, wants_stream
+from .tiles import get_tile_cache, get_tile_filters, get_zoom_range, render_tile
+
+# Largest time of day window, in hours either side of the given time
+MAX_DELTA_HOURS = 12
+
+class NearbyView(AsyncView):
 
     def parse_timestamp(self, text):
         """
@@ -30,33 +47,87 @@ class NearbyView(View):
 
         raise ValueError('Invalid timestamp format.')
 
-    def post(self, request):
+    def parse_delta_hours(self, value):
+        """
+        Returns the delta_hours parameter as a float. Raises a ValueError if
+        it's not a number between 0 and MAX_DELTA_HOURS.
+        """
+        delta_hours = float(value)
+
+        # Also rejects infinity and NaN, which compare false to everything
+        if not 0 <= delta_hours <= MAX_DELTA_HOURS:
+            raise ValueError('Invalid delta hours provided.')
+
+        return delta_hours
+
+    def parse_radius(self, value):
+        """
+        Returns the radius parameter, given in miles, in meters. Raises a
+        ValueError if it's not a number greater than 0 and at most
+        NEARBY_MAX_RADIUS miles.
+        """
+        radius = float(value)
+
+        # Also rejects infinity and NaN, which compare false to everything
+        if not 0 < radius <= getattr(settings, 'NEARBY_MAX_RADIUS', 5):
+            raise ValueError('Invalid radius provided.')
+
+        return radius * 1609.34
+
+    def complete_address(self, address):
+        """
+        Appends the city and state if only an address line is provided.
+        """
+        if ',' not in address and 'San Francisco' not in address:
+            address += ', San Francisco, CA'
+
+        return address
+
+    async def post(self, request):
         """
         Post request receiver function for getting the most-likely dispatch type
         given an address and timestamp. A radius is also provided to adjust the
         accuracy of the result.s
+
+        The geocoder request runs in the geocoder's thread pool and the
+        spatial query in the shared one, so the event loop keeps serving
+        other requests meanwhile.
         """
         response = None
         address = request.POST.get("address")
 
         # Check if an address was provided
         if address:
-            # Append city and state if only address line provided
-            if ',' not in address and 'San Francisco' not in address:
-                address += ', San Francisco, CA'
+            address = self.complete_address(address)
 
-            # Get location from address
-            geolocator = Nominatim(scheme='http')
-            location = geolocator.geocode(address)
+            # Get location from address, using the cached geocoder
+            try:
+                location = await get_geocoder().geocode_async(address)
+            except GeocoderError:
+                # Geocoder timed out, rate limited or down, 503 Service Unavailable
+                return JsonResponse(
+                    {
+                        'status': 'false',
+                        'message': 'Geocoder unavailable, try again later.'
+                    },
+                    status=503
+                )
 
             if location:
                 # Get radius from params, or set to default
                 # of 1 mile and convert to meters.
-                radius = float(request.POST.get("radius", 1.0)) * 1609.34
-
-                # Parse the source location and radius into the correct format
-                source_location = geos.fromstr('POINT({0} {1})'.format(location.longitude, location.latitude))
-                desired_radius = {'m': radius}
+                try:
+                    radius = self.parse_radius(request.POST.get("radius", 1.0))
+                    delta_hours = self.parse_delta_hours(request.POST.get("delta_hours", 2))
+                except ValueError:
+                    # Invalid radius or delta provided, 400 Bad Request
+                    return JsonResponse(
+                        {
+                            'status': 'false',
+                            'message': 'Invalid radius or delta hours provided.'
+                        },
+                        status=400
+                    )
 
                 # Time parameter for query
                 time = request.POST.get("time")
@@ -76,32 +147,17 @@ class NearbyView(View):
                             status=400
                         )
 
-                    delta_hours = request.POST.get("delta_hours", 2)
-                    delta_hours = timedelta(hours=delta_hours)
-
-                    time_minus_delta = (time - delta_hours).hour
-                    time_plus_delta = (time + delta_hours).hour
-
-                    min_time = min(time_minus_delta, time_plus_delta)
-                    max_time = max(time_minus_delta, time_plus_delta)
-                    
-                    # Get calls in the time range
-                    time_range_calls = Call.objects.filter(
-                        received_timestamp__hour__gte=min_time,
-                                    received_timestamp__hour__lte=max_time)                 
-
-                    # Get the nearby calls and group by unit_type
-                    # sorted by the counts in descending order.
-                    nearby_calls = time_range_calls.filter(
-                        point__distance_lte=(
-                            source_location, D(**desired_radius)
-                        )
-                    ).values('unit_type').annotate(
-                        count=Count('unit_type')
-                    ).order_by('-count')
+                    # Get the most common unit_type of the nearby calls in the
+                    # time of day window, from the precomputed unit_type index
+                    # when enabled or else the spatial query. The window is
+                    # matched on the minute of day and wraps around midnight.
+                    top_call = await run_in_pool(
+                        top_unit_type, location, radius,
+                        time.hour * 60 + time.minute, int(delta_hours * 60)
+                    )
 
                     # Check if calls found calls found
-                    if not nearby_calls:
+                    if not top_call:
                         # No calls found, 400 Bad Request
                         return JsonResponse(
                             {
@@ -112,8 +168,8 @@ class NearbyView(View):
                         )
                     
                     # Create the results data
-                    max_type = nearby_calls[0]["unit_type"] if nearby_calls[0] else None
-                    max_type_calls = nearby_calls[0]["count"] if nearby_calls[0] else None
+                    max_type = top_call["unit_type"]
+                    max_type_calls = top_call["count"]
 
                     # Create JSON response
                     response = JsonResponse(
@@ -155,16 +211,195 @@ class NearbyView(View):
 
         return response
 
+@method_decorator(csrf_exempt, name='dispatch')
+class NearbyBatchView(NearbyView):
+    """
+    Batch variant of NearbyView for planning jobs. Each address is geocoded
+    once however many times it appears, and every prediction is answered by
+    a single set-based query. Requests come from scripts rather than the
+    site, so they are exempt from CSRF checks.
+    """
+
+    def parse_query(self, item):
+        """
+        Returns the (address, radius, minute, delta_minutes) of one batch item,
+        with the radius in meters. Raises a ValueError for an invalid item.
+        """
+        if not isinstance(item, dict):
+            raise ValueError('Each item must be an object.')
+
+        address = item.get("address")
+        if not address or not isinstance(address, str):
+            raise ValueError('No address provided.')
+
+        time = item.get("time")
+        if not time or not isinstance(time, str):
+            raise ValueError('No time provided.')
+
+        try:
+            time = self.parse_timestamp(time)
+        except ValueError:
+            raise ValueError('Invalid timestamp provided.')
+
+        try:
+            radius = self.parse_radius(item.get("radius", 1.0))
+            delta_hours = self.parse_delta_hours(item.get("delta_hours", 2))
+        except (TypeError, ValueError):
+            raise ValueError('Invalid radius or delta hours provided.')
+
+        return (
+            self.complete_address(address), radius,
+            time.hour * 60 + time.minute, int(delta_hours * 60)
+        )
+
+    async def geocode_all(self, addresses):
+        """
+        Returns a dict of the Location, or None, of each address. Up to
+        NEARBY_BATCH_GEOCODE_CONCURRENCY addresses are geocoded at a time,
+        and the batch stops waiting after NEARBY_BATCH_GEOCODE_TIMEOUT
+        seconds. Addresses the geocoder can't answer right now or in time
+        map to a GeocoderError.
+        """
+        geocoder = get_geocoder()
+        semaphore = asyncio.Semaphore(getattr(settings, 'NEARBY_BATCH_GEOCODE_CONCURRENCY', 8))
+
+        async def geocode(address):
+            async with semaphore:
+                return await geocoder.geocode_async(address)
+
+        tasks = {address: asyncio.ensure_future(geocode(address)) for address in addresses}
+        pending = set()
+
+        if tasks:
+            done, pending = await asyncio.wait(
+                tasks.values(), timeout=getattr(settings, 'NEARBY_BATCH_GEOCODE_TIMEOUT', 30)
+            )
+
+            # Addresses left when the time is up are not geocoded
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        locations = {}
+
+        for address, task in tasks.items():
+            if task in pending:
+                locations[address] = GeocoderError('Geocoder timed out.')
+            elif isinstance(task.exception(), GeocoderError):
+                locations[address] = task.exception()
+            else:
+                locations[address] = task.result()
+
+        return locations
+
+    async def post(self, request):
+        """
+        Post request receiver function for getting the most-likely dispatch type
+        of many addresses and times at once. The request body is a JSON array
+        of objects with the address, time, radius and delta_hours parameters of
+        the nearby API.
+
+        Results are returned in input order. An item that can't be answered
+        gets its own status and message instead of failing the whole batch.
+        """
+        try:
+            items = json.loads(request.body.decode('utf-8'))
+        except ValueError:
+            items = None
+
+        # Check a JSON array was provided
+        if not isinstance(items, list):
+            return JsonResponse(
+                {
+                    'status': 'false',
+                    'message': 'Request body must be a JSON array.'
+                },
+                status=400
+            )
+
+        max_size = getattr(settings, 'NEARBY_BATCH_MAX_SIZE', 5000)
+        if len(items) > max_size:
+            return JsonResponse(
+                {
+                    'status': 'false',
+                    'message': 'Batches are limited to {0} items.'.format(max_size)
+                },
+                status=400
+            )
+
+        # Parse every item, keeping the first address spelling of each
+        # normalized address to geocode.
+        parsed = []
+        addresses = {}
+
+        for item in items:
+            try:
+                query = self.parse_query(item)
+            except ValueError as e:
+                parsed.append(str(e))
+                continue
+
+            key = normalize_address(query[0])
+            addresses.setdefault(key, query[0])
+            parsed.append((key,) + query[1:])
+
+        locations = await self.geocode_all(list(addresses.values()))
+        locations = {key: locations[address] for key, address in addresses.items()}
+
+        # Identical queries are only answered once
+        queries = []
+        positions = {}
+
+        for query in parsed:
+            location = locations[query[0]] if isinstance(query, tuple) else None
+            if isinstance(location, tuple) and query not in positions:
+                positions[query] = len(queries)
+                queries.append((locations[query[0]],) + query[1:])
+
+        matches = await run_in_pool(batch_nearby_unit_types, queries)
+
+        # Create the results data in input order
+        data = []
+
+        for query in parsed:
+            if not isinstance(query, tuple):
+                data.append({'status': 'false', 'message': query})
+            elif isinstance(locations[query[0]], GeocoderError):
+                data.append({'status': 'false', 'message': 'Geocoder unavailable, try again later.'})
+            elif not locations[query[0]]:
+                data.append({'status': 'false', 'message': 'Invalid address.'})
+            elif not matches[positions[query]]:
+                data.append({'status': 'false', 'message': 'No data found for given address.'})
+            else:
+                unit_type, count = matches[positions[query]]
+                data.append({
+                    'status': 'true',
+                    'unit_type_match': unit_type,
+                    'unit_type_match_count': count
+                })
+
+        return JsonResponse({"status": "true", "data": data})
+
+class GeocoderStats(View):
+
+    def get(self, request):
+        """
+        Returns JSON representing the geocoder cache hit/miss counters.
+        """
+        return JsonResponse(
+            {
+                'status': 'true',
+                'data': get_geocoder().stats()
+            }
+        )
+
 class LongestDispatch(View):
 
     def get(self, request):
-        # Get a set of calls grouped by address  
-        calls = Call.objects.values('address').annotate(
-            count=Count('pk'),
-            latitude=Avg('latitude'),
-            longitude=Avg('longitude'),
-            incidents=Count('incident_number', distinct=True),
-            avg_dispatch_time=Avg(F('dispatch_timestamp') - F('received_timestamp'))
+        # Get the addresses with the longest average dispatch time from
+        # the per-address rollup
+        calls = AddressStats.objects.exclude(
+            avg_dispatch_time=None
         ).order_by('-avg_dispatch_time')[:750]
         
         # Prepare the data for the JSON response
@@ -172,13 +407,13 @@ class LongestDispatch(View):
         for call in calls:
             data.append(
                 {
-                    "address": call["address"],
-                    "lat": call["latitude"],
-                    "lng": call["longitude"],
+                    "address": call.address,
+                    "lat": call.latitude,
+                    "lng": call.longitude,
                     # Convert avg_dispatch_time to a string and remove millis
-                    "avg_dispatch_time": str(call["avg_dispatch_time"]).split(".")[0],
-                    "incident_count": call["incidents"],
-                    "count": call["count"]
+                    "avg_dispatch_time": str(call.avg_dispatch_time).split(".")[0],
+                    "incident_count": call.incidents,
+                    "count": call.calls
                 }
             )
 
@@ -192,35 +427,156 @@ class LongestDispatch(View):
 
 class AddressFrequency(View):
 
+    # Columns of the compact arrays format
+    ARRAY_COLUMNS = ["address", "count", "lat", "lng"]
+
     def get(self, request):
         """
         Retrieves the frequency of all addresses in the calls database.
+
+        The format parameter selects the payload: "objects" (default) for a
+        list of objects, "arrays" for a list of [address, count, lat, lng]
+        arrays, or "geojson" for a FeatureCollection of points. With
+        stream=true the JSON is written incrementally as rows are read from a
+        server-side cursor, except under ASGI (see wants_stream).
         """
         # The minimum number of calls necessary for an address to be included
         cutoff_value = request.GET.get('cutoff_value', 4)
+        data_format = request.GET.get('format', 'objects')
+
+        try:
+            cutoff_value = int(cutoff_value)
+        except ValueError:
+            # Invalid cutoff provided, 400 Bad Request
+            return JsonResponse(
+                {
+                    'status': 'false',
+                    'message': 'Invalid cutoff value.'
+                },
+                status=400
+            )
 
-        # Gets calls grouped by address and takes an average of the latitude
-        # and longitude values for the heatmap. Only addresses with call counts
-        # greater than or equal to the cutoff value are included.
-        addresses = Call.objects.values('address').annotate(
-            count=Count('pk'),
-            latitude=Avg('latitude'),
-            longitude=Avg('longitude')
-        ).filter(count__gte=cutoff_value).order_by('-count')
+        if data_format not in ('objects', 'arrays', 'geojson'):
+            # Unknown format, 400 Bad Request
+            return JsonResponse(
+                {
+                    'status': 'false',
+                    'message': 'Invalid format.'
+                },
+                status=400
+            )
 
-        # Generate the results list from the query set
-        data = []
-        for address in addresses:
-            data.append(
+        # Gets the per-address rollup, which holds the call count and average
+        # latitude and longitude values for the heatmap. Only addresses with
+        # call counts greater than or equal to the cutoff value are included.
+        addresses = AddressStats.objects.filter(
+            calls__gte=cutoff_value
+        ).order_by('-calls').values_list(
+            'address', 'calls', 'latitude', 'longitude'
+        ).iterator(chunk_size=2000)
+
+        # Generate the results from the query set as they are read
+        if data_format == 'arrays':
+            prefix, suffix = json_prefix(
+                {'status': 'true', 'columns': self.ARRAY_COLUMNS}, 'data'
+            )
+            items = (
+                [address, count, float(lat), float(lng)]
+                for address, count, lat, lng in addresses
+            )
+        elif data_format == 'geojson':
+            prefix, suffix = json_prefix({'type': 'FeatureCollection'}, 'features')
+            items = (
+                {
+                    "type": "Feature",
+                    "geometry": {
+                        "type": "Point",
+                        "coordinates": [float(lng), float(lat)]
+                    },
+                    "properties": {
+                        "address": address,
+                        "count": count
+                    }
+                }
+                for address, count, lat, lng in addresses
+            )
+        else:
+            prefix, suffix = json_prefix({'status': 'true'}, 'data')
+            items = (
                 {
-                    "address": address["address"],
-                    "count": address["count"],
-                    "lat": address["latitude"],
-                    "lng": address["longitude"]
+                    "address": address,
+                    "count": count,
+                    "lat": lat,
+                    "lng": lng
                 }
+                for address, count, lat, lng in addresses
             )
 
         # Return the JSON data
+        return json_array_response(request, prefix, items, suffix)
+
+class GridCells(View):
+
+    def get(self, request):
+        """
+        Returns the pre-binned call counts for the grid cells inside a
+        bounding box. Parameters are bbox (min_lng,min_lat,max_lng,max_lat)
+        and zoom. When the box would hold more than GRID_MAX_CELLS cells at
+        the requested zoom, a coarser zoom level is used instead.
+        """
+        try:
+            min_lng, min_lat, max_lng, max_lat = [
+                float(v) for v in request.GET.get('bbox', '').split(',')
+            ]
+            zoom = int(request.GET.get('zoom', 13))
+
+            # Infinite or NaN coordinates can't be mapped to cells
+            if not all(math.isfinite(v) for v in (min_lng, min_lat, max_lng, max_lat)):
+                raise ValueError()
+
+            if min_lng > max_lng or min_lat > max_lat:
+                raise ValueError()
+        except ValueError:
+            # Invalid bbox or zoom provided, 400 Bad Request
+            return JsonResponse(
+                {
+                    'status': 'false',
+                    'message': 'Invalid bbox or zoom provided.'
+                },
+                status=400
+            )
+
+        levels = sorted(get_zoom_levels())
+        max_cells = getattr(settings, 'GRID_MAX_CELLS', 5000)
+
+        # Use the deepest built zoom level that keeps the payload bounded
+        zoom = max([z for z in levels if z <= zoom] or levels[:1])
+        while zoom > levels[0]:
+            size = cell_size(zoom)
+            cells = ((max_lng - min_lng) / size + 1) * ((max_lat - min_lat) / size + 1)
+
+            if cells <= max_cells:
+                break
+
+            zoom = max(z for z in levels if z < zoom)
+
+        size = cell_size(zoom)
+        cells = GridCell.objects.filter(
+            zoom=zoom,
+            x__gte=math.floor(min_lng / size), x__lte=math.floor(max_lng / size),
+            y__gte=math.floor(min_lat / size), y__lte=math.floor(max_lat / size)
+        ).values_list('calls', 'latitude_sum', 'longitude_sum')[:max_cells]
+
+        # Each cell is drawn at the centroid of its calls
+        data = {
+            "zoom": zoom,
+            "cell_size": size,
+            "cells": [
+                [round(lat_sum / count, 6), round(lng_sum / count, 6), count]
+                for count, lat_sum, lng_sum in cells
+            ]
+        }
+
         return JsonResponse(
             {
                 'status': 'true',
@@ -228,25 +584,73 @@ class AddressFrequency(View):
             }
         )
 
+class CallTile(View):
+
+    def get(self, request, z, x, y):
+        """
+        Returns a Mapbox Vector Tile of the calls in tile z/x/y, optionally
+        filtered by call_type_group, battalion, start_date and end_date.
+        Rendered tiles are cached on disk until the dataset changes. Zoom
+        levels below TILE_MIN_ZOOM are not served.
+        """
+        z, x, y = int(z), int(x), int(y)
+        min_zoom, max_zoom = get_zoom_range()
+
+        if not min_zoom <= z <= max_zoom or x >= 2 ** z or y >= 2 ** z:
+            return HttpResponse(status=404)
+
+        try:
+            filters = get_tile_filters(request.GET)
+        except ValueError as e:
+            # Invalid date provided, 400 Bad Request
+            return JsonResponse(
+                {
+                    'status': 'false',
+                    'message': str(e)
+                },
+                status=400
+            )
+
+        version, updated = get_dataset_version()
+        cache = get_tile_cache()
+        path = cache.get_path(version, filters, z, x, y) if cache else None
+        tile = cache.get(path) if cache else None
+
+        if tile is None:
+            tile = render_tile(z, x, y, filters)
+
+            if cache:
+                cache.set(path, version, tile)
+
+        return HttpResponse(tile, content_type='application/vnd.mapbox-vector-tile')
+
 class SafestNeighborhoods(View):
 
     def get(self, request):
         """
         Returns JSON representing a list of each neighborhood and the number
-        of calls.
+        of calls. With approx=true the incidents are estimated from the
+        incident sketches.
         """
+        approx = request.GET.get('approx') == 'true'
+
         # Excluded call types (non-dangerous)
         excluded_types = [
             "Citizen Assist / Service Call"
         ]
 
         # Gets calls grouped by neighborhood and sorted by number of calls
-        calls = Call.objects.exclude(
-            call_type__in=excluded_types
-        ).values('neighborhood_district').annotate(
-            calls=Count('pk'),
-            incidents=Count('incident_number', distinct=True)
-        ).order_by('incidents')
+        snapshot = get_snapshot()
+        if snapshot and not approx:
+            calls = snapshot.neighborhood_totals(excluded_types)
+        else:
+            calls = sorted(
+                query_cube(
+                    ['neighborhood_district'], ['calls', 'incidents'],
+                    exclude={'call_type': excluded_types}, approx=approx
+                ),
+                key=lambda c: c["incidents"]
+            )
         
         # Populates the data list for the JSON response
         data = []
@@ -273,11 +677,14 @@ class Neighborhoods(View):
         """
         Returns JSON representing a list of the neighborhoods/districts.
         """
-        # Gets list of neighborhoods
-        neighborhoods = Call.objects.values('neighborhood_district').distinct().order_by('neighborhood_district')
-        
-        # Populates the data list for the JSON response
-        data = [n["neighborhood_district"] for n in neighborhoods]
+        # Gets list of neighborhoods from the loaded polygons
+        data = list(Neighborhood.objects.order_by('name').values_list('name', flat=True))
+
+        # Falls back to the neighborhoods of the calls until the polygons
+        # are loaded
+        if not data:
+            neighborhoods = Call.objects.values('neighborhood_district').distinct().order_by('neighborhood_district')
+            data = [n["neighborhood_district"] for n in neighborhoods]
 
         return JsonResponse(
             {
@@ -303,4 +710,112 @@ class Battalions(View):
                 'status': 'true',
                 'data': data
             }
-        )
\ No newline at end of file
+        )
+
+class NeighborhoodCalls(View):
+
+    def get(self, request):
+        """
+        Returns JSON representing the calls whose point lies within a
+        neighborhood's polygon, newest first. Parameters are name, and
+        optionally battalion, start_date and end_date. Calls are returned a
+        page at a time: limit calls (default NEIGHBORHOOD_CALLS_PAGE_SIZE, at
+        most NEIGHBORHOOD_CALLS_MAX_PAGE_SIZE) from offset, with the offset
+        of the next page in next_offset. With stream=true the JSON is written
+        incrementally as rows are read, and every call from offset is
+        returned unless a limit is given. Under ASGI stream=true is ignored
+        (see wants_stream) and the calls are paged.
+        """
+        name = request.GET.get('name')
+        stream = wants_stream(request)
+
+        try:
+            offset = int(request.GET.get('offset', 0))
+            limit = request.GET.get('limit')
+            limit = int(limit) if limit else None
+
+            if offset < 0 or (limit is not None and limit < 1):
+                raise ValueError()
+        except ValueError:
+            # Invalid offset or limit provided, 400 Bad Request
+            return JsonResponse(
+                {
+                    'status': 'false',
+                    'message': 'Invalid offset or limit provided.'
+                },
+                status=400
+            )
+
+        # Responses that aren't streamed are built in memory and cached, so
+        # their size is bounded
+        if not stream:
+            limit = min(
+                limit or getattr(settings, 'NEIGHBORHOOD_CALLS_PAGE_SIZE', 1000),
+                getattr(settings, 'NEIGHBORHOOD_CALLS_MAX_PAGE_SIZE', 10000)
+            )
+
+        try:
+            neighborhood = Neighborhood.objects.get(name=name)
+        except Neighborhood.DoesNotExist:
+            # Unknown neighborhood, 400 Bad Request
+            return JsonResponse(
+                {
+                    'status': 'false',
+                    'message': 'Invalid neighborhood.'
+                },
+                status=400
+            )
+
+        # Matched by the point's GiST index against the polygon, rather than
+        # by the assigned neighborhood_district
+        try:
+            calls = filter_calls(
+                Call.objects.filter(point__within=neighborhood.geometry), request.GET
+            )
+        except ValueError as e:
+            # Invalid dates provided, 400 Bad Request
+            return JsonResponse(
+                {
+                    'status': 'false',
+                    'message': str(e)
+                },
+                status=400
+            )
+
+        calls = calls.order_by('-received_timestamp', '-id').values_list(
+            'incident_number', 'call_type', 'received_timestamp', 'address',
+            'unit_type', 'latitude', 'longitude'
+        )
+        next_offset = None
+
+        if stream:
+            calls = calls[offset:offset + limit] if limit else calls[offset:]
+            calls = calls.iterator(chunk_size=2000)
+        else:
+            # One more call than the page tells whether there's a next page
+            calls = list(calls[offset:offset + limit + 1])
+
+            if len(calls) > limit:
+                calls = calls[:limit]
+                next_offset = offset + limit
+
+        document = {'status': 'true', 'neighborhood': neighborhood.name, 'offset': offset}
+        if not stream:
+            document.update(limit=limit, next_offset=next_offset)
+
+        prefix, suffix = json_prefix(document, 'data')
+        items = (
+            {
+                "incident_number": incident,
+                "call_type": call_type,
+                "received_timestamp": received,
+                "address": address,
+                "unit_type": unit_type,
+                "lat": float(lat),
+                "lng": float(lng)
+            }
+            for incident, call_type, received, address, unit_type, lat, lng in calls
+        )
+
+        # Return the JSON data
+        return json_array_response(request, prefix, items, suffix)
@@ -41,6 +41,7 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'django.contrib.gis',
     'metrics',
+    'api',
 ]
 
 MIDDLEWARE = [
@@ -75,11 +76,18 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'dispatch.wsgi.application'
+ASGI_APPLICATION = 'dispatch.asgi.application'
 
 
 # Database
 # https://docs.djangoproject.com/en/2.0/ref/settings/#databases
 
+# Seconds to keep database connections open between requests. Async views
+# run their queries in a pool of API_THREAD_POOL_SIZE threads, each holding
+# one persistent connection.
+CONN_MAX_AGE = int(os.environ.get('DATABASE_CONN_MAX_AGE', 600))
+API_THREAD_POOL_SIZE = int(os.environ.get('API_THREAD_POOL_SIZE', 20))
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.contrib.gis.db.backends.postgis',
@@ -88,6 +96,7 @@ DATABASES = {
         'PASSWORD': os.environ['DATABASE_PASS'],
         'HOST': os.environ['DATABASE_HOST'],
         'PORT': os.environ['DATABASE_PORT'],
+        'CONN_MAX_AGE': CONN_MAX_AGE,
     }
 }
 
@@ -140,6 +149,77 @@ STATICFILES_FINDERS = (
     'django.contrib.staticfiles.finders.AppDirectoriesFinder',
 )
 
+# Cached API responses are invalidated when the dataset version changes. The
+# version is re-read from the database every DATASET_VERSION_TTL seconds.
+# Responses are kept in an in-process LRU of RESPONSE_CACHE_SIZE entries, and
+# also in the CACHES entry named by RESPONSE_CACHE_ALIAS if set (e.g. a
+# FileBasedCache or DatabaseCache shared by all workers).
+DATASET_VERSION_TTL = 5
+RESPONSE_CACHE_SIZE = 256
+RESPONSE_CACHE_ALIAS = None
+
+# Answer the dashboard metrics from an in-process columnar snapshot of the
+# calls table instead of the database. The snapshot is reloaded when the
+# dataset version changes.
+ANALYTICS_SNAPSHOT = os.environ.get('ANALYTICS_SNAPSHOT', '') == 'True'
+
+# Snapshot file written by the write_snapshot command. Workers memory map it
+# when it matches the current dataset version instead of reading the calls
+# table.
+ANALYTICS_SNAPSHOT_PATH = os.environ.get('ANALYTICS_SNAPSHOT_PATH')
+
+# Zoom levels the heatmap grid rollup is built for, and the most cells the
+# grid API returns for one bounding box.
+GRID_ZOOM_LEVELS = list(range(10, 19))
+GRID_MAX_CELLS = 5000
+
+# Directory for rendered vector tiles. Tiles of older dataset versions are
+# removed as new ones are rendered. Set to None to disable the cache.
+TILE_CACHE_DIR = os.environ.get('TILE_CACHE_DIR', os.path.join(BASE_DIR, 'tile_cache'))
+
+# Lowest zoom level served as vector tiles, and the most calls in one tile
+TILE_MIN_ZOOM = 12
+TILE_MAX_FEATURES = 10000
+
+# Geocoder used by the nearby calls API. Results are cached in memory (LRU of
+# GEOCODER_CACHE_SIZE addresses) and in the database, and addresses already in
+# the calls table are resolved offline by the gazetteer.
+GEOCODER_BACKEND = 'api.geocoding.NominatimGeocoder'
+GEOCODER_CACHE_SIZE = 1024
+GEOCODER_USE_GAZETTEER = True
+# Network geocoder requests run in their own pool of GEOCODER_THREAD_POOL_SIZE
+# threads, apart from the database queries, and time out after
+# GEOCODER_TIMEOUT seconds.
+GEOCODER_THREAD_POOL_SIZE = 8
+GEOCODER_TIMEOUT = 10
+
+# Answer the nearby API from a memory-resident grid cell x hour of day
+# histogram of unit types instead of a spatial query, for radii up to
+# UNIT_TYPE_INDEX_MAX_RADIUS meters. The index is reloaded when the dataset
+# version changes, from the file written by build_unit_type_index when it
+# matches.
+UNIT_TYPE_INDEX = os.environ.get('UNIT_TYPE_INDEX', '') == 'True'
+UNIT_TYPE_INDEX_PATH = os.environ.get('UNIT_TYPE_INDEX_PATH')
+UNIT_TYPE_INDEX_CELL_METERS = 100
+# (min longitude, min latitude, max longitude, max latitude) covered by the
+# index; calls outside are left out
+UNIT_TYPE_INDEX_BOUNDS = (-122.53, 37.69, -122.34, 37.84)
+UNIT_TYPE_INDEX_MAX_RADIUS = 3219
+
+# Calls per page of the neighborhood calls API, by default and at most
+NEIGHBORHOOD_CALLS_PAGE_SIZE = 1000
+NEIGHBORHOOD_CALLS_MAX_PAGE_SIZE = 10000
+
+# Largest radius, in miles, of the nearby API
+NEARBY_MAX_RADIUS = 5
+
+# Maximum number of items in a batch nearby request
+NEARBY_BATCH_MAX_SIZE = 5000
+# Addresses of a batch geocoded at a time, and the seconds a batch waits for
+# its addresses to be geocoded; later addresses get per-item errors
+NEARBY_BATCH_GEOCODE_CONCURRENCY = 8
+NEARBY_BATCH_GEOCODE_TIMEOUT = 30
+
 # GeoDjango library paths for Heroku
 GDAL_LIBRARY_PATH = os.environ.get('GDAL_LIBRARY_PATH')
 GEOS_LIBRARY_PATH = os.environ.get('GEOS_LIBRARY_PATH')
@@ -148,5 +228,5 @@ django_heroku.settings(locals())
 
 # Update the database information for Heroku
 if 'UPDATE_DATABASE_ENGINE' in os.environ and os.environ['UPDATE_DATABASE_ENGINE']:
-    DATABASES['default'] = dj_database_url.config()
+    DATABASES['default'] = dj_database_url.config(conn_max_age=CONN_MAX_AGE)
     DATABASES['default']['ENGINE'] = 'django.contrib.gis.db.backends.postgis'
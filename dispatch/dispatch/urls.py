@@ -16,10 +16,13 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path
 from django.conf.urls import url
+from metrics.cache import cache_response
 from metrics.views import (AverageCallsPerHour, AverageResponseTime,
-    BattalionDistribution, Home, Heatmaps, IncidentMetrics, NeighborhoodTrends)
-from api.views import (AddressFrequency, Battalions, NearbyView,
-    LongestDispatch, Neighborhoods, SafestNeighborhoods)
+    BattalionDistribution, Home, Heatmaps, IncidentMetrics, MetricsQuery,
+    NeighborhoodTrends)
+from api.views import (AddressFrequency, Battalions, CallTile, GeocoderStats,
+    GridCells, NearbyBatchView, NearbyView, LongestDispatch, NeighborhoodCalls, Neighborhoods,
+    SafestNeighborhoods)
 
 urlpatterns = [
     # Admin view (disabled)
@@ -30,17 +33,25 @@ urlpatterns = [
     url(r'^heatmaps$', Heatmaps.as_view(), name='heatmaps'),
     url(r'^incidents$', IncidentMetrics.as_view(), name='incident-metrics'),
 
-    # API views
-    url(r'^api/calls/address-frequency$', AddressFrequency.as_view(), name='api-address-frequency'),
-    url(r'^api/calls/nearby$', NearbyView.as_view(), name='api-calls-nearby'),
-    url(r'^api/calls/longest-dispatch$', LongestDispatch.as_view(), name='api-calls-longest-dispatch'),
-    url(r'^api/calls/safest-neighborhoods$', SafestNeighborhoods.as_view(), name='api-calls-safest-neighborhoods'),
-    url(r'^api/calls/neighborhoods$', Neighborhoods.as_view(), name='api-calls-neighborhoods'),
-    url(r'^api/calls/battalions$', Battalions.as_view(), name='api-calls-battalions'),
+    # API views, cached per dataset version
+    url(r'^api/calls/address-frequency$', cache_response(AddressFrequency.as_view()), name='api-address-frequency'),
+    url(r'^api/calls/nearby$', cache_response(NearbyView.as_view()), name='api-calls-nearby'),
+    url(r'^api/calls/nearby/batch$', NearbyBatchView.as_view(), name='api-calls-nearby-batch'),
+    url(r'^api/calls/longest-dispatch$', cache_response(LongestDispatch.as_view()), name='api-calls-longest-dispatch'),
+    url(r'^api/calls/safest-neighborhoods$', cache_response(SafestNeighborhoods.as_view()), name='api-calls-safest-neighborhoods'),
+    url(r'^api/calls/neighborhoods$', cache_response(Neighborhoods.as_view()), name='api-calls-neighborhoods'),
+    url(r'^api/calls/neighborhood$', cache_response(NeighborhoodCalls.as_view()), name='api-calls-neighborhood'),
+    url(r'^api/calls/grid$', cache_response(GridCells.as_view()), name='api-calls-grid'),
+    url(r'^api/calls/battalions$', cache_response(Battalions.as_view()), name='api-calls-battalions'),
+    url(r'^api/geocoder/stats$', GeocoderStats.as_view(), name='api-geocoder-stats'),
+
+    # Vector tiles, cached on disk per dataset version
+    url(r'^tiles/(?P<z>\d+)/(?P<x>\d+)/(?P<y>\d+)\.mvt$', CallTile.as_view(), name='tiles-calls'),
 
     # Metrics chart views
-    url(r'^api/metrics/calls-per-hour$', AverageCallsPerHour.as_view(), name='metrics-calls-per-hour'),
-    url(r'^api/metrics/battalion-dist$', BattalionDistribution.as_view(), name='metrics-battalion-dist'),
-    url(r'^api/metrics/group-response-time$', AverageResponseTime.as_view(), name='metrics-group-response-time'),
-    url(r'^api/metrics/neighborhood-trends$', NeighborhoodTrends.as_view(), name='api-calls-neighborhood-trends')
+    url(r'^api/metrics/calls-per-hour$', cache_response(AverageCallsPerHour.as_view()), name='metrics-calls-per-hour'),
+    url(r'^api/metrics/battalion-dist$', cache_response(BattalionDistribution.as_view()), name='metrics-battalion-dist'),
+    url(r'^api/metrics/group-response-time$', cache_response(AverageResponseTime.as_view()), name='metrics-group-response-time'),
+    url(r'^api/metrics/neighborhood-trends$', cache_response(NeighborhoodTrends.as_view()), name='api-calls-neighborhood-trends'),
+    url(r'^api/metrics/query$', cache_response(MetricsQuery.as_view()), name='metrics-query')
 ]
@@ -1,39 +1,31 @@
-from django.db import models
-from django.contrib.gis.geos import GEOSGeometry
-from metrics.models import Call
-import json
+from metrics.neighborhoods import NeighborhoodIndex, assign_in_python
 
-neighborhoods = json.load(open('../data/sf_neighborhoods.json'))
+_index = None
 
-MULTIPOLYGON_COL = 8 # Index for the multipolygon object
-NEIGHBORHOOD_COL = 9 # Index for the neighborhood name
-
-def populate_neighborhood_district():
+def get_index():
     """
-    Populates the neighborhood_district field for all Calls model objects using
-    the sf_neighborhoods data.
+    Returns the shared neighborhood index, building it from the
+    Neighborhood table on first use.
     """
-    calls = Call.objects.all()
+    global _index
 
-    for call in calls:
-        neighborhood = get_neighborhood(call.point)
+    if _index is None:
+        _index = NeighborhoodIndex.from_database()
 
-        if neighborhood:
-            call.neighborhood_district = neighborhood
-            call.save()
-            print("Added neighborhood for Call #" + str(call.pk) + ".")
+    return _index
 
+def populate_neighborhood_district():
+    """
+    Populates the neighborhood_district field for all Calls model objects using
+    the loaded neighborhoods. See the assign_neighborhoods management command
+    for the batched and PostGIS join modes.
+    """
+    assign_in_python(get_index(), log=print)
     print("Neighborhood population complete.")
-    
+
 def get_neighborhood(point):
     """
     Gets the neighborhood name for the specified GEOS POINT.
     Returns None if no neighborhood is found.
     """
-    for n in neighborhoods["data"]:
-        multipolygon = GEOSGeometry(n[MULTIPOLYGON_COL])
-
-        if multipolygon.contains(point):
-            return n[NEIGHBORHOOD_COL]
-
-    return None
\ No newline at end of file
+    return get_index().get_neighborhood(point)
@@ -0,0 +1,72 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, update_wrapper
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.views.generic import View
+
+_executor = None
+
+def get_executor():
+    """
+    Returns the shared thread pool for blocking work in async views. Its
+    size, API_THREAD_POOL_SIZE, also bounds the number of database
+    connections the pool holds open.
+    """
+    global _executor
+
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'API_THREAD_POOL_SIZE', 20),
+            thread_name_prefix='api-pool'
+        )
+
+    return _executor
+
+def call_with_connection(function, *args, **kwargs):
+    """
+    Calls a function in a pool thread, dropping the thread's database
+    connection before and after if it is broken or past CONN_MAX_AGE, as
+    Django does around each request.
+    """
+    close_old_connections()
+
+    try:
+        return function(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+async def run_in_pool(function, *args, **kwargs):
+    """
+    Runs a blocking function, such as a query or geocoder request, in the
+    shared thread pool and returns its result.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        get_executor(), partial(call_with_connection, function, *args, **kwargs)
+    )
+
+class AsyncView(View):
+    """
+    Class-based view whose method handlers are coroutines. as_view() returns
+    a coroutine function so Django runs the view on the event loop under
+    ASGI.
+    """
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super(AsyncView, cls).as_view(**initkwargs)
+
+        async def async_view(request, *args, **kwargs):
+            response = view(request, *args, **kwargs)
+
+            # Handlers are coroutines, but responses such as 405 Method Not
+            # Allowed are returned directly.
+            if asyncio.iscoroutine(response):
+                response = await response
+
+            return response
+
+        update_wrapper(async_view, view)
+        return async_view
@@ -0,0 +1,262 @@
+import json
+import math
+import subprocess
+import time
+import tracemalloc
+
+import numpy as np
+from django.conf import settings
+from django.db import connection
+from django.db.models import Max, Min
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import get_resolver, reverse
+
+from .cache import get_response_cache
+from .models import AddressStats, Call
+
+def tile_for(latitude, longitude, zoom):
+    """
+    Returns the (x, y) of the Web Mercator tile containing a location.
+    """
+    scale = 2 ** zoom
+    x = int((longitude + 180.0) / 360.0 * scale)
+    y = int((1.0 - math.asinh(math.tan(math.radians(latitude))) / math.pi) / 2.0 * scale)
+    return x, y
+
+def get_sample_params():
+    """
+    Returns request parameters drawn from the loaded calls: the busiest
+    addresses, a battalion, a neighborhood and the date range. Addresses
+    come from the rollup, so the geocoder resolves them offline.
+    """
+    addresses = list(
+        AddressStats.objects.order_by('-calls').values_list('address', 'latitude', 'longitude')[:20]
+    )
+    if not addresses:
+        raise ValueError('No calls are loaded.')
+
+    dates = Call.objects.aggregate(start=Min('call_date'), end=Max('call_date'))
+
+    return {
+        "addresses": [(a, float(lat), float(lng)) for a, lat, lng in addresses],
+        "battalion": Call.objects.values_list('battalion', flat=True).first(),
+        "neighborhood": Call.objects.exclude(
+            neighborhood_district=None
+        ).values_list('neighborhood_district', flat=True).first(),
+        "start_date": dates["start"].isoformat(),
+        "end_date": dates["end"].isoformat(),
+    }
+
+def get_benchmark_requests(params):
+    """
+    Returns the requests timed for each URL name in dispatch/urls.py, as
+    lists of (label, method, path, data, content type) tuples.
+    """
+    address, lat, lng = params["addresses"][0]
+    tile_x, tile_y = tile_for(lat, lng, 14)
+    bbox = '{0},{1},{2},{3}'.format(lng - 0.02, lat - 0.02, lng + 0.02, lat + 0.02)
+    dates = {'start_date': params["start_date"], 'end_date': params["end_date"]}
+
+    batch = json.dumps([
+        {'address': a, 'time': '{0}:00'.format(i % 24), 'radius': 0.5}
+        for i, (a, la, ln) in enumerate(params["addresses"] * 5)
+    ])
+
+    return {
+        'home': [('', 'GET', reverse('home'), {}, None)],
+        'heatmaps': [('', 'GET', reverse('heatmaps'), {}, None)],
+        'incident-metrics': [('', 'GET', reverse('incident-metrics'), {}, None)],
+        'api-address-frequency': [
+            ('', 'GET', reverse('api-address-frequency'), {}, None),
+            ('arrays', 'GET', reverse('api-address-frequency'), {'format': 'arrays'}, None),
+        ],
+        'api-calls-nearby': [
+            ('', 'POST', reverse('api-calls-nearby'), {'address': address, 'time': '14:00'}, None),
+        ],
+        'api-calls-nearby-batch': [
+            ('100', 'POST', reverse('api-calls-nearby-batch'), batch, 'application/json'),
+        ],
+        'api-calls-longest-dispatch': [('', 'GET', reverse('api-calls-longest-dispatch'), {}, None)],
+        'api-calls-safest-neighborhoods': [
+            ('', 'GET', reverse('api-calls-safest-neighborhoods'), {}, None),
+            ('approx', 'GET', reverse('api-calls-safest-neighborhoods'), {'approx': 'true'}, None),
+        ],
+        'api-calls-neighborhoods': [('', 'GET', reverse('api-calls-neighborhoods'), {}, None)],
+        'api-calls-neighborhood': [
+            ('', 'GET', reverse('api-calls-neighborhood'), dict(dates, name=params["neighborhood"]), None),
+        ],
+        'api-calls-grid': [
+            ('', 'GET', reverse('api-calls-grid'), {'bbox': bbox, 'zoom': 14}, None),
+        ],
+        'api-calls-battalions': [('', 'GET', reverse('api-calls-battalions'), {}, None)],
+        'api-geocoder-stats': [('', 'GET', reverse('api-geocoder-stats'), {}, None)],
+        'tiles-calls': [
+            ('', 'GET', reverse('tiles-calls', kwargs={'z': 14, 'x': tile_x, 'y': tile_y}), {}, None),
+        ],
+        'metrics-calls-per-hour': [
+            ('', 'GET', reverse('metrics-calls-per-hour'), {}, None),
+            ('filtered', 'GET', reverse('metrics-calls-per-hour'), dict(dates, battalion=params["battalion"]), None),
+        ],
+        'metrics-battalion-dist': [
+            ('', 'GET', reverse('metrics-battalion-dist'), {}, None),
+            ('battalion', 'POST', reverse('metrics-battalion-dist'), {'battalion': params["battalion"]}, None),
+        ],
+        'metrics-group-response-time': [('', 'GET', reverse('metrics-group-response-time'), {}, None)],
+        'metrics-query': [
+            ('', 'GET', reverse('metrics-query'), {'group_by': 'battalion,hour', 'measures': 'calls,avg_dispatch_time'}, None),
+            ('incidents', 'GET', reverse('metrics-query'), dict(
+                dates, group_by='call_date', measures='incidents',
+                filter='neighborhood_district:{0}'.format(params["neighborhood"])
+            ), None),
+            ('incidents-approx', 'GET', reverse('metrics-query'), dict(
+                dates, group_by='call_date', measures='incidents', approx='true',
+                filter='neighborhood_district:{0}'.format(params["neighborhood"])
+            ), None),
+        ],
+        'api-calls-neighborhood-trends': [
+            ('', 'GET', reverse('api-calls-neighborhood-trends'), {}, None),
+            ('neighborhood', 'POST', reverse('api-calls-neighborhood-trends'),
+                dict(dates, neighborhood=params["neighborhood"]), None),
+        ],
+    }
+
+def get_url_names(patterns=None):
+    """
+    Returns the names of every URL pattern, following includes.
+    """
+    names = []
+
+    for pattern in get_resolver().url_patterns if patterns is None else patterns:
+        if hasattr(pattern, 'url_patterns'):
+            names.extend(get_url_names(pattern.url_patterns))
+        elif pattern.name:
+            names.append(pattern.name)
+
+    return names
+
+def send(client, method, path, data, content_type):
+    """
+    Sends a request and reads the whole response, including streamed ones.
+    Returns the response and its body size in bytes.
+    """
+    if method == 'GET':
+        response = client.get(path, data)
+    elif content_type:
+        response = client.post(path, data, content_type=content_type)
+    else:
+        response = client.post(path, data)
+
+    if response.streaming:
+        size = sum(len(chunk) for chunk in response.streaming_content)
+    else:
+        size = len(response.content)
+
+    return response, size
+
+def measure_request(client, request, repeat, cached):
+    """
+    Returns the latency percentiles, query count and peak Python memory of
+    a request. Unless cached is True both tiers of the response cache are
+    cleared before every run, outside the timing, so the views do their full
+    work.
+    """
+    label, method, path, data, content_type = request
+
+    def clear():
+        if not cached:
+            get_response_cache().clear(shared=True)
+
+    def run():
+        return send(client, method, path, data, content_type)
+
+    # A warm-up run loads lazily built state such as the geocoder
+    clear()
+    run()
+
+    times = []
+    for i in range(repeat):
+        clear()
+        start = time.perf_counter()
+        response, size = run()
+        times.append((time.perf_counter() - start) * 1000)
+
+    # A separate instrumented run, since tracing slows the request down.
+    # Queries that async views run in the thread pool use the pool threads'
+    # connections and aren't counted.
+    clear()
+    tracemalloc.start()
+    try:
+        with CaptureQueriesContext(connection) as queries:
+            run()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "method": method,
+        "path": path,
+        "status": response.status_code,
+        "bytes": size,
+        "p50_ms": round(float(np.percentile(times, 50)), 3),
+        "p95_ms": round(float(np.percentile(times, 95)), 3),
+        "mean_ms": round(float(np.mean(times)), 3),
+        "queries": len(queries.captured_queries),
+        "peak_memory_kb": round(peak / 1024, 1),
+    }
+
+def benchmark_urls(repeat=20, cached=False, log=None):
+    """
+    Times the sample requests of every URL in dispatch/urls.py. URLs without
+    a sample request are reported as skipped.
+    @return: A dictionary of results keyed by URL name, with the request
+    label appended after a colon for URLs with several requests.
+    """
+    requests = get_benchmark_requests(get_sample_params())
+    client = Client()
+    results = {}
+
+    # Tiles are cached on disk, so the tile cache is only used when
+    # measuring cached responses
+    overrides = {'ALLOWED_HOSTS': list(settings.ALLOWED_HOSTS) + ['testserver']}
+    if not cached:
+        overrides['TILE_CACHE_DIR'] = None
+
+    with override_settings(**overrides):
+        for name in get_url_names():
+            if name not in requests:
+                results[name] = {"skipped": "No benchmark request defined."}
+                continue
+
+            for request in requests[name]:
+                key = '{0}:{1}'.format(name, request[0]) if request[0] else name
+                results[key] = measure_request(client, request, repeat, cached)
+
+                if log:
+                    log(key, results[key])
+
+    return results
+
+def get_commit():
+    """
+    Returns the short hash of the checked out commit, or None.
+    """
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True
+        ).stdout.decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare_results(old, new):
+    """
+    Yields (name, old p50, new p50, percent change) for the endpoints timed
+    in both result documents.
+    """
+    for name, result in new["endpoints"].items():
+        previous = old.get("endpoints", {}).get(name)
+
+        if previous and "p50_ms" in previous and "p50_ms" in result:
+            change = (result["p50_ms"] - previous["p50_ms"]) / max(previous["p50_ms"], 1e-6) * 100
+            yield name, previous["p50_ms"], result["p50_ms"], change
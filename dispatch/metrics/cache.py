@@ -0,0 +1,247 @@
+import asyncio
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import F
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils import timezone
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+
+from .asynchronous import run_in_pool
+from .models import DatasetVersion
+
+_version = None # Cached (version, updated, fetched at) tuple
+_version_lock = threading.Lock()
+
+def get_dataset_version():
+    """
+    Returns the current (version, updated timestamp) of the dataset. The
+    value is cached in-process for DATASET_VERSION_TTL seconds.
+    """
+    global _version
+
+    ttl = getattr(settings, 'DATASET_VERSION_TTL', 5)
+    cached = _version
+
+    if cached is None or time.time() - cached[2] > ttl:
+        dataset, created = DatasetVersion.objects.get_or_create(pk=1)
+        cached = (dataset.version, dataset.updated, time.time())
+
+        with _version_lock:
+            _version = cached
+
+    return cached[0], cached[1]
+
+def bump_dataset_version():
+    """
+    Increments the dataset version, invalidating every cached response.
+    Called by the commands that change the calls table.
+    """
+    global _version
+
+    updated = DatasetVersion.objects.filter(pk=1).update(
+        version=F('version') + 1, updated=timezone.now()
+    )
+
+    if not updated:
+        DatasetVersion.objects.create(pk=1, version=1)
+
+    with _version_lock:
+        _version = None
+
+class ResponseCache:
+    """
+    Two tier cache of serialized responses: an in-process LRU, backed by an
+    optional Django cache (e.g. file or database based) shared between
+    processes.
+    """
+
+    def __init__(self, size=256, alias=None):
+        self.size = size
+        self.alias = alias
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Returns the cached entry for a key, or None.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                return entry
+
+        if self.alias:
+            entry = caches[self.alias].get(key)
+            if entry is not None:
+                self.set(key, entry, shared=False)
+
+        return entry
+
+    def set(self, key, entry, shared=True):
+        """
+        Stores an entry in the local tier and, optionally, the shared tier.
+        """
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+        if shared and self.alias:
+            caches[self.alias].set(key, entry)
+
+    def clear(self, shared=False):
+        """
+        Removes every entry from the local tier and, if shared is True, the
+        shared tier. The whole cache behind the shared tier is cleared.
+        """
+        with self.lock:
+            self.entries.clear()
+
+        if shared and self.alias:
+            caches[self.alias].clear()
+
+_response_cache = None
+
+def get_response_cache():
+    """
+    Returns the shared response cache, configured by the RESPONSE_CACHE_SIZE
+    and RESPONSE_CACHE_ALIAS settings.
+    """
+    global _response_cache
+
+    if _response_cache is None:
+        _response_cache = ResponseCache(
+            getattr(settings, 'RESPONSE_CACHE_SIZE', 256),
+            getattr(settings, 'RESPONSE_CACHE_ALIAS', None)
+        )
+
+    return _response_cache
+
+def get_cache_key(request, version):
+    """
+    Returns the cache key for a request: the path, method and sorted
+    parameters at the given dataset version.
+    """
+    params = request.GET if request.method == 'GET' else request.POST
+    normalized = sorted((k, sorted(v)) for k, v in params.lists())
+
+    digest = hashlib.sha1(
+        repr((request.path, request.method, normalized)).encode('utf-8')
+    ).hexdigest()
+
+    return 'response:{0}:{1}'.format(version, digest)
+
+def is_not_modified(request, etag, last_modified):
+    """
+    Returns True if the request's conditional headers match the response.
+    """
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        etags = [e.strip() for e in if_none_match.split(',')]
+        return etag in etags or '*' in etags
+
+    if_modified_since = request.META.get('HTTP_IF_MODIFIED_SINCE')
+    if if_modified_since is not None:
+        since = parse_http_date_safe(if_modified_since)
+        return since is not None and int(last_modified) <= since
+
+    return False
+
+def get_cached_entry(request):
+    """
+    Returns the cache key, dataset update timestamp and cached entry (or
+    None) for a request.
+    """
+    version, updated = get_dataset_version()
+    key = get_cache_key(request, version)
+    return key, updated, get_response_cache().get(key)
+
+def make_entry(response, updated):
+    """
+    Returns the cache entry for a response, or None if the response should
+    not be cached. Only complete, successful responses are cached.
+    """
+    if response.status_code != 200 or response.streaming:
+        return None
+
+    content = response.content
+    return {
+        "content": content,
+        "content_type": response['Content-Type'],
+        "etag": quote_etag(hashlib.md5(content).hexdigest()),
+        "last_modified": updated.timestamp() if updated else time.time()
+    }
+
+def entry_response(request, entry):
+    """
+    Returns the response for a cache entry, or 304 Not Modified for a
+    matching conditional GET request.
+    """
+    if request.method == 'GET' and is_not_modified(
+            request, entry["etag"], entry["last_modified"]):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(entry["content"], content_type=entry["content_type"])
+
+    if request.method == 'GET':
+        response['ETag'] = entry["etag"]
+        response['Last-Modified'] = http_date(entry["last_modified"])
+
+    return response
+
+def cache_response(view):
+    """
+    View decorator that caches successful GET and POST responses per dataset
+    version. Responses are stored as serialized bytes, and GET responses are
+    served with ETag and Last-Modified headers. Both sync and async views
+    are supported; for async views the cache lookups run in the thread pool.
+    """
+    if asyncio.iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'POST'):
+                return await view(request, *args, **kwargs)
+
+            key, updated, entry = await run_in_pool(get_cached_entry, request)
+
+            if entry is None:
+                response = await view(request, *args, **kwargs)
+                entry = make_entry(response, updated)
+
+                if entry is None:
+                    return response
+
+                await run_in_pool(get_response_cache().set, key, entry)
+
+            return entry_response(request, entry)
+
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'POST'):
+            return view(request, *args, **kwargs)
+
+        key, updated, entry = get_cached_entry(request)
+
+        if entry is None:
+            response = view(request, *args, **kwargs)
+            entry = make_entry(response, updated)
+
+            if entry is None:
+                return response
+
+            get_response_cache().set(key, entry)
+
+        return entry_response(request, entry)
+
+    return wrapper
@@ -0,0 +1,361 @@
+import datetime
+import json
+import mmap
+import os
+import struct
+import threading
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from .cache import get_dataset_version
+from .models import Call
+
+# Text columns stored as integer codes into a per-column dictionary
+CATEGORICAL_COLUMNS = [
+    'battalion', 'call_type', 'call_type_group', 'neighborhood_district', 'unit_type'
+]
+
+# Timestamp columns stored as int64 microseconds since the epoch
+TIMESTAMP_COLUMNS = ['received_timestamp', 'dispatch_timestamp']
+
+# Date columns stored as int32 days since the epoch
+DATE_COLUMNS = ['call_date']
+
+# Integer columns stored as int64, with NULL stored as -1
+INTEGER_COLUMNS = ['incident_number', 'received_minute']
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=timezone.utc)
+EPOCH_DATE = datetime.date(1970, 1, 1)
+MICROSECOND = datetime.timedelta(microseconds=1)
+
+# On-disk snapshot layout: magic bytes, the length of a JSON header, the
+# header, then each column as raw little-endian values aligned to 64 bytes.
+SNAPSHOT_MAGIC = b'SFPDSNP1'
+SNAPSHOT_ALIGNMENT = 64
+
+def group_counts(codes, size):
+    """
+    Returns the number of rows for each group code.
+    """
+    return np.bincount(codes, minlength=size)
+
+def group_means(codes, values, size):
+    """
+    Returns the mean of values for each group code, NaN for empty groups.
+    """
+    counts = np.bincount(codes, minlength=size)
+    sums = np.bincount(codes, weights=values, minlength=size)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return sums / counts
+
+def group_distinct_counts(codes, values, size):
+    """
+    Returns the number of distinct non-negative values for each group code.
+    """
+    if not len(codes):
+        return np.zeros(size, dtype=np.int64)
+
+    # Pack each (code, value) pair into one int64 key and count the unique
+    # keys per code.
+    width = int(values.max()) + 1
+    keys = np.unique(codes.astype(np.int64) * width + values)
+    return np.bincount(keys // width, minlength=size)
+
+class CallSnapshot:
+    """
+    Read-only columnar copy of the calls table held in NumPy arrays, with
+    group-by kernels answering the dashboard metrics without the database.
+    """
+
+    def __init__(self, columns, dictionaries, version=None):
+        """
+        @param columns: A dictionary of column name to NumPy array.
+        @param dictionaries: A dictionary of categorical column name to the
+        list of values its codes index.
+        @param version: The dataset version the snapshot was loaded at.
+        """
+        self.columns = columns
+        self.dictionaries = dictionaries
+        self.version = version
+        self.size = len(columns['incident_number'])
+
+    @classmethod
+    def load(cls, chunk_size=50000, version=None):
+        """
+        Returns a snapshot of the calls table, read in chunks.
+        """
+        names = CATEGORICAL_COLUMNS + TIMESTAMP_COLUMNS + DATE_COLUMNS + INTEGER_COLUMNS
+        encoders = {name: {} for name in CATEGORICAL_COLUMNS}
+        chunks = {name: [] for name in names}
+        values = {name: [] for name in names}
+
+        def flush():
+            for name in names:
+                if values[name]:
+                    chunks[name].append(np.array(values[name], dtype=get_dtype(name)))
+                    values[name] = []
+
+        rows = Call.objects.values_list(*names).order_by()
+        for count, row in enumerate(rows.iterator(chunk_size=chunk_size), 1):
+            for name, value in zip(names, row):
+                if name in encoders:
+                    encoder = encoders[name]
+                    value = encoder.setdefault(value, len(encoder))
+                elif name in TIMESTAMP_COLUMNS:
+                    value = (value - EPOCH) // MICROSECOND
+                elif name in DATE_COLUMNS:
+                    value = (value - EPOCH_DATE).days
+                elif value is None:
+                    value = -1
+
+                values[name].append(value)
+
+            if count % chunk_size == 0:
+                flush()
+
+        flush()
+
+        columns = {
+            name: np.concatenate(chunks[name]) if chunks[name]
+            else np.array([], dtype=get_dtype(name))
+            for name in names
+        }
+        dictionaries = {name: list(encoders[name]) for name in CATEGORICAL_COLUMNS}
+
+        return cls(columns, dictionaries, version)
+
+    def save(self, path):
+        """
+        Writes the snapshot to a file. The file is written beside the target
+        and renamed over it, so readers never see a partial snapshot.
+        """
+        layout = {}
+        offset = 0
+
+        for name, column in self.columns.items():
+            dtype = column.dtype.newbyteorder('<')
+            layout[name] = {"dtype": dtype.str, "offset": offset}
+            offset += column.size * dtype.itemsize
+            offset += -offset % SNAPSHOT_ALIGNMENT
+
+        header = json.dumps({
+            "version": self.version,
+            "size": self.size,
+            "columns": layout,
+            "dictionaries": self.dictionaries
+        }).encode('utf-8')
+
+        # Pad the header so the data section starts aligned
+        start = len(SNAPSHOT_MAGIC) + 8 + len(header)
+        header += b' ' * (-start % SNAPSHOT_ALIGNMENT)
+        start += -start % SNAPSHOT_ALIGNMENT
+
+        temp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+        with open(temp_path, 'wb') as f:
+            f.write(SNAPSHOT_MAGIC)
+            f.write(struct.pack('<Q', len(header)))
+            f.write(header)
+
+            for name, column in self.columns.items():
+                f.seek(start + layout[name]["offset"])
+                f.write(column.astype(layout[name]["dtype"], copy=False).tobytes())
+
+            f.truncate(start + offset)
+
+        os.replace(temp_path, path)
+
+    @classmethod
+    def open(cls, path):
+        """
+        Returns a snapshot whose columns are read-only views of the
+        memory-mapped file, so processes opening the same file share one
+        page-cached copy.
+        """
+        with open(path, 'rb') as f:
+            if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+                raise ValueError('{0} is not a calls snapshot.'.format(path))
+
+            header_length = struct.unpack('<Q', f.read(8))[0]
+            header = json.loads(f.read(header_length).decode('utf-8'))
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        start = len(SNAPSHOT_MAGIC) + 8 + header_length
+        columns = {
+            name: np.frombuffer(
+                buffer, dtype=column["dtype"], count=header["size"],
+                offset=start + column["offset"]
+            )
+            for name, column in header["columns"].items()
+        }
+
+        return cls(columns, header["dictionaries"], header["version"])
+
+    def codes_for(self, column, values):
+        """
+        Returns the codes of the given values in a categorical column,
+        skipping values that don't occur.
+        """
+        lookup = {v: i for i, v in enumerate(self.dictionaries[column])}
+        return [lookup[v] for v in values if v in lookup]
+
+    def average_dispatch_time(self):
+        """
+        Returns the average dispatch time per call_type_group, longest first,
+        in the shape of the AverageResponseTime ORM query.
+        """
+        codes = self.columns['call_type_group']
+        labels = self.dictionaries['call_type_group']
+        intervals = self.columns['dispatch_timestamp'] - self.columns['received_timestamp']
+        means = group_means(codes, intervals, len(labels))
+
+        results = [
+            {
+                "call_type_group": labels[i],
+                "avg_dispatch_time": datetime.timedelta(microseconds=float(means[i]))
+            }
+            for i in range(len(labels)) if not np.isnan(means[i])
+        ]
+
+        return sorted(results, key=lambda r: r["avg_dispatch_time"], reverse=True)
+
+    def battalion_counts(self):
+        """
+        Returns the number of calls per battalion, ordered by battalion.
+        """
+        labels = self.dictionaries['battalion']
+        counts = group_counts(self.columns['battalion'], len(labels))
+
+        return sorted(
+            (
+                {"battalion": labels[i], "count": int(counts[i])}
+                for i in range(len(labels)) if counts[i]
+            ),
+            key=lambda r: r["battalion"]
+        )
+
+    def battalion_call_types(self, battalion):
+        """
+        Returns the number of calls per call_type for a battalion, ordered
+        by call_type.
+        """
+        codes = self.codes_for('battalion', [battalion])
+        if not codes:
+            return []
+
+        labels = self.dictionaries['call_type']
+        mask = self.columns['battalion'] == codes[0]
+        counts = group_counts(self.columns['call_type'][mask], len(labels))
+
+        return sorted(
+            (
+                {"call_type": labels[i], "call_count": int(counts[i])}
+                for i in range(len(labels)) if counts[i]
+            ),
+            key=lambda r: r["call_type"]
+        )
+
+    def neighborhood_daily_counts(self, neighborhoods):
+        """
+        Returns calls and distinct incidents per (call_date, neighborhood)
+        for the given neighborhoods, ordered by date.
+        """
+        codes = self.codes_for('neighborhood_district', neighborhoods)
+        mask = np.isin(self.columns['neighborhood_district'], codes)
+
+        dates, date_codes = np.unique(self.columns['call_date'][mask], return_inverse=True)
+        labels = self.dictionaries['neighborhood_district']
+        groups = date_codes * len(labels) + self.columns['neighborhood_district'][mask]
+        size = len(dates) * len(labels)
+
+        calls = group_counts(groups, size)
+        incidents = group_distinct_counts(groups, self.columns['incident_number'][mask], size)
+
+        return [
+            {
+                "call_date": EPOCH_DATE + datetime.timedelta(days=int(dates[g // len(labels)])),
+                "neighborhood_district": labels[g % len(labels)],
+                "calls": int(calls[g]),
+                "incidents": int(incidents[g])
+            }
+            for g in np.flatnonzero(calls)
+        ]
+
+    def neighborhood_totals(self, excluded_types):
+        """
+        Returns calls and distinct incidents per neighborhood, excluding the
+        given call types, ordered by incidents.
+        """
+        excluded = self.codes_for('call_type', excluded_types)
+        mask = ~np.isin(self.columns['call_type'], excluded)
+
+        labels = self.dictionaries['neighborhood_district']
+        codes = self.columns['neighborhood_district'][mask]
+        calls = group_counts(codes, len(labels))
+        incidents = group_distinct_counts(codes, self.columns['incident_number'][mask], len(labels))
+
+        return sorted(
+            (
+                {
+                    "neighborhood_district": labels[i],
+                    "calls": int(calls[i]),
+                    "incidents": int(incidents[i])
+                }
+                for i in range(len(labels)) if calls[i]
+            ),
+            key=lambda r: r["incidents"]
+        )
+
+def get_dtype(name):
+    """
+    Returns the NumPy dtype a column is stored as.
+    """
+    if name in CATEGORICAL_COLUMNS or name in DATE_COLUMNS:
+        return np.int32
+
+    return np.int64
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+def get_snapshot():
+    """
+    Returns the shared snapshot of the calls table, or None if the
+    ANALYTICS_SNAPSHOT setting is off. The snapshot is reloaded when the
+    dataset version changes. The file at ANALYTICS_SNAPSHOT_PATH is memory
+    mapped when it matches the current version, otherwise the snapshot is
+    read from the database.
+    """
+    global _snapshot
+
+    if not getattr(settings, 'ANALYTICS_SNAPSHOT', False):
+        return None
+
+    version, updated = get_dataset_version()
+
+    if _snapshot is None or _snapshot.version != version:
+        with _snapshot_lock:
+            if _snapshot is None or _snapshot.version != version:
+                _snapshot = open_snapshot(version)
+
+    return _snapshot
+
+def open_snapshot(version):
+    """
+    Returns the snapshot file at ANALYTICS_SNAPSHOT_PATH if it was written at
+    the given dataset version, otherwise a snapshot loaded from the database.
+    """
+    path = getattr(settings, 'ANALYTICS_SNAPSHOT_PATH', None)
+
+    if path and os.path.exists(path):
+        try:
+            snapshot = CallSnapshot.open(path)
+        except (OSError, ValueError):
+            snapshot = None
+
+        if snapshot is not None and snapshot.version == version:
+            return snapshot
+
+    return CallSnapshot.load(version=version)
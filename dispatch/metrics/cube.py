@@ -0,0 +1,404 @@
+import datetime
+import hashlib
+import math
+
+from django.db import connection, transaction
+from django.utils.dateparse import parse_date
+from psycopg2.extras import execute_values
+
+from .models import Call, CallCube, IncidentSketch
+
+def parse_date_value(value):
+    """
+    Returns the date of a YYYY-MM-DD filter value. Raises a ValueError if
+    the value is not a valid date.
+    """
+    date = parse_date(value)
+
+    if date is None:
+        raise ValueError('Invalid date "{0}".'.format(value))
+
+    return date
+
+# Dimensions the cube can be grouped and filtered by, as (SQL expression on
+# the cube, SQL expression on the calls table, parser of filter values)
+# tuples. month and year are derived from the call date. The nullable
+# columns are left as they are on the calls table, so grouping by them
+# can follow its indexes.
+DIMENSIONS = {
+    'call_date': ('call_date', 'call_date', parse_date_value),
+    'month': ("date_trunc('month', call_date)::date", "date_trunc('month', call_date)::date", parse_date_value),
+    'year': ('EXTRACT(YEAR FROM call_date)::integer', 'EXTRACT(YEAR FROM call_date)::integer', int),
+    'hour': ('hour', 'COALESCE(received_minute / 60, -1)', int),
+    'battalion': ('battalion', 'battalion', str),
+    'neighborhood_district': ('neighborhood_district', 'neighborhood_district', str),
+    'call_type': ('call_type', 'call_type', str),
+    'call_type_group': ('call_type_group', 'call_type_group', str),
+    'unit_type': ('unit_type', 'unit_type', str),
+    'priority': ('priority', 'priority', str),
+}
+
+# Cube columns identifying a cell, in the order of the unique constraint
+CELL_COLUMNS = [
+    'call_date', 'hour', 'battalion', 'neighborhood_district', 'call_type',
+    'call_type_group', 'unit_type', 'priority'
+]
+
+# Columns identifying an incident sketch. The hour, unit type and priority
+# differ between the calls of an incident and are left out.
+SKETCH_COLUMNS = [
+    'call_date', 'battalion', 'neighborhood_district', 'call_type', 'call_type_group'
+]
+
+# Dimensions incidents can be estimated by
+SKETCH_DIMENSIONS = SKETCH_COLUMNS + ['month', 'year']
+
+# Dimensions stored as '' for calls without a value, since NULLs never
+# conflict in the cells' unique constraint
+NULLABLE_DIMENSIONS = ['neighborhood_district', 'call_type_group']
+
+# Call fields the cube is aggregated from
+SOURCE_FIELDS = [
+    'call_date', 'received_minute', 'battalion', 'neighborhood_district',
+    'call_type', 'call_type_group', 'unit_type', 'priority', 'incident_number',
+    'received_timestamp', 'dispatch_timestamp', 'on_scene_timestamp'
+]
+
+MEASURES = ['calls', 'incidents', 'days', 'avg_dispatch_time', 'avg_response_time']
+
+# SQL of every measure but incidents, which is counted by its own query
+MEASURE_SQL = {
+    'calls': 'COALESCE(SUM(calls), 0)',
+    'days': 'COUNT(DISTINCT call_date)',
+    'avg_dispatch_time': 'SUM(dispatch_seconds) / NULLIF(SUM(dispatch_calls), 0)',
+    'avg_response_time': 'SUM(response_seconds) / NULLIF(SUM(response_calls), 0)',
+}
+
+# Registers of the incident sketches (migration 0022_incidentsketch). The
+# relative standard error of a distinct incident estimate is
+# 1.04 / sqrt(HLL_REGISTERS), about 0.81%.
+HLL_PRECISION = 14
+HLL_REGISTERS = 1 << HLL_PRECISION
+
+def hll_entry(incident):
+    """
+    Returns the register and rank of an incident number in a sketch, as set
+    by the metrics_hll_sketch database function: the register is the top
+    bits of the number's md5 and the rank the position of the first set bit
+    of the next 32 bits.
+    """
+    digest = hashlib.md5(str(incident).encode('utf-8')).hexdigest()
+    return (
+        int(digest[:8], 16) >> (32 - HLL_PRECISION),
+        33 - int(digest[8:16], 16).bit_length()
+    )
+
+def hll_estimate(registers, harmonic_sum):
+    """
+    Returns the HyperLogLog estimate of a number of distinct values, with
+    linear counting for small counts, where it's more accurate.
+    @param registers: The number of non-empty registers of the sketch.
+    @param harmonic_sum: The sum of 2^-rank over the non-empty registers.
+    """
+    m = HLL_REGISTERS
+    zeros = m - registers
+    estimate = 0.7213 / (1 + 1.079 / m) * m * m / (harmonic_sum + zeros)
+
+    if estimate <= 2.5 * m and zeros:
+        estimate = m * math.log(m / zeros)
+
+    return int(round(estimate))
+
+def refresh_call_cube(dates=None):
+    """
+    Recomputes the cube cells and incident sketches of the given call dates
+    from the calls table, or rebuilds them all when no dates are given.
+    """
+    calls_table = connection.ops.quote_name(Call._meta.db_table)
+
+    # INSERT of each table's rows for the calls matching a condition
+    tables = [
+        (
+            connection.ops.quote_name(CallCube._meta.db_table),
+            'INSERT INTO {0} ({1}, calls, dispatch_seconds, dispatch_calls, '
+            'response_seconds, response_calls) '
+            'SELECT call_date, COALESCE(received_minute / 60, -1), battalion, '
+            "COALESCE(neighborhood_district, ''), call_type, COALESCE(call_type_group, ''), "
+            'unit_type, priority, COUNT(*), '
+            'COALESCE(SUM(EXTRACT(EPOCH FROM dispatch_timestamp - received_timestamp)), 0), '
+            'COUNT(dispatch_timestamp), '
+            'COALESCE(SUM(EXTRACT(EPOCH FROM on_scene_timestamp - received_timestamp)), 0), '
+            'COUNT(on_scene_timestamp) '
+            'FROM {2} {3} GROUP BY 1, 2, 3, 4, 5, 6, 7, 8',
+            CELL_COLUMNS
+        ),
+        (
+            connection.ops.quote_name(IncidentSketch._meta.db_table),
+            'INSERT INTO {0} ({1}, hll) '
+            "SELECT call_date, battalion, COALESCE(neighborhood_district, ''), call_type, "
+            "COALESCE(call_type_group, ''), metrics_hll_sketch(array_agg(DISTINCT incident_number)) "
+            'FROM {2} {3} GROUP BY 1, 2, 3, 4, 5',
+            SKETCH_COLUMNS
+        ),
+    ]
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        if dates is None:
+            for table, sql, columns in tables:
+                cursor.execute('DELETE FROM {0}'.format(table))
+                cursor.execute(sql.format(table, ', '.join(columns), calls_table, ''))
+        else:
+            dates = sorted(d for d in dates if d is not None)
+
+            if dates:
+                for table, sql, columns in tables:
+                    cursor.execute(
+                        'DELETE FROM {0} WHERE call_date = ANY(%s)'.format(table), [dates]
+                    )
+                    cursor.execute(
+                        sql.format(table, ', '.join(columns), calls_table,
+                            'WHERE call_date = ANY(%s)'),
+                        [dates]
+                    )
+
+def add_to_call_cube(columns, rows):
+    """
+    Adds a batch of newly loaded calls to the cube and the incident
+    sketches. The batch is aggregated per cell and sketch before touching
+    the database, then merged into the stored rows with one upsert per page.
+    Only the batch's incident numbers are hashed; stored sketches are merged
+    register by register. Batches without every source column recompute
+    their dates from the calls table instead.
+    @param columns: The Call field names of the row values.
+    @param rows: A list of tuples of parsed values.
+    """
+    if any(name not in columns for name in SOURCE_FIELDS):
+        call_date = columns.index('call_date')
+        refresh_call_cube({r[call_date] for r in rows})
+        return
+
+    indexes = [columns.index(name) for name in SOURCE_FIELDS]
+    cells = {}
+    sketches = {}
+
+    for row in rows:
+        (call_date, minute, battalion, neighborhood, call_type, group, unit_type,
+            priority, incident, received, dispatched, on_scene) = [row[i] for i in indexes]
+
+        key = (
+            call_date, minute // 60 if minute is not None else -1, battalion,
+            neighborhood or '', call_type, group or '', unit_type, priority
+        )
+        cell = cells.get(key)
+
+        if cell is None:
+            cell = cells[key] = [0, 0.0, 0, 0.0, 0]
+
+        cell[0] += 1
+
+        if dispatched is not None:
+            cell[1] += (dispatched - received).total_seconds()
+            cell[2] += 1
+
+        if on_scene is not None:
+            cell[3] += (on_scene - received).total_seconds()
+            cell[4] += 1
+
+        # Highest rank of each register of the sketch
+        registers = sketches.setdefault(
+            (call_date, battalion, neighborhood or '', call_type, group or ''), {}
+        )
+        register, rank = hll_entry(incident)
+
+        if rank > registers.get(register, 0):
+            registers[register] = rank
+
+    if not cells:
+        return
+
+    cube_table = connection.ops.quote_name(CallCube._meta.db_table)
+    sketch_table = connection.ops.quote_name(IncidentSketch._meta.db_table)
+    cell_columns = ', '.join(CELL_COLUMNS)
+    sketch_columns = ', '.join(SKETCH_COLUMNS)
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        execute_values(
+            cursor.cursor,
+            'INSERT INTO {0} AS c ({1}, calls, dispatch_seconds, dispatch_calls, '
+            'response_seconds, response_calls) VALUES %s '
+            'ON CONFLICT ({1}) DO UPDATE SET '
+            'calls = c.calls + EXCLUDED.calls, '
+            'dispatch_seconds = c.dispatch_seconds + EXCLUDED.dispatch_seconds, '
+            'dispatch_calls = c.dispatch_calls + EXCLUDED.dispatch_calls, '
+            'response_seconds = c.response_seconds + EXCLUDED.response_seconds, '
+            'response_calls = c.response_calls + EXCLUDED.response_calls'.format(
+                cube_table, cell_columns
+            ),
+            [key + tuple(cell) for key, cell in cells.items()],
+            page_size=1000
+        )
+        execute_values(
+            cursor.cursor,
+            'INSERT INTO {0} AS s ({1}, hll) VALUES %s '
+            'ON CONFLICT ({1}) DO UPDATE SET hll = metrics_hll_union(s.hll, EXCLUDED.hll)'.format(
+                sketch_table, sketch_columns
+            ),
+            [
+                key + ([r << 6 | registers[r] for r in sorted(registers)],)
+                for key, registers in sketches.items()
+            ],
+            page_size=1000
+        )
+
+def query_cube(group_by, measures=('calls',), filters=None, exclude=None,
+        start_date=None, end_date=None, approx=False):
+    """
+    Answers a slice of the calls from the cube.
+    @param group_by: A list of dimension names to group by, or an empty
+    list for one row of totals.
+    @param measures: Measure names: calls, incidents (distinct incident
+    numbers), days (distinct call dates), avg_dispatch_time (received to
+    dispatched) and avg_response_time (received to on scene).
+    @param filters: A dictionary of dimension name to a list of filter
+    values; calls must match one of the values of every dimension.
+    @param exclude: A dictionary of dimension name to a list of values to
+    leave out.
+    @param start_date: The first call date to include.
+    @param end_date: The last call date to include.
+    @param approx: Estimate incidents from the union of the matching
+    incident sketches instead of counting them exactly.
+    @return: A list of dictionaries of the dimension values and measures,
+    ordered by the dimensions. Average times are timedeltas, or None when
+    no call in the group has the interval. Raises a ValueError for unknown
+    dimensions or measures, invalid filter values and estimated incidents
+    by dimensions the sketches don't have.
+    """
+    unknown = [n for n in list(group_by) + list(filters or {}) + list(exclude or {})
+        if n not in DIMENSIONS]
+    unknown += [m for m in measures if m not in MEASURES]
+    if unknown:
+        raise ValueError('Unknown dimension or measure: {0}.'.format(', '.join(unknown)))
+
+    if 'incidents' in measures and approx:
+        unknown = [n for n in list(group_by) + list(filters or {}) + list(exclude or {})
+            if n not in SKETCH_DIMENSIONS]
+        if unknown:
+            raise ValueError('Incidents can\'t be estimated by: {0}.'.format(', '.join(unknown)))
+
+    # Conditions on the cells and on the calls, with the filter values as
+    # parameters
+    conditions = []
+    call_conditions = []
+    params = []
+
+    for values, operator in ((filters, '= ANY(%s)'), (exclude, '<> ALL(%s)')):
+        for name, raw in (values or {}).items():
+            expression, call_expression, parse = DIMENSIONS[name]
+            conditions.append('{0} {1}'.format(expression, operator))
+            params.append([parse(v) for v in raw])
+
+            # NULL matches '' on the calls table
+            if name in NULLABLE_DIMENSIONS and values is filters:
+                call_conditions.append('({0} = ANY(%s){1})'.format(
+                    name, ' OR {0} IS NULL'.format(name) if '' in params[-1] else ''
+                ))
+            elif name in NULLABLE_DIMENSIONS:
+                call_conditions.append("COALESCE({0}, '') <> ALL(%s)".format(name))
+            else:
+                call_conditions.append('{0} {1}'.format(call_expression, operator))
+
+    if start_date:
+        conditions.append('call_date >= %s')
+        call_conditions.append('call_date >= %s')
+        params.append(start_date)
+
+    if end_date:
+        conditions.append('call_date <= %s')
+        call_conditions.append('call_date <= %s')
+        params.append(end_date)
+
+    expressions = [DIMENSIONS[name][0] for name in group_by]
+    table = connection.ops.quote_name(CallCube._meta.db_table)
+    group = 'GROUP BY {0} ORDER BY {0}'.format(
+        ', '.join(str(i) for i in range(1, len(group_by) + 1))
+    ) if group_by else ''
+
+    def run(select, source, conditions=conditions):
+        where = 'WHERE ' + ' AND '.join(conditions) if conditions else ''
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT {0} FROM {1} {2} {3}'.format(', '.join(select), source, where, group),
+                params
+            )
+            return cursor.fetchall()
+
+    aggregates = [m for m in measures if m in MEASURE_SQL]
+    if aggregates or 'incidents' not in measures:
+        rows = run(expressions + [MEASURE_SQL[m] for m in aggregates] or ['COUNT(*)'], table)
+
+    # Incident sets of different cells overlap, so distinct incidents are
+    # estimated from the union of the matching sketches: the highest rank of
+    # each register across them. Exact counts come from the calls table,
+    # where the filter and group columns of the views are covered by
+    # metrics_call_nbhd_date_idx.
+    if 'incidents' in measures and approx:
+        aliases = ['d{0}'.format(i) for i in range(len(group_by))]
+        where = 'WHERE ' + ' AND '.join(conditions) if conditions else ''
+        registers = (
+            'SELECT {0} e >> 6 AS register, MAX(e & 63) AS rank '
+            'FROM {1}, unnest(hll) AS e {2} GROUP BY {3}'.format(
+                ''.join('{0} AS {1}, '.format(e, a) for e, a in zip(expressions, aliases)),
+                connection.ops.quote_name(IncidentSketch._meta.db_table), where,
+                ', '.join(aliases + ['register'])
+            )
+        )
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT {0} FROM ({1}) AS registers {2}'.format(
+                    ', '.join(aliases + ['COUNT(*)', 'SUM(power(2.0::float8, -rank))']), registers,
+                    'GROUP BY ' + ', '.join(aliases) if aliases else ''
+                ),
+                params
+            )
+            incidents = {
+                row[:-2]: hll_estimate(row[-2], float(row[-1] or 0))
+                for row in cursor.fetchall()
+            }
+    elif 'incidents' in measures:
+        incidents = {
+            tuple('' if value is None else value for value in row[:-1]): row[-1]
+            for row in run(
+                [DIMENSIONS[name][1] for name in group_by] + ['COUNT(DISTINCT incident_number)'],
+                connection.ops.quote_name(Call._meta.db_table), call_conditions
+            )
+        }
+
+    # Without other measures the groups are those with incidents, so the
+    # cube isn't read
+    if not aggregates and 'incidents' in measures:
+        rows = sorted(incidents)
+
+    results = []
+    for row in rows:
+        keys = row[:len(group_by)]
+        result = {}
+        for name, value in zip(group_by, keys):
+            if name in NULLABLE_DIMENSIONS and value == '':
+                value = None
+
+            result[name] = value
+
+        for name, value in zip(aggregates, row[len(group_by):]):
+            if name in ('avg_dispatch_time', 'avg_response_time'):
+                value = datetime.timedelta(seconds=value) if value is not None else None
+
+            result[name] = value
+
+        if 'incidents' in measures:
+            result['incidents'] = incidents.get(tuple(keys), 0)
+
+        results.append(result)
+
+    return results
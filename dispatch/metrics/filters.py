@@ -0,0 +1,76 @@
+from django.utils.dateparse import parse_date
+
+def parse_date_param(params, name):
+    """
+    Returns the date for a YYYY-MM-DD request parameter, or None if it's
+    missing. Raises a ValueError if the value is not a valid date.
+    """
+    value = params.get(name)
+
+    if not value:
+        return None
+
+    try:
+        date = parse_date(value)
+    except ValueError:
+        date = None
+
+    if date is None:
+        raise ValueError('Invalid {0} provided.'.format(name))
+
+    return date
+
+def get_list_param(params, name):
+    """
+    Returns the non-empty values of a request parameter that may be given
+    more than once.
+    """
+    values = params.getlist(name) if hasattr(params, 'getlist') else [params.get(name)]
+    return [v for v in values if v]
+
+def filter_calls(calls, params):
+    """
+    Filters a Call QuerySet by the optional battalion, neighborhood,
+    start_date and end_date request parameters. Battalion and neighborhood
+    may be repeated to match any of the values. Dates are inclusive and
+    matched against call_date. Raises a ValueError for invalid dates.
+    """
+    battalions = get_list_param(params, 'battalion')
+    if battalions:
+        calls = calls.filter(battalion__in=battalions)
+
+    neighborhoods = get_list_param(params, 'neighborhood')
+    if neighborhoods:
+        calls = calls.filter(neighborhood_district__in=neighborhoods)
+
+    start_date = parse_date_param(params, 'start_date')
+    if start_date:
+        calls = calls.filter(call_date__gte=start_date)
+
+    end_date = parse_date_param(params, 'end_date')
+    if end_date:
+        calls = calls.filter(call_date__lte=end_date)
+
+    return calls
+
+def get_cube_filters(params):
+    """
+    Returns the cube filters for the optional battalion, neighborhood,
+    start_date and end_date request parameters, as accepted by filter_calls,
+    as a tuple of a dimension filter dictionary, the start date and the end
+    date. Raises a ValueError for invalid dates.
+    """
+    filters = {}
+
+    battalions = get_list_param(params, 'battalion')
+    if battalions:
+        filters['battalion'] = battalions
+
+    neighborhoods = get_list_param(params, 'neighborhood')
+    if neighborhoods:
+        filters['neighborhood_district'] = neighborhoods
+
+    return (
+        filters, parse_date_param(params, 'start_date'),
+        parse_date_param(params, 'end_date')
+    )
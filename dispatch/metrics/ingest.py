@@ -0,0 +1,595 @@
+import csv
+import hashlib
+import io
+from decimal import Decimal
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import Call, minute_of_day
+
+# Fields computed while loading from another parsed column, as
+# (field, source field, function) tuples
+DERIVED_COLUMNS = [
+    ('received_minute', 'received_timestamp', minute_of_day),
+]
+
+# Fields that are derived while loading, or by the database for point,
+# rather than read from the CSV
+DERIVED_FIELDS = ['point', 'row_hash'] + [d[0] for d in DERIVED_COLUMNS]
+
+def row_hash(values):
+    """
+    Returns the MD5 hex digest of a record's raw CSV values, which changes
+    whenever any loaded value of the row changes.
+    """
+    return hashlib.md5('\x1f'.join(values).encode('utf-8')).hexdigest()
+
+def parse_text(value):
+    """
+    Returns the raw text value of a column.
+    """
+    return value
+
+def parse_nullable_text(value):
+    """
+    Returns the text value of a column, or None for an empty column.
+    """
+    return value if value else None
+
+def parse_integer(value):
+    """
+    Returns the integer value of a column, or None for an empty column.
+    """
+    return int(value) if value else None
+
+def parse_decimal(value):
+    """
+    Returns the Decimal value of a column, or None for an empty column.
+    """
+    return Decimal(value) if value else None
+
+def parse_boolean(value):
+    """
+    Returns the boolean value of a column, accepting the spellings used by
+    the city data exports.
+    """
+    return value.strip().lower() in ('true', 't', '1', 'yes', 'y')
+
+def parse_date_value(value):
+    """
+    Returns the date value of a column, or None for an empty column.
+    Timestamps are accepted and truncated to their date.
+    """
+    if not value:
+        return None
+
+    return parse_date(value[:10])
+
+def parse_timestamp(value):
+    """
+    Returns the timezone aware datetime value of a column, or None for an
+    empty column. Exports suffix the timestamps with " UTC", which is
+    stripped before parsing.
+    """
+    if not value:
+        return None
+
+    if value.endswith(' UTC'):
+        value = value[:-4]
+
+    timestamp = parse_datetime(value)
+
+    if timestamp is None:
+        raise ValueError('Invalid timestamp "{0}".'.format(value))
+
+    # Timestamps without an offset are treated as UTC
+    if timezone.is_naive(timestamp):
+        timestamp = timezone.make_aware(timestamp, timezone.utc)
+
+    return timestamp
+
+# Parser for each internal field type of the Call model
+PARSERS = {
+    'AutoField': parse_integer,
+    'BooleanField': parse_boolean,
+    'CharField': parse_text,
+    'DateField': parse_date_value,
+    'DateTimeField': parse_timestamp,
+    'DecimalField': parse_decimal,
+    'IntegerField': parse_integer,
+    'TextField': parse_text,
+}
+
+def get_parser(field):
+    """
+    Returns the parser for a Call model field. Empty values of nullable text
+    fields are stored as NULL.
+    """
+    internal_type = field.get_internal_type()
+
+    if internal_type in ('CharField', 'TextField') and field.null:
+        return parse_nullable_text
+
+    return PARSERS[internal_type]
+
+class CallReader:
+    """
+    Streams Call rows out of a dispatch CSV export in batches.
+
+    The reader tracks the byte offset of the end of each record, so a load
+    that is interrupted can be resumed from the last committed batch.
+    """
+
+    def __init__(self, csv_file, offset=0, end=None):
+        """
+        @param csv_file: A file object opened in binary mode.
+        @param offset: The byte offset of the first record to read. An offset
+        of 0 starts after the header row.
+        @param end: Stop before the first record starting at or after this
+        byte offset, or read to the end of the file by default.
+        """
+        self.file = csv_file
+        self.position = 0
+        self.end = end
+
+        # The header is always read from the start of the file
+        self.file.seek(0)
+        header = next(csv.reader([self.file.readline().decode('utf-8-sig')]))
+        self.position = max(offset, self.file.tell())
+        self.file.seek(self.position)
+
+        # Resolve the model field for each CSV column once, rather than
+        # looking up the field type for every value.
+        fields = {f.name: f for f in Call._meta.concrete_fields}
+        self.indexes = []
+        self.columns = []
+        self.parsers = []
+
+        for index, name in enumerate(header):
+            name = name.strip()
+
+            if name in fields and not fields[name].primary_key \
+                    and name not in DERIVED_FIELDS:
+                self.indexes.append(index)
+                self.columns.append(name)
+                self.parsers.append(get_parser(fields[name]))
+
+        missing = [n for n in ('latitude', 'longitude') if n not in self.columns]
+        if missing:
+            raise ValueError('Missing column(s): {0}.'.format(', '.join(missing)))
+
+        # Derived values are appended after the parsed columns
+        self.derived = []
+        for name, source, function in DERIVED_COLUMNS:
+            if source in self.columns:
+                self.derived.append((self.columns.index(source), function))
+                self.columns.append(name)
+
+        # The content hash of each row is the last column
+        self.columns.append('row_hash')
+
+    def lines(self):
+        """
+        Yields decoded lines, recording the byte offset after each line.
+        """
+        end = self.end
+
+        for line in iter(self.file.readline, b''):
+            self.position = self.file.tell()
+            yield line.decode('utf-8')
+
+            if end is not None and self.position >= end:
+                break
+
+    def rows(self, offsets=False):
+        """
+        Yields a tuple of parsed values for each record, in the order of
+        the columns attribute.
+        @param offsets: Whether to append the byte offset of the end of each
+        record, which orders records across byte ranges of the file.
+        """
+        indexes = self.indexes
+        columns = list(zip(indexes, self.parsers))
+        derived = self.derived
+
+        for record in csv.reader(self.lines()):
+            # Skip blank lines
+            if not record:
+                continue
+
+            row = tuple(parse(record[index]) for index, parse in columns)
+
+            if derived:
+                row += tuple(function(row[index]) for index, function in derived)
+
+            row += (row_hash([record[index] for index in indexes]),)
+
+            if offsets:
+                row += (self.position,)
+
+            yield row
+
+    def batches(self, batch_size):
+        """
+        Yields lists of at most batch_size rows along with the byte offset
+        at the end of the batch's last record.
+        """
+        batch = []
+
+        for row in self.rows():
+            batch.append(row)
+
+            if len(batch) >= batch_size:
+                yield batch, self.position
+                batch = []
+
+        if batch:
+            yield batch, self.position
+
+def copy_text(value):
+    """
+    Formats a value for the PostgreSQL COPY text format.
+    """
+    if value is None:
+        return '\\N'
+
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+
+    return (
+        str(value).replace('\\', '\\\\').replace('\t', '\\t')
+        .replace('\n', '\\n').replace('\r', '\\r')
+    )
+
+def copy_line(row):
+    """
+    Returns a row as a line of PostgreSQL COPY text.
+    """
+    return '\t'.join(copy_text(v) for v in row) + '\n'
+
+class CopyWriter:
+    """
+    Writes batches of parsed rows with PostgreSQL COPY. Points are set by
+    the calls table's trigger from the latitude and longitude.
+    """
+
+    def __init__(self, connection, reader, table=None, ordered=False):
+        """
+        @param table: The table copied into; the calls table by default.
+        @param ordered: Whether rows end with their position in the file,
+        copied into the load_order column of a staging table.
+        """
+        self.connection = connection
+        self.reader = reader
+        self.sql = 'COPY {0} ({1}{2}) FROM STDIN'.format(
+            connection.ops.quote_name(table or Call._meta.db_table),
+            self.column_list(reader.columns),
+            ', ' + StagingMerge.order_column if ordered else ''
+        )
+
+    def column_list(self, columns):
+        """
+        Returns the quoted, comma separated database columns of Call fields.
+        """
+        return ', '.join(
+            self.connection.ops.quote_name(Call._meta.get_field(c).column)
+            for c in columns
+        )
+
+    def write(self, rows):
+        """
+        Copies the rows into the table.
+        """
+        buffer = io.StringIO()
+
+        for row in rows:
+            buffer.write(copy_line(row))
+
+        buffer.seek(0)
+        with self.connection.cursor() as cursor:
+            cursor.cursor.copy_expert(self.sql, buffer)
+
+class CopyStream:
+    """
+    File-like object that formats rows for COPY as they are read, so a
+    whole CSV can be streamed through one COPY without holding it in memory.
+    """
+
+    def __init__(self, rows):
+        self.lines = (copy_line(row) for row in rows)
+        self.pending = ''
+        self.rows = 0
+
+    def read(self, size=-1):
+        """
+        Returns up to size characters of COPY text, or everything left when
+        size is negative. An empty string marks the end of the rows.
+        """
+        chunks = [self.pending]
+        length = len(self.pending)
+
+        while size < 0 or length < size:
+            line = next(self.lines, None)
+            if line is None:
+                break
+
+            chunks.append(line)
+            length += len(line)
+            self.rows += 1
+
+        data = ''.join(chunks)
+
+        if size < 0:
+            self.pending = ''
+            return data
+
+        self.pending = data[size:]
+        return data[:size]
+
+    def readline(self):
+        """
+        Returns the rest of the current line of COPY text, including the
+        newline, or an empty string at the end of the rows.
+        """
+        # A sized read may have left part of a line, or several lines,
+        # pending
+        if '\n' in self.pending:
+            line, self.pending = self.pending.split('\n', 1)
+            return line + '\n'
+
+        line = next(self.lines, '')
+        if line:
+            self.rows += 1
+
+        line, self.pending = self.pending + line, ''
+        return line
+
+class ChangeSet:
+    """
+    The calls affected by merging rows into the calls table: the number of
+    inserted, updated and unchanged rows, and the call dates, neighborhoods,
+    addresses and points of the old and new versions of every changed call.
+    """
+
+    def __init__(self):
+        self.inserted = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.dates = set()
+        self.neighborhoods = set()
+        self.addresses = set()
+        # (latitude, longitude) of the replaced and the new versions
+        self.removed_points = []
+        self.added_points = []
+
+    @property
+    def changed(self):
+        return self.inserted + self.updated
+
+    def add_versions(self, versions, points):
+        """
+        Records (call_date, neighborhood, address, latitude, longitude)
+        tuples of changed calls, appending their points to a list.
+        """
+        for call_date, neighborhood, address, lat, lng in versions:
+            self.dates.add(call_date)
+            self.neighborhoods.add(neighborhood)
+            self.addresses.add(address)
+            points.append((lat, lng))
+
+    def update(self, other):
+        """
+        Adds the counts and affected dates, neighborhoods and addresses of
+        another change set to this one. Points are only needed to update the
+        rollups of a batch, so they aren't accumulated.
+        """
+        self.inserted += other.inserted
+        self.updated += other.updated
+        self.unchanged += other.unchanged
+        self.dates |= other.dates
+        self.neighborhoods |= other.neighborhoods
+        self.addresses |= other.addresses
+
+    def as_dict(self):
+        """
+        Returns the counts and the affected call dates and neighborhoods,
+        in a form that can be serialized to JSON.
+        """
+        return {
+            "inserted": self.inserted,
+            "updated": self.updated,
+            "unchanged": self.unchanged,
+            "dates": sorted(d.isoformat() for d in self.dates if d is not None),
+            "neighborhoods": sorted(n for n in self.neighborhoods if n is not None),
+        }
+
+class StagingMerge:
+    """
+    Set-based merge of a staging table of parsed rows into the calls table,
+    keyed on row_id. Rows whose content hash matches the stored call are
+    dropped from the staging table, and the rest insert new calls or update
+    existing ones with INSERT ... ON CONFLICT DO UPDATE.
+    """
+
+    # Column of the staging table holding each row's position in the file,
+    # since concurrent COPYs don't store rows in file order
+    order_column = 'load_order'
+
+    # Values of a call that determine the rollups it counts towards
+    version_fields = ['call_date', 'neighborhood_district', 'address', 'latitude', 'longitude']
+
+    def __init__(self, connection, columns, staging_table):
+        """
+        @param columns: The Call field names of the staging table's columns.
+        @param staging_table: The name of the staging table.
+        """
+        missing = [n for n in ('row_id', 'call_date', 'address') if n not in columns]
+        if missing:
+            raise ValueError('Missing column(s): {0}.'.format(', '.join(missing)))
+
+        quote = connection.ops.quote_name
+        self.calls = quote(Call._meta.db_table)
+        self.staging = quote(staging_table)
+        self.columns = ', '.join(quote(Call._meta.get_field(c).column) for c in columns)
+        self.updates = ', '.join(
+            '{0} = EXCLUDED.{0}'.format(quote(Call._meta.get_field(c).column))
+            for c in columns if c not in ('row_id', 'call_date')
+        )
+        self.versions = ', '.join(
+            'c.' + quote(Call._meta.get_field(c).column) for c in self.version_fields
+        )
+
+    def create_sql(self, temporary=True):
+        """
+        Returns the statement creating the empty staging table, either as a
+        temporary table or as an unlogged table other connections can see.
+        The table has the calls' columns and the load_order column.
+        """
+        return (
+            'CREATE {0} TABLE IF NOT EXISTS {1} AS SELECT {2}, NULL::bigint AS {3} '
+            'FROM {4} WITH NO DATA'.format(
+                'TEMPORARY' if temporary else 'UNLOGGED', self.staging, self.columns,
+                self.order_column, self.calls
+            )
+        )
+
+    def versions_of(self, cursor, sql, changes, points):
+        """
+        Records the versions of the calls selected by a statement in a
+        change set. Without a points list, only the count and the distinct
+        dates, neighborhoods and addresses are fetched, which keeps merges
+        of millions of rows out of Python memory.
+        @return: The number of versions.
+        """
+        if points is not None:
+            cursor.execute(sql)
+            versions = cursor.fetchall()
+            changes.add_versions(versions, points)
+            return len(versions)
+
+        cursor.execute(
+            'WITH v AS ({0}) SELECT COUNT(*), array_agg(DISTINCT call_date), '
+            'array_agg(DISTINCT neighborhood_district), array_agg(DISTINCT address) '
+            'FROM v'.format(sql)
+        )
+        count, dates, neighborhoods, addresses = cursor.fetchone()
+        changes.dates.update(dates or [])
+        changes.neighborhoods.update(neighborhoods or [])
+        changes.addresses.update(addresses or [])
+        return count
+
+    def merge(self, cursor, points=True):
+        """
+        Merges the staging table into the calls table. Of several rows with
+        the same row_id, the one latest in the file, by load_order, wins.
+        @param points: Whether to record the points of the old and new
+        versions of changed calls, for incremental grid updates.
+        @return: The ChangeSet of the merge.
+        """
+        changes = ChangeSet()
+
+        # A row can only be merged once per statement
+        cursor.execute(
+            'DELETE FROM {0} a USING {0} b '
+            'WHERE a.row_id = b.row_id AND a.{1} < b.{1}'.format(self.staging, self.order_column)
+        )
+
+        cursor.execute(
+            'DELETE FROM {0} s USING {1} c '
+            'WHERE c.row_id = s.row_id AND c.row_hash = s.row_hash'.format(self.staging, self.calls)
+        )
+        changes.unchanged = cursor.rowcount
+
+        # The versions being replaced, including any stored under another
+        # call_date, which are deleted since the new version belongs in
+        # another partition
+        changes.updated = self.versions_of(
+            cursor,
+            'SELECT {0} FROM {1} c JOIN {2} s ON c.row_id = s.row_id'.format(
+                self.versions, self.calls, self.staging
+            ),
+            changes, changes.removed_points if points else None
+        )
+
+        cursor.execute(
+            'DELETE FROM {0} c USING {1} s '
+            'WHERE c.row_id = s.row_id AND c.call_date <> s.call_date'.format(self.calls, self.staging)
+        )
+
+        merged = self.versions_of(
+            cursor,
+            'INSERT INTO {0} AS c ({1}) SELECT {1} FROM {2} '
+            'ON CONFLICT (row_id, call_date) DO UPDATE SET {3} '
+            'RETURNING {4}'.format(self.calls, self.columns, self.staging, self.updates, self.versions),
+            changes, changes.added_points if points else None
+        )
+        changes.inserted = merged - changes.updated
+
+        return changes
+
+class UpsertWriter(CopyWriter):
+    """
+    Merges batches of parsed rows into the calls table keyed on row_id.
+    Each batch is copied into a temporary staging table and merged from
+    there with a StagingMerge.
+    """
+    staging_table = 'metrics_call_staging'
+
+    def __init__(self, connection, reader):
+        self.merger = StagingMerge(connection, reader.columns, self.staging_table)
+        super().__init__(connection, reader, self.staging_table, ordered=True)
+
+    def write(self, rows):
+        """
+        Merges the rows into the calls table. Within a batch, the last row
+        with a row_id wins.
+        @return: The ChangeSet of the batch.
+        """
+        with self.connection.cursor() as cursor:
+            # Temporary tables live as long as the connection, but creating
+            # one is rolled back with a failed batch
+            cursor.execute(self.merger.create_sql())
+            cursor.execute('TRUNCATE {0}'.format(self.merger.staging))
+
+            # Rows are ordered by their index in the batch
+            super().write(row + (index,) for index, row in enumerate(rows))
+
+            return self.merger.merge(cursor)
+
+class BulkCreateWriter:
+    """
+    Writes batches of parsed rows with bulk_create. Like COPY, it leaves
+    points to the calls table's trigger.
+    """
+
+    def __init__(self, connection, reader):
+        self.reader = reader
+
+    def write(self, rows):
+        """
+        Creates a Call for each of the rows.
+        """
+        columns = self.reader.columns
+        calls = [Call(**dict(zip(columns, row))) for row in rows]
+        Call.objects.bulk_create(calls, batch_size=len(calls))
+
+def get_writer(connection, reader, method=None):
+    """
+    Returns the writer for the given method name, using COPY by default on
+    PostgreSQL and bulk_create elsewhere. The upsert method merges rows into
+    existing calls by row_id.
+    """
+    if method is None:
+        method = 'copy' if connection.vendor == 'postgresql' else 'bulk_create'
+
+    if method == 'copy':
+        return CopyWriter(connection, reader)
+
+    if method == 'upsert':
+        return UpsertWriter(connection, reader)
+
+    return BulkCreateWriter(connection, reader)
@@ -0,0 +1,65 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from metrics.cube import refresh_call_cube
+from metrics.models import Neighborhood
+from metrics.neighborhoods import (NeighborhoodIndex, assign_in_database,
+    assign_in_python)
+from metrics.cache import bump_dataset_version
+
+class Command(BaseCommand):
+    """
+    Management command for backfilling Call.neighborhood_district from the
+    neighborhood polygons.
+    """
+    help = 'Assigns a neighborhood district to each call from its point.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--mode', choices=['python', 'sql'], default='sql',
+            help='Prepared geometry index in Python, or a PostGIS UPDATE join '
+                 'against the neighborhood table.'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=100000,
+            help='Number of primary keys covered per transaction.'
+        )
+        parser.add_argument(
+            '--only-missing', action='store_true',
+            help='Only assign calls without a neighborhood district.'
+        )
+
+    def handle(self, *args, **options):
+        mode = options['mode']
+        if mode == 'sql' and connection.vendor != 'postgresql':
+            raise CommandError('The sql mode requires PostgreSQL with PostGIS.')
+
+        if not Neighborhood.objects.exists():
+            raise CommandError(
+                'No neighborhoods are loaded; run the load_neighborhoods command first.'
+            )
+
+        start = time.time()
+
+        if mode == 'sql':
+            total = assign_in_database(
+                options['batch_size'], options['only_missing'], log=self.stdout.write
+            )
+        else:
+            total = assign_in_python(
+                NeighborhoodIndex.from_database(), options['batch_size'],
+                options['only_missing'], log=self.stdout.write
+            )
+
+        # The cube is grouped by neighborhood, so it's rebuilt
+        if total:
+            refresh_call_cube()
+
+        # Invalidate cached API responses
+        bump_dataset_version()
+
+        self.stdout.write(self.style.SUCCESS(
+            'Assigned {0} calls in {1:.1f}s.'.format(total, time.time() - start)
+        ))
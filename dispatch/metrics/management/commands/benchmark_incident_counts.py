@@ -0,0 +1,97 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from metrics.cube import HLL_REGISTERS, query_cube
+
+# Neighborhoods and excluded call types used by the dashboard views
+NEIGHBORHOODS = [
+    "Mission", "Western Addition", "Sunset/Parkside",
+    "Financial District/South Beach", "South of Market"
+]
+EXCLUDED_TYPES = ["Citizen Assist / Service Call"]
+
+# Distinct incident queries of the views and the metrics API, as query_cube
+# keyword arguments
+QUERIES = {
+    'total': {'group_by': []},
+    'neighborhood_totals': {
+        'group_by': ['neighborhood_district'],
+        'exclude': {'call_type': EXCLUDED_TYPES}
+    },
+    'neighborhood_daily_counts': {
+        'group_by': ['call_date', 'neighborhood_district'],
+        'filters': {'neighborhood_district': NEIGHBORHOODS}
+    },
+    'battalion_months': {'group_by': ['battalion', 'month']},
+    'call_type_years': {'group_by': ['call_type', 'year']},
+}
+
+def median_time(function, repeat):
+    """
+    Returns the median of repeat runs of a function in milliseconds and the
+    result of the last run.
+    """
+    times = []
+
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append((time.perf_counter() - start) * 1000)
+
+    return statistics.median(times), result
+
+def relative_errors(exact, approx, group_by):
+    """
+    Returns the relative error of each group's estimated incidents against
+    the exact count.
+    """
+    estimates = {
+        tuple(row[name] for name in group_by): row['incidents'] for row in approx
+    }
+    errors = []
+
+    for row in exact:
+        key = tuple(row[name] for name in group_by)
+        if row['incidents']:
+            errors.append(abs(estimates.get(key, 0) - row['incidents']) / row['incidents'])
+
+    return errors
+
+class Command(BaseCommand):
+    """
+    Management command comparing exact distinct incident counts from the
+    calls table with the estimates from the incident sketches.
+    """
+    help = 'Benchmarks exact and approximate distinct incident counts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--repeat', type=int, default=5,
+            help='Number of runs per query; the median is reported.'
+        )
+
+    def handle(self, *args, **options):
+        repeat = max(options['repeat'], 1)
+
+        self.stdout.write('Sketches of {0} registers, standard error {1:.2%}.'.format(
+            HLL_REGISTERS, 1.04 / HLL_REGISTERS ** 0.5
+        ))
+        self.stdout.write('{0:<28}{1:>8}{2:>12}{3:>12}{4:>10}{5:>12}{6:>12}'.format(
+            'query', 'groups', 'exact ms', 'approx ms', 'speedup', 'mean error', 'max error'
+        ))
+
+        for name, query in QUERIES.items():
+            exact_ms, exact = median_time(
+                lambda: query_cube(measures=['incidents'], **query), repeat
+            )
+            approx_ms, approx = median_time(
+                lambda: query_cube(measures=['incidents'], approx=True, **query), repeat
+            )
+            errors = relative_errors(exact, approx, query['group_by']) or [0.0]
+
+            self.stdout.write('{0:<28}{1:>8}{2:>12.2f}{3:>12.2f}{4:>9.1f}x{5:>12.2%}{6:>12.2%}'.format(
+                name, len(exact), exact_ms, approx_ms, exact_ms / max(approx_ms, 1e-6),
+                statistics.mean(errors), max(errors)
+            ))
@@ -0,0 +1,119 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Avg, Count, F
+
+from metrics.columnar import CallSnapshot
+from metrics.models import Call
+
+# Neighborhoods and excluded call types used by the dashboard views
+NEIGHBORHOODS = [
+    "Mission", "Western Addition", "Sunset/Parkside",
+    "Financial District/South Beach", "South of Market"
+]
+EXCLUDED_TYPES = ["Citizen Assist / Service Call"]
+
+def orm_metrics(battalion):
+    """
+    Returns the ORM implementation of each dashboard metric by name.
+    """
+    return {
+        'average_dispatch_time': lambda: list(
+            Call.objects.values('call_type_group').annotate(
+                avg_dispatch_time=Avg(F('dispatch_timestamp') - F('received_timestamp'))
+            ).order_by('-avg_dispatch_time')
+        ),
+        'battalion_counts': lambda: list(
+            Call.objects.values('battalion').annotate(
+                count=Count('battalion')
+            ).order_by('battalion')
+        ),
+        'battalion_call_types': lambda: list(
+            Call.objects.filter(battalion=battalion).values('call_type').annotate(
+                call_count=Count('pk')
+            ).order_by('call_type')
+        ),
+        'neighborhood_daily_counts': lambda: list(
+            Call.objects.filter(neighborhood_district__in=NEIGHBORHOODS).values(
+                'call_date', 'neighborhood_district'
+            ).annotate(
+                calls=Count('pk'),
+                incidents=Count('incident_number', distinct=True)
+            ).order_by('call_date')
+        ),
+        'neighborhood_totals': lambda: list(
+            Call.objects.exclude(call_type__in=EXCLUDED_TYPES).values(
+                'neighborhood_district'
+            ).annotate(
+                calls=Count('pk'),
+                incidents=Count('incident_number', distinct=True)
+            ).order_by('incidents')
+        ),
+    }
+
+def snapshot_metrics(snapshot, battalion):
+    """
+    Returns the snapshot implementation of each dashboard metric by name.
+    """
+    return {
+        'average_dispatch_time': snapshot.average_dispatch_time,
+        'battalion_counts': snapshot.battalion_counts,
+        'battalion_call_types': lambda: snapshot.battalion_call_types(battalion),
+        'neighborhood_daily_counts': lambda: snapshot.neighborhood_daily_counts(NEIGHBORHOODS),
+        'neighborhood_totals': lambda: snapshot.neighborhood_totals(EXCLUDED_TYPES),
+    }
+
+def best_time(function, repeat):
+    """
+    Returns the fastest of repeat runs of a function in milliseconds.
+    """
+    times = []
+
+    for i in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append((time.perf_counter() - start) * 1000)
+
+    return min(times)
+
+class Command(BaseCommand):
+    """
+    Management command comparing the ORM and columnar snapshot
+    implementations of the dashboard metrics.
+    """
+    help = 'Benchmarks the dashboard metrics on the ORM and the columnar snapshot.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--repeat', type=int, default=5,
+            help='Number of runs per metric; the fastest is reported.'
+        )
+        parser.add_argument(
+            '--battalion', default='B02',
+            help='Battalion used for the call type distribution metric.'
+        )
+
+    def handle(self, *args, **options):
+        repeat = max(options['repeat'], 1)
+        battalion = options['battalion']
+
+        start = time.perf_counter()
+        snapshot = CallSnapshot.load()
+        self.stdout.write('Snapshot of {0} calls loaded in {1:.0f} ms.'.format(
+            snapshot.size, (time.perf_counter() - start) * 1000
+        ))
+
+        orm = orm_metrics(battalion)
+        columnar = snapshot_metrics(snapshot, battalion)
+
+        self.stdout.write('{0:<28}{1:>12}{2:>12}{3:>10}'.format(
+            'metric', 'orm ms', 'snapshot ms', 'speedup'
+        ))
+
+        for name in orm:
+            orm_ms = best_time(orm[name], repeat)
+            snapshot_ms = best_time(columnar[name], repeat)
+
+            self.stdout.write('{0:<28}{1:>12.2f}{2:>12.2f}{3:>9.1f}x'.format(
+                name, orm_ms, snapshot_ms, orm_ms / max(snapshot_ms, 1e-6)
+            ))
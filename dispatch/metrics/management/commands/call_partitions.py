@@ -0,0 +1,76 @@
+import datetime
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from metrics.cache import bump_dataset_version
+from metrics.partitions import (detach_partition, ensure_partitions,
+    list_partitions, month_start, months_between)
+from metrics.rollups import refresh_rollups
+
+def parse_month(value):
+    """
+    Returns the first day of a YYYY-MM month argument.
+    """
+    try:
+        return datetime.datetime.strptime(value, '%Y-%m').date()
+    except ValueError:
+        raise CommandError('Invalid month {0}; expected YYYY-MM.'.format(value))
+
+class Command(BaseCommand):
+    """
+    Management command for listing, creating and detaching the monthly
+    partitions of the calls table.
+    """
+    help = 'Lists, creates ahead of time or detaches monthly calls table partitions.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--create-through', metavar='YYYY-MM',
+            help='Create any missing partitions from the current month through this month.'
+        )
+        parser.add_argument(
+            '--detach-before', metavar='YYYY-MM',
+            help='Detach every partition for a month before this one.'
+        )
+        parser.add_argument(
+            '--archive-dir',
+            help='Write detached partitions here as gzipped CSV and drop them.'
+        )
+
+    def handle(self, *args, **options):
+        if options['create_through']:
+            end = parse_month(options['create_through'])
+            ensure_partitions(months_between(month_start(datetime.date.today()), end))
+
+        if options['detach_before']:
+            before = parse_month(options['detach_before'])
+            archive_dir = options['archive_dir']
+
+            if archive_dir:
+                os.makedirs(archive_dir, exist_ok=True)
+
+            detached = 0
+            for name, month, rows, size in list_partitions():
+                if month >= before:
+                    continue
+
+                archive_path = None
+                if archive_dir:
+                    archive_path = os.path.join(archive_dir, '{0}.csv.gz'.format(name))
+
+                detach_partition(name, archive_path)
+                detached += 1
+                self.stdout.write('Detached {0} (~{1} rows){2}.'.format(
+                    name, rows, ' to ' + archive_path if archive_path else ''
+                ))
+
+            # The detached calls leave the rollups and cached responses
+            if detached:
+                refresh_rollups()
+                bump_dataset_version()
+
+        self.stdout.write('{0:<24}{1:>12}{2:>12}'.format('partition', 'rows', 'MB'))
+
+        for name, month, rows, size in list_partitions():
+            self.stdout.write('{0:<24}{1:>12}{2:>12.1f}'.format(name, rows, size / 1e6))
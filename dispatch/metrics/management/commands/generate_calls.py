@@ -0,0 +1,51 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from metrics.synthetic import SCALES, SyntheticCalls
+
+def parse_rows(value):
+    """
+    Returns the row count for a scale name (10k, 1m, 10m) or a number.
+    """
+    if value.lower() in SCALES:
+        return SCALES[value.lower()]
+
+    try:
+        return int(value)
+    except ValueError:
+        raise CommandError('Invalid row count {0}.'.format(value))
+
+class Command(BaseCommand):
+    """
+    Management command for writing a synthetic dispatch CSV export.
+    """
+    help = 'Writes a synthetic San Francisco dispatch CSV for benchmarks.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_path', help='Output CSV path.')
+        parser.add_argument(
+            '--rows', default='10k',
+            help='Number of rows, or a scale: 10k, 1m or 10m (default: 10k).'
+        )
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help='Random seed; the same seed generates the same calls.'
+        )
+        parser.add_argument(
+            '--days', type=int,
+            help='Number of days the calls span (default: scaled to the row count).'
+        )
+
+    def handle(self, *args, **options):
+        rows = parse_rows(options['rows'])
+        start = time.time()
+
+        with open(options['csv_path'], 'w', newline='') as f:
+            SyntheticCalls(rows, options['seed'], days=options['days']).write_csv(f)
+
+        self.stdout.write(self.style.SUCCESS(
+            'Wrote {0} synthetic calls to {1} in {2:.1f}s.'.format(
+                rows, options['csv_path'], time.time() - start
+            )
+        ))
@@ -0,0 +1,185 @@
+import json
+import resource
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from metrics.ingest import CallReader, ChangeSet, get_writer
+from metrics.parallel import ingest_parallel
+from metrics.partitions import ensure_partitions
+from metrics.rollups import apply_changes, update_rollups
+from metrics.cache import bump_dataset_version
+
+class Command(BaseCommand):
+    """
+    Management command for streaming a dispatch CSV export into the calls
+    table in batches.
+    """
+    help = 'Streams a dispatch CSV export into the calls table.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_path', help='Path to the dispatch CSV export.')
+        parser.add_argument(
+            '--batch-size', type=int, default=10000,
+            help='Number of rows written per transaction.'
+        )
+        parser.add_argument(
+            '--offset', type=int, default=0,
+            help='Byte offset to resume from, as reported by a previous run.'
+        )
+        parser.add_argument(
+            '--method', choices=['copy', 'bulk_create', 'upsert'],
+            help='Write method (default: copy on PostgreSQL). upsert merges '
+                 'new and changed rows into existing calls by row_id.'
+        )
+        parser.add_argument(
+            '--changes',
+            help='With upsert or --workers, write the affected call dates and neighborhoods '
+                 'to this JSON file.'
+        )
+        parser.add_argument(
+            '--workers', type=int, default=1,
+            help='Parse the CSV in this many processes, each streaming its part '
+                 'into a staging table that is then merged by row_id.'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('Batch size must be at least 1.')
+
+        if options['workers'] > 1:
+            return self.handle_parallel(options)
+
+        try:
+            csv_file = open(options['csv_path'], 'rb')
+        except OSError as e:
+            raise CommandError('Unable to open CSV: {0}'.format(e))
+
+        with csv_file:
+            try:
+                reader = CallReader(csv_file, options['offset'])
+                writer = get_writer(connection, reader, options['method'])
+            except (StopIteration, ValueError) as e:
+                raise CommandError('Invalid CSV header: {0}'.format(e))
+
+            total = 0
+            changed = 0
+            merged = ChangeSet()
+            start = time.time()
+
+            try:
+                # Each batch is committed on its own, together with its rollup
+                # updates, so the reported offset is always safe to resume
+                # from.
+                call_date = reader.columns.index('call_date')
+
+                for rows, offset in reader.batches(batch_size):
+                    with transaction.atomic():
+                        # Create the monthly partitions of new call dates
+                        ensure_partitions({r[call_date] for r in rows})
+                        changes = writer.write(rows)
+
+                        # Merges only refresh the rollups of changed calls
+                        if changes is None:
+                            update_rollups(reader.columns, rows)
+                        else:
+                            apply_changes(changes)
+
+                    total += len(rows)
+
+                    if changes is None:
+                        changed += len(rows)
+                        summary = ''
+                    else:
+                        changed += changes.changed
+                        merged.update(changes)
+                        summary = ' ({0} inserted, {1} updated, {2} unchanged)'.format(
+                            merged.inserted, merged.updated, merged.unchanged
+                        )
+
+                    self.stdout.write(
+                        'Ingested {0} rows{1} ({2:.0f} rows/sec, peak RSS {3:.1f} MB); '
+                        'resume offset {4}.'.format(
+                            total, summary, total / max(time.time() - start, 1e-6),
+                            peak_rss_mb(), offset
+                        )
+                    )
+            finally:
+                # Invalidate cached API responses, including after a partial
+                # load whose committed batches are already visible. A merge
+                # that changed nothing keeps them.
+                if changed:
+                    bump_dataset_version()
+
+        if options['method'] == 'upsert':
+            self.write_changes(merged, options['changes'])
+
+        self.stdout.write(self.style.SUCCESS(
+            'Ingest complete: {0} rows in {1:.1f}s.'.format(total, time.time() - start)
+        ))
+
+    def handle_parallel(self, options):
+        """
+        Loads the CSV with a pool of worker processes and one merge.
+        """
+        if options['method'] not in (None, 'upsert') or options['offset']:
+            raise CommandError('--workers always merges by row_id; it cannot be '
+                               'combined with --method or --offset.')
+
+        start = time.time()
+
+        def log_shard(shard_start, shard_end, rows, seconds):
+            self.stdout.write(
+                'Shard {0}-{1}: {2} rows in {3:.1f}s ({4:.0f} rows/sec).'.format(
+                    shard_start, shard_end, rows, seconds, rows / max(seconds, 1e-6)
+                )
+            )
+
+        try:
+            changes = ingest_parallel(options['csv_path'], options['workers'], log_shard)
+        except (OSError, StopIteration, ValueError) as e:
+            raise CommandError('Unable to ingest CSV: {0}'.format(e))
+
+        if changes.changed:
+            bump_dataset_version()
+
+        total = changes.changed + changes.unchanged
+        self.write_changes(changes, options['changes'])
+        self.stdout.write(self.style.SUCCESS(
+            'Ingest complete: {0} rows ({1} inserted, {2} updated, {3} unchanged) '
+            'in {4:.1f}s ({5:.0f} rows/sec, peak RSS {6:.1f} MB).'.format(
+                total, changes.inserted, changes.updated, changes.unchanged,
+                time.time() - start, total / max(time.time() - start, 1e-6),
+                peak_rss_mb()
+            )
+        ))
+
+    def write_changes(self, changes, path=None):
+        """
+        Prints the call dates and neighborhoods affected by a merge, and
+        writes them to a JSON file when a path is given.
+        """
+        affected = changes.as_dict()
+        self.stdout.write('Affected dates: {0}; neighborhoods: {1}.'.format(
+            ', '.join(affected['dates']) or 'none',
+            ', '.join(affected['neighborhoods']) or 'none'
+        ))
+
+        if path:
+            with open(path, 'w') as f:
+                json.dump(affected, f, indent=2)
+
+def peak_rss_mb():
+    """
+    Returns the peak resident set size of the process in megabytes.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # ru_maxrss is reported in bytes on macOS and kilobytes elsewhere
+    if sys.platform == 'darwin':
+        return peak / (1024 * 1024)
+
+    return peak / 1024
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from metrics.cache import bump_dataset_version
+from metrics.neighborhoods import (NEIGHBORHOODS_PATH, load_neighborhoods,
+    read_neighborhoods)
+
+class Command(BaseCommand):
+    """
+    Management command for loading the neighborhood polygons into the
+    Neighborhood table.
+    """
+    help = 'Loads the San Francisco neighborhood polygons into the database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'json_path', nargs='?', default=NEIGHBORHOODS_PATH,
+            help='Path to the neighborhoods export (default: data/sf_neighborhoods.json).'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            neighborhoods = read_neighborhoods(options['json_path'])
+        except (OSError, ValueError, KeyError, IndexError) as e:
+            raise CommandError('Unable to read neighborhoods: {0}'.format(e))
+
+        count = load_neighborhoods(neighborhoods)
+
+        # Invalidate cached neighborhood lists
+        bump_dataset_version()
+
+        self.stdout.write(self.style.SUCCESS('Loaded {0} neighborhoods.'.format(count)))
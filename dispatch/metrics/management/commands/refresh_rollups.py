@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from metrics.rollups import refresh_rollups
+from metrics.cache import bump_dataset_version
+
+class Command(BaseCommand):
+    """
+    Management command for rebuilding the rollup tables from the calls table.
+    """
+    help = 'Rebuilds the rollup tables from the calls table.'
+
+    def handle(self, *args, **options):
+        start = time.time()
+        refresh_rollups()
+
+        # Invalidate cached API responses
+        bump_dataset_version()
+
+        self.stdout.write(self.style.SUCCESS(
+            'Rollups rebuilt in {0:.1f}s.'.format(time.time() - start)
+        ))
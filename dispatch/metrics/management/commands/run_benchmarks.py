@@ -0,0 +1,157 @@
+import datetime
+import io
+import json
+import os
+import tempfile
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from metrics.benchmarks import benchmark_urls, compare_results, get_commit
+from metrics.management.commands.generate_calls import parse_rows
+from metrics.management.commands.ingest_calls import peak_rss_mb
+from metrics.models import AddressStats, Call, CallCube, GridCell, IncidentSketch, Neighborhood
+from metrics.synthetic import SyntheticCalls
+
+class Command(BaseCommand):
+    """
+    Management command that loads synthetic calls, then times ingest,
+    neighborhood assignment and every URL, and saves the results as JSON.
+    """
+    help = 'Benchmarks ingest, neighborhood assignment and every URL on synthetic data.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rows', default='10k',
+            help='Number of synthetic rows, or a scale: 10k, 1m or 10m (default: 10k).'
+        )
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for the synthetic calls.')
+        parser.add_argument('--csv', help='Load this CSV instead of generating one.')
+        parser.add_argument(
+            '--reset', action='store_true',
+            help='Empty the calls table and rollups before loading. Required if calls are loaded.'
+        )
+        parser.add_argument(
+            '--skip-load', action='store_true',
+            help='Only time the URLs, on the calls already loaded.'
+        )
+        parser.add_argument('--repeat', type=int, default=20, help='Timed runs per request.')
+        parser.add_argument(
+            '--cached', action='store_true',
+            help='Keep response and tile caches between runs instead of timing the full work.'
+        )
+        parser.add_argument('--output', help='Results file (default: benchmark-<commit>-<rows>.json).')
+        parser.add_argument('--compare', help='Earlier results file to compare median latencies with.')
+
+    def handle(self, *args, **options):
+        results = {
+            "commit": get_commit(),
+            "timestamp": datetime.datetime.utcnow().isoformat() + 'Z',
+            "database": '{0} {1}'.format(connection.vendor, getattr(connection, 'pg_version', '')).strip(),
+            "cached": options['cached'],
+        }
+
+        if not options['skip_load']:
+            if Call.objects.exists():
+                if not options['reset']:
+                    raise CommandError('Calls are already loaded; pass --reset to replace them or --skip-load.')
+
+                self.reset()
+
+            results.update(self.load(options))
+
+        results["rows"] = Call.objects.count()
+        self.stdout.write('Timing URLs on {0} calls.'.format(results["rows"]))
+        self.stdout.write('{0:<44}{1:>8}{2:>10}{3:>10}{4:>9}{5:>12}'.format(
+            'url', 'status', 'p50 ms', 'p95 ms', 'queries', 'peak KB'
+        ))
+
+        def log(name, result):
+            self.stdout.write('{0:<44}{1:>8}{2:>10.2f}{3:>10.2f}{4:>9}{5:>12.1f}'.format(
+                name, result["status"], result["p50_ms"], result["p95_ms"],
+                result["queries"], result["peak_memory_kb"]
+            ))
+
+        try:
+            results["endpoints"] = benchmark_urls(max(options['repeat'], 1), options['cached'], log)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        results["peak_rss_mb"] = round(peak_rss_mb(), 1)
+
+        output = options['output'] or 'benchmark-{0}-{1}.json'.format(
+            results["commit"] or 'unknown', results["rows"]
+        )
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+        self.stdout.write(self.style.SUCCESS('Saved results to {0}.'.format(output)))
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                previous = json.load(f)
+
+            self.stdout.write('{0:<44}{1:>10}{2:>10}{3:>9}'.format('url', 'old p50', 'new p50', 'change'))
+            for name, old, new, change in compare_results(previous, results):
+                self.stdout.write('{0:<44}{1:>10.2f}{2:>10.2f}{3:>+8.1f}%'.format(name, old, new, change))
+
+    def reset(self):
+        """
+        Empties the calls table and the rollups built from it.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute('TRUNCATE {0}'.format(', '.join(
+                connection.ops.quote_name(model._meta.db_table)
+                for model in (Call, AddressStats, GridCell, CallCube, IncidentSketch)
+            )))
+
+    def load(self, options):
+        """
+        Generates the synthetic CSV unless one is given, then times loading it
+        and assigning neighborhoods. Returns the timings.
+        """
+        rows = parse_rows(options['rows'])
+        timings = {}
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = options['csv']
+
+            if not path:
+                path = os.path.join(directory, 'calls.csv')
+                start = time.time()
+
+                with open(path, 'w', newline='') as f:
+                    SyntheticCalls(rows, options['seed']).write_csv(f)
+
+                self.stdout.write('Generated {0} calls in {1:.1f}s.'.format(rows, time.time() - start))
+
+            start = time.time()
+            call_command('ingest_calls', path, stdout=io.StringIO())
+            elapsed = time.time() - start
+            loaded = Call.objects.count()
+
+            timings["ingest"] = {
+                "rows": loaded,
+                "seconds": round(elapsed, 3),
+                "rows_per_sec": round(loaded / max(elapsed, 1e-6), 1),
+                "peak_rss_mb": round(peak_rss_mb(), 1),
+            }
+            self.stdout.write('Ingested {0} calls in {1:.1f}s.'.format(loaded, elapsed))
+
+        # The polygons are only loaded once, outside the timing
+        if not Neighborhood.objects.exists():
+            call_command('load_neighborhoods', stdout=io.StringIO())
+
+        start = time.time()
+        call_command('assign_neighborhoods', stdout=io.StringIO())
+        elapsed = time.time() - start
+
+        timings["assign_neighborhoods"] = {
+            "seconds": round(elapsed, 3),
+            "rows_per_sec": round(loaded / max(elapsed, 1e-6), 1),
+        }
+        self.stdout.write('Assigned neighborhoods in {0:.1f}s.'.format(elapsed))
+
+        return timings
@@ -0,0 +1,36 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from metrics.cache import get_dataset_version
+from metrics.columnar import CallSnapshot
+
+class Command(BaseCommand):
+    """
+    Management command for writing the columnar snapshot file that web
+    workers memory map on startup.
+    """
+    help = 'Writes the columnar snapshot of the calls table to disk.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?',
+            help='Output file (default: the ANALYTICS_SNAPSHOT_PATH setting).'
+        )
+
+    def handle(self, *args, **options):
+        path = options['path'] or getattr(settings, 'ANALYTICS_SNAPSHOT_PATH', None)
+        if not path:
+            raise CommandError('No path given and ANALYTICS_SNAPSHOT_PATH is not set.')
+
+        start = time.time()
+        version, updated = get_dataset_version()
+        snapshot = CallSnapshot.load(version=version)
+        snapshot.save(path)
+
+        self.stdout.write(self.style.SUCCESS(
+            'Wrote snapshot of {0} calls at version {1} to {2} in {3:.1f}s.'.format(
+                snapshot.size, version, path, time.time() - start
+            )
+        ))
@@ -0,0 +1,32 @@
+from django.contrib.postgres.operations import BtreeGistExtension
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('metrics', '0011_auto_20180319_0058'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='call',
+            name='received_minute',
+            field=models.SmallIntegerField(blank=True, db_index=True, null=True),
+        ),
+        # Backfill the minute of day for existing calls
+        migrations.RunSQL(
+            "UPDATE metrics_call SET received_minute = "
+            "EXTRACT(HOUR FROM received_timestamp AT TIME ZONE 'UTC') * 60 + "
+            "EXTRACT(MINUTE FROM received_timestamp AT TIME ZONE 'UTC')",
+            migrations.RunSQL.noop
+        ),
+        # Composite index so the nearby query filters on the point bounding
+        # box and the minute of day in a single index scan
+        BtreeGistExtension(),
+        migrations.RunSQL(
+            'CREATE INDEX metrics_call_point_minute_gist '
+            'ON metrics_call USING GIST (point, received_minute)',
+            'DROP INDEX metrics_call_point_minute_gist'
+        ),
+    ]
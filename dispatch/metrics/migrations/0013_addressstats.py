@@ -0,0 +1,44 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('metrics', '0012_call_received_minute'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='call',
+            index=models.Index(fields=['address'], name='metrics_call_address_idx'),
+        ),
+        migrations.CreateModel(
+            name='AddressStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('address', models.TextField(unique=True)),
+                ('calls', models.IntegerField()),
+                ('incidents', models.IntegerField()),
+                ('latitude', models.DecimalField(decimal_places=10, max_digits=12)),
+                ('longitude', models.DecimalField(decimal_places=10, max_digits=13)),
+                ('avg_dispatch_time', models.DurationField(null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='addressstats',
+            index=models.Index(fields=['-calls'], name='metrics_addr_calls_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='addressstats',
+            index=models.Index(fields=['-avg_dispatch_time'], name='metrics_addr_dispatch_idx'),
+        ),
+        # Populate the rollup from the calls already loaded
+        migrations.RunSQL(
+            'INSERT INTO metrics_addressstats '
+            '(address, calls, incidents, latitude, longitude, avg_dispatch_time) '
+            'SELECT address, COUNT(*), COUNT(DISTINCT incident_number), '
+            'AVG(latitude), AVG(longitude), AVG(dispatch_timestamp - received_timestamp) '
+            'FROM metrics_call GROUP BY address',
+            migrations.RunSQL.noop
+        ),
+    ]
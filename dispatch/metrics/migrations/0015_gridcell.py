@@ -0,0 +1,27 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('metrics', '0014_datasetversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GridCell',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('zoom', models.SmallIntegerField()),
+                ('x', models.IntegerField()),
+                ('y', models.IntegerField()),
+                ('calls', models.IntegerField()),
+                ('latitude_sum', models.FloatField()),
+                ('longitude_sum', models.FloatField()),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='gridcell',
+            unique_together={('zoom', 'x', 'y')},
+        ),
+    ]
@@ -0,0 +1,37 @@
+from django.contrib.postgres.indexes import BrinIndex
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    # Indexes are built concurrently so loads and reads continue meanwhile,
+    # which can't be done inside a transaction.
+    atomic = False
+
+    dependencies = [
+        ('metrics', '0015_gridcell'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='call',
+            index=models.Index(fields=['call_type_group'], include=['received_timestamp', 'dispatch_timestamp'], name='metrics_call_group_resp_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='call',
+            index=models.Index(fields=['battalion', 'call_type'], name='metrics_call_battalion_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='call',
+            index=models.Index(fields=['neighborhood_district', 'call_date'], include=['call_type', 'incident_number'], name='metrics_call_nbhd_date_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='call',
+            index=models.Index(fields=['call_date'], include=['received_minute', 'received_timestamp', 'battalion', 'neighborhood_district'], name='metrics_call_date_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='call',
+            index=BrinIndex(fields=['received_timestamp'], name='metrics_call_received_brin'),
+        ),
+    ]
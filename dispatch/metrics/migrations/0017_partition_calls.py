@@ -0,0 +1,83 @@
+import datetime
+
+from django.db import migrations
+
+TABLE = 'metrics_call'
+
+def rebuild_calls_table(cursor, partitioned):
+    """
+    Recreates the calls table as a table partitioned by month of call_date,
+    or back as a plain table, copying its rows, sequence and indexes. The
+    primary key of a partitioned table must include call_date, so it becomes
+    (id, call_date); id alone remains unique through its sequence.
+    """
+    cursor.execute(
+        'SELECT indexname, indexdef FROM pg_indexes WHERE tablename = %s '
+        'AND indexname <> %s', [TABLE, TABLE + '_pkey']
+    )
+    indexes = cursor.fetchall()
+
+    cursor.execute('SELECT pg_get_serial_sequence(%s, %s)', [TABLE, 'id'])
+    sequence = cursor.fetchone()[0]
+
+    # Keep the id sequence and free the table, key and index names
+    cursor.execute('ALTER SEQUENCE {0} OWNED BY NONE'.format(sequence))
+    cursor.execute('ALTER TABLE {0} RENAME TO {0}_old'.format(TABLE))
+    cursor.execute('ALTER INDEX {0}_pkey RENAME TO {0}_old_pkey'.format(TABLE))
+
+    for name, definition in indexes:
+        cursor.execute('DROP INDEX {0}'.format(name))
+
+    if partitioned:
+        cursor.execute(
+            'CREATE TABLE {0} (LIKE {0}_old INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+            'PARTITION BY RANGE (call_date)'.format(TABLE)
+        )
+        cursor.execute('ALTER TABLE {0} ADD PRIMARY KEY (id, call_date)'.format(TABLE))
+
+        # One partition per month of the existing calls
+        cursor.execute(
+            "SELECT DISTINCT date_trunc('month', call_date)::date FROM {0}_old".format(TABLE)
+        )
+        for month, in cursor.fetchall():
+            end = datetime.date(month.year + month.month // 12, month.month % 12 + 1, 1)
+            cursor.execute(
+                'CREATE TABLE {0}_y{1:04d}m{2:02d} PARTITION OF {0} '
+                'FOR VALUES FROM (%s) TO (%s)'.format(TABLE, month.year, month.month),
+                [month, end]
+            )
+    else:
+        cursor.execute(
+            'CREATE TABLE {0} (LIKE {0}_old INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'.format(TABLE)
+        )
+        cursor.execute('ALTER TABLE {0} ADD PRIMARY KEY (id)'.format(TABLE))
+
+    cursor.execute('INSERT INTO {0} SELECT * FROM {0}_old'.format(TABLE))
+    cursor.execute('DROP TABLE {0}_old CASCADE'.format(TABLE))
+    cursor.execute('ALTER SEQUENCE {0} OWNED BY {1}.id'.format(sequence, TABLE))
+
+    # Indexes created on the partitioned table cascade to every partition,
+    # including ones created later
+    for name, definition in indexes:
+        cursor.execute(definition)
+
+    cursor.execute('ANALYZE {0}'.format(TABLE))
+
+def partition_calls(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        rebuild_calls_table(cursor, partitioned=True)
+
+def unpartition_calls(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        rebuild_calls_table(cursor, partitioned=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('metrics', '0016_call_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_calls, unpartition_calls),
+    ]
@@ -0,0 +1,36 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('metrics', '0017_partition_calls'),
+    ]
+
+    operations = [
+        # Fill in or correct the points of existing calls in one statement
+        migrations.RunSQL(
+            'UPDATE metrics_call SET point = ST_SetSRID(ST_MakePoint(longitude, latitude), 4326) '
+            'WHERE point IS NULL OR ST_X(point) <> longitude::float8 '
+            'OR ST_Y(point) <> latitude::float8',
+            migrations.RunSQL.noop
+        ),
+        # Derive the point from the latitude and longitude on every insert or
+        # update, whether by save(), bulk_create(), update() or COPY. Row
+        # triggers on a partitioned table need PostgreSQL 13.
+        migrations.RunSQL(
+            'CREATE FUNCTION metrics_call_set_point() RETURNS trigger AS $$ '
+            'BEGIN '
+            'NEW.point := ST_SetSRID(ST_MakePoint(NEW.longitude, NEW.latitude), 4326); '
+            'RETURN NEW; '
+            'END; '
+            '$$ LANGUAGE plpgsql',
+            'DROP FUNCTION metrics_call_set_point()'
+        ),
+        migrations.RunSQL(
+            'CREATE TRIGGER metrics_call_set_point '
+            'BEFORE INSERT OR UPDATE OF latitude, longitude, point ON metrics_call '
+            'FOR EACH ROW EXECUTE FUNCTION metrics_call_set_point()',
+            'DROP TRIGGER metrics_call_set_point ON metrics_call'
+        ),
+    ]
@@ -0,0 +1,70 @@
+from django.conf import settings
+from django.db import migrations, models
+
+
+def remove_duplicate_calls(apps, schema_editor):
+    """
+    Keeps only the most recently loaded copy of each row, so the unique
+    constraint can be added to a table that was loaded more than once. When
+    copies were removed, the address and grid rollups are rebuilt from the
+    remaining calls and the dataset version is bumped, so cached responses
+    counting the copies are dropped.
+    """
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            'DELETE FROM metrics_call a USING metrics_call b '
+            'WHERE a.row_id = b.row_id AND a.id < b.id'
+        )
+
+        if not cursor.rowcount:
+            return
+
+        cursor.execute('DELETE FROM metrics_addressstats')
+        cursor.execute(
+            'INSERT INTO metrics_addressstats '
+            '(address, calls, incidents, latitude, longitude, avg_dispatch_time) '
+            'SELECT address, COUNT(*), COUNT(DISTINCT incident_number), '
+            'AVG(latitude), AVG(longitude), AVG(dispatch_timestamp - received_timestamp) '
+            'FROM metrics_call GROUP BY address'
+        )
+
+        # Grid cells as built by metrics.rollups, 8 x 8 per map tile
+        cursor.execute('DELETE FROM metrics_gridcell')
+        for zoom in getattr(settings, 'GRID_ZOOM_LEVELS', list(range(10, 19))):
+            size = 360.0 / (2 ** zoom) / 8
+            cursor.execute(
+                'INSERT INTO metrics_gridcell (zoom, x, y, calls, latitude_sum, longitude_sum) '
+                'SELECT %s, FLOOR(ST_X(point) / %s), FLOOR(ST_Y(point) / %s), '
+                'COUNT(*), SUM(ST_Y(point)), SUM(ST_X(point)) '
+                'FROM metrics_call WHERE point IS NOT NULL GROUP BY 2, 3',
+                [zoom, size, size]
+            )
+
+        cursor.execute(
+            'UPDATE metrics_datasetversion SET version = version + 1, updated = now() '
+            'WHERE id = 1'
+        )
+        if not cursor.rowcount:
+            cursor.execute(
+                'INSERT INTO metrics_datasetversion (id, version, updated) VALUES (1, 1, now())'
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('metrics', '0018_call_point_trigger'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='call',
+            name='row_hash',
+            field=models.CharField(blank=True, max_length=32, null=True),
+        ),
+        migrations.RunPython(remove_duplicate_calls, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='call',
+            constraint=models.UniqueConstraint(fields=('row_id', 'call_date'), name='metrics_call_row_id_uniq'),
+        ),
+    ]
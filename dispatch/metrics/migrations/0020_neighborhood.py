@@ -0,0 +1,20 @@
+import django.contrib.gis.db.models.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('metrics', '0019_call_row_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Neighborhood',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('geometry', django.contrib.gis.db.models.fields.MultiPolygonField(srid=4326)),
+            ],
+        ),
+    ]
@@ -0,0 +1,49 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('metrics', '0020_neighborhood'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CallCube',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('call_date', models.DateField()),
+                ('hour', models.SmallIntegerField()),
+                ('battalion', models.CharField(max_length=3)),
+                ('neighborhood_district', models.CharField(max_length=100)),
+                ('call_type', models.TextField()),
+                ('call_type_group', models.TextField()),
+                ('unit_type', models.TextField()),
+                ('priority', models.CharField(max_length=1)),
+                ('calls', models.IntegerField()),
+                ('dispatch_seconds', models.FloatField()),
+                ('dispatch_calls', models.IntegerField()),
+                ('response_seconds', models.FloatField()),
+                ('response_calls', models.IntegerField()),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='callcube',
+            constraint=models.UniqueConstraint(fields=('call_date', 'hour', 'battalion', 'neighborhood_district', 'call_type', 'call_type_group', 'unit_type', 'priority'), name='metrics_callcube_cell_uniq'),
+        ),
+        # Populate the cube from the calls already loaded
+        migrations.RunSQL(
+            'INSERT INTO metrics_callcube (call_date, hour, battalion, '
+            'neighborhood_district, call_type, call_type_group, unit_type, priority, '
+            'calls, dispatch_seconds, dispatch_calls, response_seconds, response_calls) '
+            'SELECT call_date, COALESCE(received_minute / 60, -1), battalion, '
+            "COALESCE(neighborhood_district, ''), call_type, COALESCE(call_type_group, ''), "
+            'unit_type, priority, COUNT(*), '
+            'COALESCE(SUM(EXTRACT(EPOCH FROM dispatch_timestamp - received_timestamp)), 0), '
+            'COUNT(dispatch_timestamp), '
+            'COALESCE(SUM(EXTRACT(EPOCH FROM on_scene_timestamp - received_timestamp)), 0), '
+            'COUNT(on_scene_timestamp) '
+            'FROM metrics_call GROUP BY 1, 2, 3, 4, 5, 6, 7, 8',
+            migrations.RunSQL.noop
+        ),
+    ]
@@ -0,0 +1,62 @@
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('metrics', '0021_callcube'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IncidentSketch',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('call_date', models.DateField()),
+                ('battalion', models.CharField(max_length=3)),
+                ('neighborhood_district', models.CharField(max_length=100)),
+                ('call_type', models.TextField()),
+                ('call_type_group', models.TextField()),
+                ('hll', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), size=None)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='incidentsketch',
+            constraint=models.UniqueConstraint(fields=('call_date', 'battalion', 'neighborhood_district', 'call_type', 'call_type_group'), name='metrics_incidentsketch_uniq'),
+        ),
+        # HyperLogLog sketch of a set of incident numbers with 2^14 registers,
+        # stored sparsely as register << 6 | rank for each non-empty register.
+        # The register is the top 14 bits of the incident number's md5 and the
+        # rank is the position of the first set bit of the next 32 bits.
+        migrations.RunSQL(
+            'CREATE FUNCTION metrics_hll_sketch(incidents integer[]) RETURNS integer[] AS $$ '
+            "SELECT COALESCE(array_agg(register << 6 | rank ORDER BY register), '{}') "
+            'FROM ('
+            "SELECT (('x' || substr(h, 1, 8))::bit(32)::bigint >> 18)::integer AS register, "
+            "MAX(COALESCE(NULLIF(position('1' IN ('x' || substr(h, 9, 8))::bit(32)::text), 0), 33)) AS rank "
+            'FROM (SELECT md5(i::text) AS h FROM unnest(incidents) AS i) AS hashes '
+            'GROUP BY 1'
+            ') AS registers '
+            '$$ LANGUAGE SQL IMMUTABLE STRICT PARALLEL SAFE',
+            'DROP FUNCTION metrics_hll_sketch(integer[])'
+        ),
+        # Union of two sketches: the highest rank of each register. Since an
+        # entry is register << 6 | rank, that's the largest entry per register.
+        migrations.RunSQL(
+            'CREATE FUNCTION metrics_hll_union(a integer[], b integer[]) RETURNS integer[] AS $$ '
+            "SELECT COALESCE(array_agg(e ORDER BY e), '{}') "
+            'FROM (SELECT MAX(e) AS e FROM unnest(a || b) AS e GROUP BY e >> 6) AS registers '
+            '$$ LANGUAGE SQL IMMUTABLE STRICT PARALLEL SAFE',
+            'DROP FUNCTION metrics_hll_union(integer[], integer[])'
+        ),
+        # Populate the sketches from the calls already loaded
+        migrations.RunSQL(
+            'INSERT INTO metrics_incidentsketch (call_date, battalion, '
+            'neighborhood_district, call_type, call_type_group, hll) '
+            "SELECT call_date, battalion, COALESCE(neighborhood_district, ''), call_type, "
+            "COALESCE(call_type_group, ''), metrics_hll_sketch(array_agg(DISTINCT incident_number)) "
+            'FROM metrics_call GROUP BY 1, 2, 3, 4, 5',
+            migrations.RunSQL.noop
+        ),
+    ]
@@ -1,6 +1,19 @@
 from django.db import models
 from django.contrib.gis.db import models as gismodels
-from django.contrib.gis.geos import GEOSGeometry
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import BrinIndex
+
+def minute_of_day(timestamp):
+    """
+    Returns the minute of the day (0-1439) of a timestamp in UTC, or None.
+    """
+    if not hasattr(timestamp, 'hour'):
+        return None
+
+    if timestamp.utcoffset():
+        timestamp = timestamp - timestamp.utcoffset()
+
+    return timestamp.hour * 60 + timestamp.minute
 
 class Call(models.Model):
     """
@@ -43,7 +56,166 @@ class Call(models.Model):
     latitude = models.DecimalField(max_digits=12, decimal_places=10)
     longitude = models.DecimalField(max_digits=13, decimal_places=10)
     point = gismodels.PointField(null=True, blank=True)
+    received_minute = models.SmallIntegerField(null=True, blank=True, db_index=True)
+    # MD5 of the row's CSV values, so re-ingesting skips unchanged rows
+    row_hash = models.CharField(max_length=32, null=True, blank=True)
+
+    class Meta:
+        # point has GeoDjango's GiST index, plus the (point, received_minute)
+        # GiST index added in migration 0012 for the nearby API. The covering
+        # indexes match the filter and GROUP BY columns of the chart and API
+        # views so they are answered by index (only) scans.
+        indexes = [
+            models.Index(fields=['address'], name='metrics_call_address_idx'),
+            models.Index(
+                fields=['call_type_group'],
+                include=['received_timestamp', 'dispatch_timestamp'],
+                name='metrics_call_group_resp_idx'
+            ),
+            models.Index(fields=['battalion', 'call_type'], name='metrics_call_battalion_idx'),
+            models.Index(
+                fields=['neighborhood_district', 'call_date'],
+                include=['call_type', 'incident_number'],
+                name='metrics_call_nbhd_date_idx'
+            ),
+            models.Index(
+                fields=['call_date'],
+                include=['received_minute', 'received_timestamp', 'battalion', 'neighborhood_district'],
+                name='metrics_call_date_idx'
+            ),
+            BrinIndex(fields=['received_timestamp'], name='metrics_call_received_brin'),
+        ]
+        # Rows are merged by row_id. A unique index of a partitioned table
+        # must include the partition key, so the constraint is on (row_id,
+        # call_date); row_id leads it, so it also serves lookups by row_id.
+        constraints = [
+            models.UniqueConstraint(
+                fields=['row_id', 'call_date'], name='metrics_call_row_id_uniq'
+            ),
+        ]
 
     def save(self, *args, **kwargs):
-        self.point = GEOSGeometry('POINT({0} {1})'.format(self.longitude, self.latitude)) 
-        super(Call, self).save(*args, **kwargs)  
\ No newline at end of file
+        # point is set from latitude and longitude by a database trigger, so
+        # it's also kept in sync by bulk_create(), update() and COPY.
+        self.received_minute = minute_of_day(self.received_timestamp)
+        super(Call, self).save(*args, **kwargs)
+
+class AddressStats(models.Model):
+    """
+    Model for the per-address rollup of calls used by the heatmaps. Rows are
+    refreshed by the ingest command for the addresses it loads.
+    """
+    address = models.TextField(unique=True)
+    calls = models.IntegerField()
+    incidents = models.IntegerField()
+    latitude = models.DecimalField(max_digits=12, decimal_places=10)
+    longitude = models.DecimalField(max_digits=13, decimal_places=10)
+    avg_dispatch_time = models.DurationField(null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-calls'], name='metrics_addr_calls_idx'),
+            models.Index(fields=['-avg_dispatch_time'], name='metrics_addr_dispatch_idx'),
+        ]
+
+class DatasetVersion(models.Model):
+    """
+    Model for the single row tracking the version of the loaded dataset.
+    The version is bumped by the commands that change the calls table and
+    invalidates cached API responses.
+    """
+    version = models.IntegerField(default=0)
+    updated = models.DateTimeField(auto_now_add=True)
+
+class GridCell(models.Model):
+    """
+    Model for the number of calls in one cell of the heatmap grid at a zoom
+    level. Cells are square in degrees, with cell (x, y) covering longitudes
+    [x * size, (x + 1) * size) and latitudes [y * size, (y + 1) * size).
+    Coordinate sums are kept so cells can be updated incrementally and
+    drawn at the centroid of their calls.
+    """
+    zoom = models.SmallIntegerField()
+    x = models.IntegerField()
+    y = models.IntegerField()
+    calls = models.IntegerField()
+    latitude_sum = models.FloatField()
+    longitude_sum = models.FloatField()
+
+    class Meta:
+        unique_together = ('zoom', 'x', 'y')
+
+class Neighborhood(models.Model):
+    """
+    Model for the San Francisco analysis neighborhoods, loaded from the
+    city's export by the load_neighborhoods command. The polygons have a
+    GiST index, so calls are matched to neighborhoods with spatial joins.
+    """
+    name = models.CharField(max_length=100, unique=True)
+    geometry = gismodels.MultiPolygonField(srid=4326)
+
+class CallCube(models.Model):
+    """
+    Model for one cell of the call cube: the calls of one call date and hour
+    of the day (UTC) with one combination of battalion, neighborhood, call
+    type, call type group, unit type and priority. Cells are maintained by
+    the ingest command and answer the chart views and the metrics query API.
+    Missing neighborhoods and call type groups are stored as ''.
+    """
+    call_date = models.DateField()
+    hour = models.SmallIntegerField()
+    battalion = models.CharField(max_length=3)
+    neighborhood_district = models.CharField(max_length=100)
+    call_type = models.TextField()
+    call_type_group = models.TextField()
+    unit_type = models.TextField()
+    priority = models.CharField(max_length=1)
+    calls = models.IntegerField()
+    # Distinct incidents are counted from the calls table, or estimated from
+    # the IncidentSketch rows.
+    # Sums of the received to dispatched and received to on scene intervals,
+    # and the number of calls with each
+    dispatch_seconds = models.FloatField()
+    dispatch_calls = models.IntegerField()
+    response_seconds = models.FloatField()
+    response_calls = models.IntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=[
+                    'call_date', 'hour', 'battalion', 'neighborhood_district',
+                    'call_type', 'call_type_group', 'unit_type', 'priority'
+                ],
+                name='metrics_callcube_cell_uniq'
+            ),
+        ]
+
+class IncidentSketch(models.Model):
+    """
+    Model for a HyperLogLog sketch of the incidents of one call date with
+    one combination of battalion, neighborhood, call type and call type
+    group. Sketches are coarser than the cube cells: they leave out the
+    hour, unit type and priority, which differ between the calls of an
+    incident, so most incidents are sketched once. Maintained by the ingest
+    command along with the cube. Missing neighborhoods and call type groups
+    are stored as ''.
+    """
+    call_date = models.DateField()
+    battalion = models.CharField(max_length=3)
+    neighborhood_district = models.CharField(max_length=100)
+    call_type = models.TextField()
+    call_type_group = models.TextField()
+    # Non-empty registers as register << 6 | rank, sorted by register
+    hll = ArrayField(models.IntegerField())
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=[
+                    'call_date', 'battalion', 'neighborhood_district', 'call_type',
+                    'call_type_group'
+                ],
+                name='metrics_incidentsketch_uniq'
+            ),
+        ]
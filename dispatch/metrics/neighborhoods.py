@@ -0,0 +1,217 @@
+import json
+import os
+
+from django.conf import settings
+from django.contrib.gis.geos import GEOSGeometry, MultiPolygon
+from django.db import connection, transaction
+from django.db.models import Max, Min
+
+from .models import Call, Neighborhood
+
+# Path to the San Francisco analysis neighborhoods export
+NEIGHBORHOODS_PATH = os.path.join(
+    os.path.dirname(settings.BASE_DIR), 'data', 'sf_neighborhoods.json'
+)
+
+MULTIPOLYGON_COL = 8 # Index for the multipolygon object
+NEIGHBORHOOD_COL = 9 # Index for the neighborhood name
+
+def read_neighborhoods(path=NEIGHBORHOODS_PATH):
+    """
+    Returns a list of (name, WKT multipolygon) tuples from the neighborhoods
+    export.
+    """
+    with open(path) as f:
+        rows = json.load(f)["data"]
+
+    return [(n[NEIGHBORHOOD_COL], n[MULTIPOLYGON_COL]) for n in rows]
+
+def load_neighborhoods(neighborhoods):
+    """
+    Replaces the Neighborhood rows with the given neighborhoods.
+    @param neighborhoods: A list of (name, WKT multipolygon) tuples.
+    @return: The number of neighborhoods loaded.
+    """
+    rows = []
+
+    for name, wkt in neighborhoods:
+        geometry = GEOSGeometry(wkt, srid=4326)
+
+        # Neighborhoods made of one polygon may be exported as a POLYGON
+        if geometry.geom_type == 'Polygon':
+            geometry = MultiPolygon(geometry, srid=4326)
+
+        rows.append(Neighborhood(name=name, geometry=geometry))
+
+    with transaction.atomic():
+        Neighborhood.objects.all().delete()
+        Neighborhood.objects.bulk_create(rows)
+
+    return len(rows)
+
+class NeighborhoodIndex:
+    """
+    In-memory point-in-neighborhood lookup.
+
+    Each multipolygon is parsed once and prepared, and a uniform grid over
+    the combined extent maps every cell to the neighborhoods whose bounding
+    box overlaps it, so a lookup only tests a handful of candidates.
+    """
+
+    def __init__(self, neighborhoods, grid_size=32):
+        """
+        @param neighborhoods: A list of (name, WKT multipolygon) tuples.
+        @param grid_size: The number of grid cells along each axis.
+        """
+        self.polygons = []
+
+        for name, wkt in neighborhoods:
+            geometry = GEOSGeometry(wkt, srid=4326)
+            self.polygons.append((name, geometry.extent, geometry.prepared))
+
+        self.grid_size = grid_size
+        self.cells = {}
+
+        if not self.polygons:
+            return
+
+        # Grid covers the union of the neighborhood bounding boxes
+        self.min_x = min(p[1][0] for p in self.polygons)
+        self.min_y = min(p[1][1] for p in self.polygons)
+        max_x = max(p[1][2] for p in self.polygons)
+        max_y = max(p[1][3] for p in self.polygons)
+        self.cell_width = (max_x - self.min_x) / grid_size or 1
+        self.cell_height = (max_y - self.min_y) / grid_size or 1
+
+        for index, (name, extent, prepared) in enumerate(self.polygons):
+            x0, y0 = self.get_cell(extent[0], extent[1])
+            x1, y1 = self.get_cell(extent[2], extent[3])
+
+            for x in range(x0, x1 + 1):
+                for y in range(y0, y1 + 1):
+                    self.cells.setdefault((x, y), []).append(index)
+
+    @classmethod
+    def from_json(cls, path=NEIGHBORHOODS_PATH):
+        """
+        Returns an index built from the neighborhoods export.
+        """
+        return cls(read_neighborhoods(path))
+
+    @classmethod
+    def from_database(cls):
+        """
+        Returns an index built from the Neighborhood table.
+        """
+        return cls([
+            (name, geometry.wkt)
+            for name, geometry in Neighborhood.objects.values_list('name', 'geometry')
+        ])
+
+    def get_cell(self, x, y):
+        """
+        Returns the grid cell containing the coordinates, clamped to the grid.
+        """
+        last = self.grid_size - 1
+        return (
+            min(max(int((x - self.min_x) / self.cell_width), 0), last),
+            min(max(int((y - self.min_y) / self.cell_height), 0), last)
+        )
+
+    def get_neighborhood(self, point):
+        """
+        Gets the neighborhood name for the specified GEOS POINT.
+        Returns None if no neighborhood is found.
+        """
+        if point is None or not self.polygons:
+            return None
+
+        x, y = point.x, point.y
+
+        for index in self.cells.get(self.get_cell(x, y), []):
+            name, extent, prepared = self.polygons[index]
+
+            # Cheap bounding box rejection before the exact test
+            if extent[0] <= x <= extent[2] and extent[1] <= y <= extent[3] \
+                    and prepared.contains(point):
+                return name
+
+        return None
+
+def get_id_batches(queryset, batch_size):
+    """
+    Yields (start, end) primary key ranges covering the queryset.
+    """
+    bounds = queryset.aggregate(low=Min('pk'), high=Max('pk'))
+
+    if bounds["low"] is None:
+        return
+
+    for start in range(bounds["low"], bounds["high"] + 1, batch_size):
+        yield start, start + batch_size
+
+def assign_in_python(index, batch_size=10000, only_missing=False, log=None):
+    """
+    Assigns neighborhood_district for calls using the in-memory index. Calls
+    are streamed in primary key batches, and each batch is written with one
+    UPDATE per neighborhood inside its own transaction.
+    Returns the number of calls assigned a neighborhood.
+    """
+    calls = Call.objects.exclude(point=None)
+    if only_missing:
+        calls = calls.filter(neighborhood_district=None)
+
+    total = 0
+
+    for start, end in get_id_batches(calls, batch_size):
+        groups = {}
+        batch = calls.filter(pk__gte=start, pk__lt=end).values_list('pk', 'point')
+
+        for pk, point in batch.iterator():
+            name = index.get_neighborhood(point)
+
+            if name:
+                groups.setdefault(name, []).append(pk)
+
+        with transaction.atomic():
+            for name, pks in groups.items():
+                Call.objects.filter(pk__in=pks).update(neighborhood_district=name)
+                total += len(pks)
+
+        if log:
+            log('Assigned calls up to #{0} ({1} total).'.format(end - 1, total))
+
+    return total
+
+def assign_in_database(batch_size=100000, only_missing=False, log=None):
+    """
+    Assigns neighborhood_district for calls with a set-based PostGIS
+    UPDATE ... FROM spatial join against the GiST-indexed Neighborhood
+    table. Calls are updated in primary key ranges, each in its own
+    transaction.
+    Returns the number of calls assigned a neighborhood.
+    """
+    sql = (
+        'UPDATE {0} AS c SET neighborhood_district = n.name '
+        'FROM {1} AS n '
+        'WHERE c.id >= %s AND c.id < %s AND ST_Contains(n.geometry, c.point)'
+    ).format(
+        connection.ops.quote_name(Call._meta.db_table),
+        connection.ops.quote_name(Neighborhood._meta.db_table)
+    )
+    if only_missing:
+        sql += ' AND c.neighborhood_district IS NULL'
+
+    total = 0
+    calls = Call.objects.exclude(point=None)
+
+    with connection.cursor() as cursor:
+        for start, end in get_id_batches(calls, batch_size):
+            with transaction.atomic():
+                cursor.execute(sql, [start, end])
+                total += cursor.rowcount
+
+            if log:
+                log('Assigned calls up to #{0} ({1} total).'.format(end - 1, total))
+
+    return total
@@ -0,0 +1,131 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.db import connection, connections, transaction
+
+from .cube import refresh_call_cube
+from .ingest import CallReader, CopyStream, CopyWriter, StagingMerge
+from .partitions import ensure_partitions
+from .rollups import refresh_address_stats, refresh_grid_cells
+
+# Characters of COPY text sent to the server per read of a shard's stream
+COPY_CHUNK_SIZE = 1024 * 1024
+
+def shard_offsets(csv_path, shards):
+    """
+    Splits a CSV export into byte ranges of about equal size, each starting
+    at the beginning of a line. Records must not span lines, which holds for
+    the city's exports.
+    @return: A list of (start, end) byte offsets, the first starting after
+    the header row.
+    """
+    size = os.path.getsize(csv_path)
+
+    with open(csv_path, 'rb') as f:
+        f.readline()
+        starts = [f.tell()]
+
+        for i in range(1, shards):
+            # Reading from the byte before the split point finds the first
+            # line starting at or after it
+            f.seek(max(size * i // shards - 1, starts[0]))
+            f.readline()
+
+            if starts[-1] < f.tell() < size:
+                starts.append(f.tell())
+
+    return [(start, end) for start, end in zip(starts, starts[1:] + [size]) if start < end]
+
+def init_worker():
+    """
+    Prepares a pool process. Processes started without fork import Django
+    afresh; forked ones already have it set up.
+    """
+    django.setup()
+
+def copy_shard(csv_path, start, end, staging_table):
+    """
+    Parses the records of a byte range of a CSV export and streams them into
+    the staging table with one COPY, committed on its own.
+    @return: A (start, end, rows, seconds) tuple.
+    """
+    began = time.time()
+
+    try:
+        with open(csv_path, 'rb') as f:
+            reader = CallReader(f, start, end)
+            # Rows are ordered across shards by their byte offset
+            writer = CopyWriter(connection, reader, staging_table, ordered=True)
+            stream = CopyStream(reader.rows(offsets=True))
+
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.cursor.copy_expert(writer.sql, stream, size=COPY_CHUNK_SIZE)
+    finally:
+        connection.close()
+
+    return start, end, stream.rows, time.time() - began
+
+def ingest_parallel(csv_path, workers, log=None):
+    """
+    Loads a CSV export with a pool of processes: the file is split into one
+    byte range per worker, each worker parses its range and streams it into
+    a shared unlogged staging table, and the staging table is then merged
+    into the calls table by row_id in one transaction. The address rollup
+    and the cube are refreshed for the affected addresses and dates and the
+    grid rebuilt, all in SQL.
+    @param workers: The number of worker processes.
+    @param log: Optional function called with each finished shard's
+    (start, end, rows, seconds).
+    @return: The ChangeSet of the merge.
+    """
+    with open(csv_path, 'rb') as f:
+        columns = CallReader(f).columns
+
+    staging_table = 'metrics_call_staging_{0}'.format(os.getpid())
+    merger = StagingMerge(connection, columns, staging_table)
+
+    with connection.cursor() as cursor:
+        cursor.execute(merger.create_sql(temporary=False))
+
+    try:
+        # Workers open their own connections; a forked worker must not share
+        # the parent's
+        connections.close_all()
+
+        shards = shard_offsets(csv_path, workers)
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as pool:
+            futures = [
+                pool.submit(copy_shard, csv_path, start, end, staging_table)
+                for start, end in shards
+            ]
+
+            for future in as_completed(futures):
+                result = future.result()
+
+                if log:
+                    log(*result)
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute('ANALYZE {0}'.format(merger.staging))
+
+            # Create the monthly partitions of the loaded call dates
+            cursor.execute(
+                "SELECT DISTINCT date_trunc('month', call_date)::date FROM {0}".format(merger.staging)
+            )
+            ensure_partitions([month for month, in cursor.fetchall()])
+
+            # Merges of whole exports change too many calls to update the
+            # grid point by point, so it's rebuilt in one pass instead
+            changes = merger.merge(cursor, points=False)
+
+            if changes.changed:
+                refresh_address_stats(changes.addresses)
+                refresh_grid_cells()
+                refresh_call_cube(changes.dates)
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TABLE IF EXISTS {0}'.format(merger.staging))
+
+    return changes
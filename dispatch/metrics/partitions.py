@@ -0,0 +1,135 @@
+import datetime
+import gzip
+import re
+import threading
+
+from django.db import connection, transaction
+
+from .models import Call
+
+# Monthly partitions of the calls table are named metrics_call_y2018m01
+PARTITION_NAME = re.compile(r'^(?P<table>.+)_y(?P<year>\d{4})m(?P<month>\d{2})$')
+
+_known_partitions = set()
+_known_partitions_lock = threading.Lock()
+
+def month_start(date):
+    """
+    Returns the first day of a date's month.
+    """
+    return datetime.date(date.year, date.month, 1)
+
+def next_month(date):
+    """
+    Returns the first day of the month after a date's month.
+    """
+    if date.month == 12:
+        return datetime.date(date.year + 1, 1, 1)
+
+    return datetime.date(date.year, date.month + 1, 1)
+
+def months_between(start, end):
+    """
+    Yields the first day of every month from start's month to end's month,
+    inclusive.
+    """
+    month = month_start(start)
+
+    while month <= end:
+        yield month
+        month = next_month(month)
+
+def partition_name(month):
+    """
+    Returns the name of the calls table partition holding a month.
+    """
+    return '{0}_y{1:04d}m{2:02d}'.format(Call._meta.db_table, month.year, month.month)
+
+def list_partitions():
+    """
+    Returns the (name, month, estimated rows, size in bytes) of every calls
+    table partition, oldest first.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT c.relname, c.reltuples, pg_total_relation_size(c.oid) '
+            'FROM pg_inherits i '
+            'JOIN pg_class c ON c.oid = i.inhrelid '
+            'JOIN pg_class p ON p.oid = i.inhparent '
+            'WHERE p.relname = %s ORDER BY c.relname',
+            [Call._meta.db_table]
+        )
+        rows = cursor.fetchall()
+
+    partitions = []
+    for name, estimate, size in rows:
+        match = PARTITION_NAME.match(name)
+
+        if match:
+            month = datetime.date(int(match.group('year')), int(match.group('month')), 1)
+            partitions.append((name, month, max(int(estimate), 0), size))
+
+    return partitions
+
+def ensure_partitions(dates):
+    """
+    Creates the monthly partitions for any of the given call dates that
+    don't have one yet. Partitions already seen by this process are skipped
+    without a query, so it's cheap to call for every ingest batch.
+    """
+    months = {month_start(date) for date in dates if date is not None}
+    missing = months - _known_partitions
+
+    if not missing:
+        return
+
+    table = connection.ops.quote_name(Call._meta.db_table)
+
+    # Created in their own savepoint so a failure doesn't poison the batch
+    # transaction. Indexes of the partitioned table are added automatically.
+    with transaction.atomic(), connection.cursor() as cursor:
+        for month in sorted(missing):
+            cursor.execute(
+                'CREATE TABLE IF NOT EXISTS {0} PARTITION OF {1} '
+                'FOR VALUES FROM (%s) TO (%s)'.format(
+                    connection.ops.quote_name(partition_name(month)), table
+                ),
+                [month, next_month(month)]
+            )
+
+    # Remembered only once committed or, inside an outer transaction, once
+    # that commits, since a rollback also removes the new partitions
+    def remember():
+        with _known_partitions_lock:
+            _known_partitions.update(missing)
+
+    transaction.on_commit(remember)
+
+def detach_partition(name, archive_path=None):
+    """
+    Detaches a partition from the calls table, which only takes a brief
+    lock instead of deleting its rows one by one. With an archive path, the
+    partition's rows are written there as gzipped CSV and the partition is
+    dropped; otherwise it's kept as a standalone table.
+    """
+    partition = connection.ops.quote_name(name)
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute('ALTER TABLE {0} DETACH PARTITION {1}'.format(
+            connection.ops.quote_name(Call._meta.db_table), partition
+        ))
+
+        if archive_path:
+            with gzip.open(archive_path, 'wb') as f:
+                cursor.cursor.copy_expert(
+                    'COPY {0} TO STDOUT WITH (FORMAT csv, HEADER true)'.format(partition), f
+                )
+
+            cursor.execute('DROP TABLE {0}'.format(partition))
+
+    match = PARTITION_NAME.match(name)
+    if match:
+        with _known_partitions_lock:
+            _known_partitions.discard(
+                datetime.date(int(match.group('year')), int(match.group('month')), 1)
+            )
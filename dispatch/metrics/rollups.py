@@ -0,0 +1,161 @@
+import math
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from .cube import add_to_call_cube, refresh_call_cube
+from .models import AddressStats, Call, GridCell
+
+# Grid cells per map tile edge, so a 256 pixel tile holds 8 x 8 cells
+CELLS_PER_TILE = 8
+
+def get_zoom_levels():
+    """
+    Returns the zoom levels the heatmap grid is built for.
+    """
+    return getattr(settings, 'GRID_ZOOM_LEVELS', list(range(10, 19)))
+
+def cell_size(zoom):
+    """
+    Returns the edge length, in degrees, of a grid cell at a zoom level.
+    """
+    return 360.0 / (2 ** zoom) / CELLS_PER_TILE
+
+def refresh_address_stats(addresses=None):
+    """
+    Recomputes the AddressStats rows for the given addresses from the calls
+    table, or rebuilds the whole rollup when no addresses are given.
+    """
+    stats_table = connection.ops.quote_name(AddressStats._meta.db_table)
+    calls_table = connection.ops.quote_name(Call._meta.db_table)
+
+    sql = (
+        'INSERT INTO {0} '
+        '(address, calls, incidents, latitude, longitude, avg_dispatch_time) '
+        'SELECT address, COUNT(*), COUNT(DISTINCT incident_number), '
+        'AVG(latitude), AVG(longitude), AVG(dispatch_timestamp - received_timestamp) '
+        'FROM {1} {2} GROUP BY address '
+        'ON CONFLICT (address) DO UPDATE SET '
+        'calls = EXCLUDED.calls, incidents = EXCLUDED.incidents, '
+        'latitude = EXCLUDED.latitude, longitude = EXCLUDED.longitude, '
+        'avg_dispatch_time = EXCLUDED.avg_dispatch_time'
+    )
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        if addresses is None:
+            cursor.execute('DELETE FROM {0}'.format(stats_table))
+            cursor.execute(sql.format(stats_table, calls_table, ''))
+        elif addresses:
+            # Addresses whose calls were all moved elsewhere have no row left
+            cursor.execute(
+                'DELETE FROM {0} WHERE address = ANY(%s)'.format(stats_table),
+                [list(addresses)]
+            )
+            cursor.execute(
+                sql.format(stats_table, calls_table, 'WHERE address = ANY(%s)'),
+                [list(addresses)]
+            )
+
+def refresh_grid_cells():
+    """
+    Rebuilds the heatmap grid for every zoom level from the calls table.
+    """
+    grid_table = connection.ops.quote_name(GridCell._meta.db_table)
+    calls_table = connection.ops.quote_name(Call._meta.db_table)
+
+    sql = (
+        'INSERT INTO {0} (zoom, x, y, calls, latitude_sum, longitude_sum) '
+        'SELECT %s, FLOOR(ST_X(point) / %s), FLOOR(ST_Y(point) / %s), '
+        'COUNT(*), SUM(ST_Y(point)), SUM(ST_X(point)) '
+        'FROM {1} WHERE point IS NOT NULL GROUP BY 2, 3'
+    ).format(grid_table, calls_table)
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute('DELETE FROM {0}'.format(grid_table))
+
+        for zoom in get_zoom_levels():
+            size = cell_size(zoom)
+            cursor.execute(sql, [zoom, size, size])
+
+def add_grid_cells(points, sign=1):
+    """
+    Adds newly loaded calls to the heatmap grid.
+    @param points: An iterable of (latitude, longitude) tuples.
+    @param sign: -1 to subtract the calls instead, such as the replaced
+    versions of updated calls.
+    """
+    grid_table = connection.ops.quote_name(GridCell._meta.db_table)
+    points = [(float(lat), float(lng)) for lat, lng in points if lat is not None and lng is not None]
+    cells = {}
+
+    # Aggregate the batch per cell before touching the database
+    for zoom in get_zoom_levels():
+        size = cell_size(zoom)
+
+        for lat, lng in points:
+            key = (zoom, math.floor(lng / size), math.floor(lat / size))
+            cell = cells.get(key)
+
+            if cell is None:
+                cells[key] = [sign, sign * lat, sign * lng]
+            else:
+                cell[0] += sign
+                cell[1] += sign * lat
+                cell[2] += sign * lng
+
+    if not cells:
+        return
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.executemany(
+            'INSERT INTO {0} AS g (zoom, x, y, calls, latitude_sum, longitude_sum) '
+            'VALUES (%s, %s, %s, %s, %s, %s) '
+            'ON CONFLICT (zoom, x, y) DO UPDATE SET '
+            'calls = g.calls + EXCLUDED.calls, '
+            'latitude_sum = g.latitude_sum + EXCLUDED.latitude_sum, '
+            'longitude_sum = g.longitude_sum + EXCLUDED.longitude_sum'.format(grid_table),
+            [key + tuple(cell) for key, cell in cells.items()]
+        )
+
+        # Cells left without calls are removed
+        if sign < 0:
+            cursor.executemany(
+                'DELETE FROM {0} WHERE zoom = %s AND x = %s AND y = %s '
+                'AND calls <= 0'.format(grid_table),
+                list(cells)
+            )
+
+def update_rollups(columns, rows):
+    """
+    Updates every rollup for a batch of newly loaded calls.
+    @param columns: The Call field names of the row values.
+    @param rows: A list of tuples of parsed values.
+    """
+    if 'address' in columns:
+        address = columns.index('address')
+        refresh_address_stats({r[address] for r in rows})
+
+    lat = columns.index('latitude')
+    lng = columns.index('longitude')
+    add_grid_cells((r[lat], r[lng]) for r in rows)
+
+    add_to_call_cube(columns, rows)
+
+def apply_changes(changes):
+    """
+    Updates every rollup for the calls changed by a merge, touching only
+    the affected addresses, grid cells and call dates of the cube.
+    @param changes: A metrics.ingest.ChangeSet.
+    """
+    refresh_address_stats(changes.addresses)
+    add_grid_cells(changes.removed_points, sign=-1)
+    add_grid_cells(changes.added_points)
+    refresh_call_cube(changes.dates)
+
+def refresh_rollups():
+    """
+    Rebuilds every rollup from the calls table.
+    """
+    refresh_address_stats()
+    refresh_grid_cells()
+    refresh_call_cube()
@@ -0,0 +1,258 @@
+import bisect
+import csv
+import datetime
+import itertools
+import random
+
+from django.contrib.gis.geos import Point
+
+from .neighborhoods import NeighborhoodIndex, read_neighborhoods
+
+# Named dataset sizes for the benchmarks
+SCALES = {'10k': 10000, '1m': 1000000, '10m': 10000000}
+
+# Column order of the city's dispatch CSV export
+CSV_COLUMNS = [
+    'call_number', 'unit_id', 'incident_number', 'call_type', 'call_date',
+    'watch_date', 'received_timestamp', 'entry_timestamp', 'dispatch_timestamp',
+    'response_timestamp', 'on_scene_timestamp', 'transport_timestamp',
+    'hospital_timestamp', 'call_final_disposition', 'available_timestamp',
+    'address', 'city', 'zipcode_of_incident', 'battalion', 'station_area', 'box',
+    'original_priority', 'priority', 'final_priority', 'als_unit',
+    'call_type_group', 'number_of_alarms', 'unit_type',
+    'unit_sequence_in_call_dispatch', 'fire_prevention_district',
+    'supervisor_district', 'neighborhood_district', 'location', 'row_id',
+    'latitude', 'longitude'
+]
+
+# (call type, call type group, relative frequency)
+CALL_TYPES = [
+    ('Medical Incident', 'Potentially Life-Threatening', 64),
+    ('Alarms', 'Alarm', 12),
+    ('Structure Fire', 'Fire', 8),
+    ('Traffic Collision', 'Non Life-threatening', 4),
+    ('Other', 'Non Life-threatening', 3),
+    ('Citizen Assist / Service Call', 'Non Life-threatening', 3),
+    ('Outside Fire', 'Fire', 2),
+    ('Vehicle Fire', 'Fire', 1),
+    ('Gas Leak (Natural and LP Gases)', 'Alarm', 1),
+    ('Electrical Hazard', 'Alarm', 1),
+    ('Water Rescue', 'Potentially Life-Threatening', 1),
+]
+
+# (unit type, unit id prefix, relative frequency, transports patients)
+UNIT_TYPES = [
+    ('ENGINE', 'E', 40, False),
+    ('MEDIC', 'M', 30, True),
+    ('TRUCK', 'T', 10, False),
+    ('PRIVATE', 'AM', 7, True),
+    ('CHIEF', 'B', 6, False),
+    ('RESCUE CAPTAIN', 'RC', 4, False),
+    ('RESCUE SQUAD', 'RS', 2, False),
+    ('SUPPORT', 'SP', 1, False),
+]
+
+DISPOSITIONS = [
+    ('Code 2 Transport', 40), ('Fire', 20), ('Patient Declined Transport', 10),
+    ('Other', 10), ('No Merit', 8), ('Against Medical Advice', 5),
+    ('Unable to Locate', 4), ('Cancelled', 3),
+]
+
+BATTALIONS = ['B{0:02d}'.format(n) for n in range(1, 11)]
+
+STREETS = [
+    'MARKET ST', 'MISSION ST', 'VALENCIA ST', 'GEARY BLVD', 'VAN NESS AVE',
+    'FOLSOM ST', 'HOWARD ST', 'BROADWAY', 'CALIFORNIA ST', 'IRVING ST',
+    'TARAVAL ST', 'OCEAN AVE', 'DIVISADERO ST', 'FILLMORE ST', 'POLK ST',
+    'LARKIN ST', '3RD ST', '24TH ST', 'CLEMENT ST', 'HAIGHT ST'
+]
+
+# Relative number of calls received in each hour of the day
+HOURLY_WEIGHTS = [
+    5, 4, 3, 3, 3, 3, 4, 5, 7, 8, 9, 9, 9, 9, 9, 9, 9, 9, 9, 8, 8, 7, 6, 6
+]
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S.%f UTC'
+
+def cumulative(weights):
+    """
+    Returns the running totals of a list of weights.
+    """
+    return list(itertools.accumulate(weights))
+
+class SyntheticCalls:
+    """
+    Generator of realistic dispatch CSV rows for benchmarks. Calls are
+    grouped into incidents of one or more units at addresses inside the San
+    Francisco neighborhoods, with call volume skewed towards busy addresses
+    and daytime hours and each unit's timestamps following in order.
+    """
+
+    def __init__(self, rows, seed=0, start=datetime.date(2016, 1, 1), days=None):
+        """
+        @param rows: The number of rows to generate.
+        @param seed: The random seed, so runs generate identical data.
+        @param start: The date of the first call.
+        @param days: The number of days the calls span; by default about 1000
+        calls a day, between 30 days and 10 years.
+        """
+        self.rows = rows
+        self.random = random.Random(seed)
+        self.start = datetime.datetime(start.year, start.month, start.day, tzinfo=datetime.timezone.utc)
+        self.days = days or min(max(rows // 1000, 30), 3650)
+
+        self.call_type_weights = cumulative([c[2] for c in CALL_TYPES])
+        self.unit_type_weights = cumulative([u[2] for u in UNIT_TYPES])
+        self.disposition_weights = cumulative([d[1] for d in DISPOSITIONS])
+        self.hour_weights = cumulative(HOURLY_WEIGHTS)
+        self.addresses = self.make_addresses(max(rows // 50, 1000))
+
+    def pick(self, choices, weights):
+        """
+        Returns a random choice using cumulative weights.
+        """
+        return choices[bisect.bisect(weights, self.random.random() * weights[-1])]
+
+    def make_addresses(self, count):
+        """
+        Returns a list of (address, latitude, longitude, neighborhood, details)
+        tuples for random points inside the neighborhoods, where details holds
+        the battalion, station area, box, zip code and districts.
+        """
+        neighborhoods = read_neighborhoods()
+        index = NeighborhoodIndex(neighborhoods)
+        names = [name for name, wkt in neighborhoods]
+        min_x, min_y = index.min_x, index.min_y
+        max_x = min_x + index.cell_width * index.grid_size
+        max_y = min_y + index.cell_height * index.grid_size
+        addresses = []
+
+        while len(addresses) < count:
+            lng = self.random.uniform(min_x, max_x)
+            lat = self.random.uniform(min_y, max_y)
+            neighborhood = index.get_neighborhood(Point(lng, lat, srid=4326))
+
+            if neighborhood is None:
+                continue
+
+            # Response areas follow the neighborhood, so calls at nearby
+            # addresses share a battalion and districts
+            n = names.index(neighborhood)
+            details = (
+                BATTALIONS[n % len(BATTALIONS)], '{0:02d}'.format(n + 1),
+                '{0:04d}'.format(self.random.randrange(10000)),
+                '941{0:02d}'.format(n % 34 + 2),
+                str(n % 10 + 1), str(n % 11 + 1)
+            )
+            address = '{0:d}00 Block of {1}'.format(
+                self.random.randrange(1, 50), self.random.choice(STREETS)
+            )
+            addresses.append(
+                (address, round(lat, 10), round(lng, 10), neighborhood, details)
+            )
+
+        return addresses
+
+    def incident_time(self):
+        """
+        Returns a random receive time, weighted towards daytime hours.
+        """
+        hour = self.pick(range(24), self.hour_weights)
+        return self.start + datetime.timedelta(
+            days=self.random.randrange(self.days), hours=hour,
+            seconds=self.random.randrange(3600),
+            microseconds=self.random.randrange(1000000)
+        )
+
+    def after(self, timestamp, low, high):
+        """
+        Returns a timestamp between low and high seconds after another.
+        """
+        return timestamp + datetime.timedelta(seconds=self.random.uniform(low, high))
+
+    def incident_rows(self, call_number, incident_number):
+        """
+        Yields the rows of one incident: one per dispatched unit.
+        """
+        rand = self.random
+
+        # Busy addresses get most of the calls
+        address, lat, lng, neighborhood, details = self.addresses[
+            int(len(self.addresses) * rand.random() ** 3)
+        ]
+        battalion, station, box, zipcode, prevention, supervisor = details
+
+        call_type, call_type_group, weight = self.pick(CALL_TYPES, self.call_type_weights)
+        received = self.incident_time()
+        entry = self.after(received, 5, 120)
+        priority = '3' if call_type_group != 'Non Life-threatening' else '2'
+        alarms = rand.choice([1, 1, 1, 2, 3]) if call_type_group == 'Fire' else 1
+        units = rand.choice([1, 1, 1, 2, 2, 3, 4]) + alarms - 1
+        unit_ids = set()
+
+        for sequence in range(1, units + 1):
+            unit_type, prefix, weight, transports = self.pick(UNIT_TYPES, self.unit_type_weights)
+            disposition, weight = self.pick(DISPOSITIONS, self.disposition_weights)
+
+            # Row ids are call_number-unit_id, so a unit is dispatched once
+            unit_id = '{0}{1:02d}'.format(prefix, rand.randrange(1, 45))
+            while unit_id in unit_ids:
+                unit_id = '{0}{1:02d}'.format(prefix, rand.randrange(1, 45))
+            unit_ids.add(unit_id)
+
+            dispatch = self.after(entry, 5, 240 + 30 * sequence)
+            response = self.after(dispatch, 5, 90) if rand.random() > 0.1 else None
+            on_scene = self.after(response or dispatch, 120, 900) if rand.random() > 0.15 else None
+            transport = hospital = None
+
+            if transports and on_scene and disposition == 'Code 2 Transport':
+                transport = self.after(on_scene, 300, 1800)
+                hospital = self.after(transport, 300, 1500)
+
+            available = self.after(hospital or on_scene or response or dispatch, 300, 3600)
+
+            yield [
+                call_number, unit_id, incident_number, call_type,
+                received.date().isoformat(),
+                (received - datetime.timedelta(hours=8)).date().isoformat(),
+                received.strftime(TIMESTAMP_FORMAT), entry.strftime(TIMESTAMP_FORMAT),
+                dispatch.strftime(TIMESTAMP_FORMAT),
+                response.strftime(TIMESTAMP_FORMAT) if response else '',
+                on_scene.strftime(TIMESTAMP_FORMAT) if on_scene else '',
+                transport.strftime(TIMESTAMP_FORMAT) if transport else '',
+                hospital.strftime(TIMESTAMP_FORMAT) if hospital else '',
+                disposition, available.strftime(TIMESTAMP_FORMAT),
+                address, 'San Francisco', zipcode, battalion, station, box,
+                priority, priority, int(priority), 'true' if unit_type == 'MEDIC' else 'false',
+                call_type_group, alarms, unit_type, sequence, prevention, supervisor,
+                neighborhood, '({0}, {1})'.format(lat, lng),
+                '{0}-{1}'.format(call_number, unit_id), lat, lng
+            ]
+
+    def __iter__(self):
+        """
+        Yields self.rows CSV rows.
+        """
+        count = 0
+        call_number = 160010000
+        incident_number = 16000000
+
+        while count < self.rows:
+            call_number += 1
+            incident_number += 1
+
+            for row in self.incident_rows(call_number, incident_number):
+                yield row
+                count += 1
+
+                if count >= self.rows:
+                    return
+
+    def write_csv(self, f):
+        """
+        Writes the header and rows to a text file in the city's export
+        format, which the ingest_calls command loads.
+        """
+        writer = csv.writer(f)
+        writer.writerow(CSV_COLUMNS)
+        writer.writerows(self)
@@ -1,3 +1,453 @@
-from django.test import TestCase
+import datetime
+import io
+import os
+import re
+import tempfile
+from decimal import Decimal
 
-# Create your tests here.
+from django.db import connection
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from api.geocoding import Location
+from api.nearby import batch_nearby_unit_types, nearby_unit_types
+from metrics.cube import (
+    CELL_COLUMNS, HLL_REGISTERS, SKETCH_COLUMNS, SOURCE_FIELDS, add_to_call_cube,
+    hll_entry, hll_estimate, query_cube, refresh_call_cube
+)
+from metrics.ingest import CallReader, CopyStream, copy_line
+from metrics.models import Call, CallCube, IncidentSketch, minute_of_day
+from metrics.parallel import shard_offsets
+from metrics.partitions import ensure_partitions, months_between
+
+# Matches a sequential scan of the calls table or one of its monthly
+# partitions
+CALL_SEQ_SCAN = re.compile(r'Seq Scan on {0}(_y\d{{4}}m\d{{2}})?\b'.format(Call._meta.db_table))
+
+# Synthetic calls, seven minutes apart from January 2018, ten battalions, eight neighborhoods and
+# six call types, around San Francisco.
+SYNTHETIC_CALLS_SQL = '''
+INSERT INTO {table} (
+    call_number, unit_id, incident_number, call_type, call_date, watch_date,
+    received_timestamp, entry_timestamp, dispatch_timestamp,
+    call_final_disposition, available_timestamp, address, zipcode_of_incident,
+    battalion, station_area, box, original_priority, priority, final_priority,
+    als_unit, call_type_group, number_of_alarms, unit_type,
+    unit_sequence_in_call_dispatch, fire_prevention_district,
+    supervisor_district, neighborhood_district, location, row_id, latitude,
+    longitude, received_minute
+)
+SELECT
+    g, 'U' || (g %% 500), g / 2,
+    (ARRAY['Medical Incident', 'Alarms', 'Structure Fire', 'Traffic Collision',
+        'Citizen Assist / Service Call', 'Other'])[1 + g %% 6],
+    received::date, received::date,
+    received, received + interval '1 minute', received + interval '2 minutes',
+    'Other', received + interval '1 hour', (g %% 5000) || ' MARKET ST', '94103',
+    'B' || lpad((1 + g %% 10)::text, 2, '0'), '01', '1234', '3', '3', 3,
+    g %% 2 = 0, (ARRAY['Alarm', 'Fire', 'Potentially Life-Threatening',
+        'Non Life-threatening'])[1 + g %% 4], 1,
+    (ARRAY['ENGINE', 'MEDIC', 'TRUCK', 'CHIEF'])[1 + g %% 4], 1, '1', '1',
+    (ARRAY['Mission', 'Western Addition', 'Sunset/Parkside',
+        'Financial District/South Beach', 'South of Market', 'Tenderloin',
+        'Marina', 'Noe Valley'])[1 + g %% 8],
+    '', g::text, latitude, longitude,
+    EXTRACT(HOUR FROM received) * 60 + EXTRACT(MINUTE FROM received)
+FROM (
+    SELECT g,
+        timestamp with time zone '2018-01-01 00:00:00+00' + g * interval '7 minutes' AS received,
+        (37.70 + random() * 0.11)::numeric(12, 10) AS latitude,
+        (-122.51 + random() * 0.13)::numeric(13, 10) AS longitude
+    FROM generate_series(1, %s) AS g
+) AS calls
+'''
+
+@override_settings(ANALYTICS_SNAPSHOT=False, UNIT_TYPE_INDEX=False, TILE_CACHE_DIR=None)
+class CallIndexTests(TransactionTestCase):
+    """
+    Checks the calls table indexes are chosen by the planner, with its
+    default settings and statistics gathered after loading, for the queries
+    they were built for, and that no view query needs a sequential scan of
+    the calls table.
+    """
+    CALLS = 200000
+
+    # A week of calls, a small share of the table
+    WEEK = (datetime.date(2018, 3, 1), datetime.date(2018, 3, 7))
+
+    def setUp(self):
+        ensure_partitions(months_between(
+            datetime.date(2018, 1, 1),
+            datetime.date(2018, 1, 1) + datetime.timedelta(minutes=7 * self.CALLS)
+        ))
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                SYNTHETIC_CALLS_SQL.format(table=connection.ops.quote_name(Call._meta.db_table)),
+                [self.CALLS]
+            )
+
+        # VACUUM sets the visibility map index-only scans rely on, and can't
+        # run inside a transaction, hence TransactionTestCase
+        with connection.cursor() as cursor:
+            cursor.execute('VACUUM ANALYZE {0}'.format(
+                connection.ops.quote_name(Call._meta.db_table)
+            ))
+
+    def explain(self, sql, params=None):
+        """
+        Returns the text plan of a query.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN ' + sql, params)
+            return '\n'.join(row[0] for row in cursor.fetchall())
+
+    def index_names(self, index):
+        """
+        Returns the name of an index on the calls table and of the indexes
+        of each partition attached to it.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT c.relname FROM pg_inherits i '
+                'JOIN pg_class c ON c.oid = i.inhrelid '
+                'JOIN pg_class p ON p.oid = i.inhparent '
+                'WHERE p.relname = %s',
+                [index]
+            )
+            return [index] + [name for name, in cursor.fetchall()]
+
+    def assertNoSeqScan(self, sql, params=None):
+        plan = self.explain(sql, params)
+        self.assertIsNone(CALL_SEQ_SCAN.search(plan), '{0}\n\n{1}'.format(sql, plan))
+
+    def assertUsesIndex(self, index, sql, params=None, index_only=False):
+        """
+        Asserts a query's plan scans the calls table, or its partitions, with
+        an index, only reading the index when index_only is set.
+        """
+        plan = self.explain(sql, params)
+        scan = r'Index Only Scan' if index_only else r'(Index Only Scan|Index Scan|Bitmap Index Scan)'
+        pattern = re.compile(r'{0} (using|on) ({1})\b'.format(
+            scan, '|'.join(re.escape(n) for n in self.index_names(index))
+        ))
+
+        self.assertRegex(plan, pattern, '{0}\n\n{1}'.format(sql, plan))
+        self.assertIsNone(CALL_SEQ_SCAN.search(plan), '{0}\n\n{1}'.format(sql, plan))
+
+    def test_indexes_serve_their_queries(self):
+        table = connection.ops.quote_name(Call._meta.db_table)
+        start, end = self.WEEK
+
+        queries = [
+            # Calls per hour of a date range
+            ('metrics_call_date_idx', True,
+                'SELECT received_minute / 60, COUNT(*) FROM {0} '
+                'WHERE call_date BETWEEN %s AND %s GROUP BY 1', [start, end]),
+            # Neighborhood trends: incidents per day and call type
+            ('metrics_call_nbhd_date_idx', True,
+                'SELECT call_date, call_type, COUNT(DISTINCT incident_number) FROM {0} '
+                'WHERE neighborhood_district = %s AND call_date BETWEEN %s AND %s '
+                'GROUP BY 1, 2', ['Mission', start, end]),
+            # Call type distribution of a battalion
+            ('metrics_call_battalion_idx', True,
+                'SELECT call_type, COUNT(*) FROM {0} WHERE battalion = %s GROUP BY 1',
+                ['B02']),
+            # Battalion list
+            ('metrics_call_battalion_idx', True,
+                'SELECT DISTINCT battalion FROM {0} ORDER BY battalion', []),
+            # Average dispatch time of a call type group
+            ('metrics_call_group_resp_idx', True,
+                'SELECT AVG(dispatch_timestamp - received_timestamp) FROM {0} '
+                'WHERE call_type_group = %s', ['Alarm']),
+            # Calls received in a time range
+            ('metrics_call_received_brin', False,
+                'SELECT COUNT(*) FROM {0} WHERE received_timestamp >= %s AND received_timestamp < %s',
+                [datetime.datetime(2018, 3, 1, tzinfo=datetime.timezone.utc),
+                    datetime.datetime(2018, 3, 2, tzinfo=datetime.timezone.utc)]),
+        ]
+
+        for index, index_only, sql, params in queries:
+            with self.subTest(index=index, sql=sql):
+                self.assertUsesIndex(index, sql.format(table), params, index_only)
+
+    def test_views_avoid_seq_scans(self):
+        requests = [
+            ('get', reverse('metrics-calls-per-hour'), {}),
+            ('get', reverse('metrics-calls-per-hour'), {'battalion': 'B02', 'start_date': '2018-03-01'}),
+            ('get', reverse('metrics-battalion-dist'), {}),
+            ('post', reverse('metrics-battalion-dist'), {'battalion': 'B02'}),
+            ('get', reverse('metrics-group-response-time'), {}),
+            ('get', reverse('api-calls-neighborhood-trends'), {}),
+            ('post', reverse('api-calls-neighborhood-trends'), {'neighborhood': 'Mission'}),
+            ('get', reverse('api-calls-safest-neighborhoods'), {}),
+            ('get', reverse('api-calls-neighborhoods'), {}),
+            ('get', reverse('api-calls-battalions'), {}),
+            ('get', reverse('api-address-frequency'), {}),
+            ('get', reverse('api-calls-longest-dispatch'), {}),
+            ('get', reverse('tiles-calls', kwargs={'z': 14, 'x': 2620, 'y': 6331}), {}),
+        ]
+
+        for method, path, data in requests:
+            with self.subTest(method=method, path=path, data=data):
+                with CaptureQueriesContext(connection) as context:
+                    getattr(self.client, method)(path, data)
+
+                for query in context.captured_queries:
+                    if Call._meta.db_table in query['sql'] and query['sql'].startswith('SELECT'):
+                        self.assertNoSeqScan(query['sql'])
+
+    def test_nearby_queries_avoid_seq_scans(self):
+        location = Location(37.7749, -122.4194)
+
+        sql, params = nearby_unit_types(location, 1609.34, 14 * 60, 120).query.sql_with_params()
+        self.assertNoSeqScan(sql, params)
+
+        with CaptureQueriesContext(connection) as context:
+            batch_nearby_unit_types([
+                (location, 1609.34, 14 * 60, 120),
+                (Location(37.76, -122.43), 804.67, 23 * 60, 120)
+            ])
+
+        for query in context.captured_queries:
+            self.assertNoSeqScan(query['sql'])
+
+def make_call(number, incident, received, neighborhood, call_type, group, unit_type):
+    """
+    Returns an unsaved Call received at a time, dispatched a minute later
+    and on scene after five.
+    """
+    return Call(
+        call_number=number, unit_id='U{0}'.format(number), incident_number=incident,
+        call_type=call_type, call_date=received.date(), watch_date=received.date(),
+        received_timestamp=received, entry_timestamp=received,
+        dispatch_timestamp=received + datetime.timedelta(minutes=1),
+        on_scene_timestamp=received + datetime.timedelta(minutes=5),
+        call_final_disposition='Other',
+        available_timestamp=received + datetime.timedelta(hours=1),
+        address='{0} MARKET ST'.format(number), zipcode_of_incident='94103',
+        battalion='B02', station_area='01', box='1234', original_priority='3',
+        priority='3', final_priority=3, als_unit=True, call_type_group=group,
+        number_of_alarms=1, unit_type=unit_type, unit_sequence_in_call_dispatch=1,
+        fire_prevention_district='1', supervisor_district='1',
+        neighborhood_district=neighborhood, location='', row_id=str(number),
+        latitude=Decimal('37.77'), longitude=Decimal('-122.42'),
+        received_minute=minute_of_day(received)
+    )
+
+class CallCubeTests(TransactionTestCase):
+    """
+    Checks cube cells and incident sketches merged batch by batch at ingest
+    match a rebuild from the calls table, and the measures query_cube
+    answers from them.
+    """
+
+    def setUp(self):
+        ensure_partitions([datetime.date(2018, 1, 1)])
+
+        day = datetime.datetime(2018, 1, 2, 10, 15, tzinfo=datetime.timezone.utc)
+        calls = [
+            # Two units of incident 1, and incident 5 in the same cell as the
+            # first
+            make_call(1, 1, day, 'Mission', 'Medical Incident', 'Alarm', 'ENGINE'),
+            make_call(2, 1, day, 'Mission', 'Medical Incident', 'Alarm', 'MEDIC'),
+            make_call(3, 2, day, 'Mission', 'Structure Fire', 'Fire', 'ENGINE'),
+            make_call(4, 5, day, 'Mission', 'Medical Incident', 'Alarm', 'ENGINE'),
+            # Calls without a neighborhood or call type group
+            make_call(5, 3, day, None, 'Medical Incident', None, 'ENGINE'),
+            make_call(6, 4, day + datetime.timedelta(days=1), None, 'Medical Incident', None, 'ENGINE'),
+        ]
+        Call.objects.bulk_create(calls)
+
+        # Merged in two batches, so cells and sketches of the second are
+        # merged into stored ones
+        rows = [tuple(getattr(c, name) for name in SOURCE_FIELDS) for c in calls]
+        add_to_call_cube(SOURCE_FIELDS, rows[:3])
+        add_to_call_cube(SOURCE_FIELDS, rows[3:])
+
+    def stored_rows(self):
+        return (
+            sorted(CallCube.objects.values_list(
+                *CELL_COLUMNS + ['calls', 'dispatch_seconds', 'dispatch_calls',
+                    'response_seconds', 'response_calls']
+            )),
+            sorted(IncidentSketch.objects.values_list(*SKETCH_COLUMNS + ['hll'])),
+        )
+
+    def test_merged_cells_match_rebuild(self):
+        cell = CallCube.objects.get(
+            neighborhood_district='Mission', call_type='Medical Incident', unit_type='ENGINE'
+        )
+        self.assertEqual((cell.hour, cell.calls, cell.dispatch_calls), (10, 2, 2))
+        self.assertEqual(cell.dispatch_seconds, 120)
+
+        merged = self.stored_rows()
+        refresh_call_cube()
+        self.assertEqual(self.stored_rows(), merged)
+
+    def test_exact_incidents(self):
+        self.assertEqual(query_cube(['neighborhood_district'], ['calls', 'incidents']), [
+            {'neighborhood_district': None, 'calls': 2, 'incidents': 2},
+            {'neighborhood_district': 'Mission', 'calls': 4, 'incidents': 3},
+        ])
+        self.assertEqual(query_cube([], ['calls', 'incidents'], exclude={'neighborhood_district': ['']}), [
+            {'calls': 4, 'incidents': 3},
+        ])
+        self.assertEqual(
+            query_cube(['call_type_group'], ['incidents'], {'neighborhood_district': ['']}),
+            [{'call_type_group': None, 'incidents': 2}]
+        )
+        self.assertEqual(
+            query_cube(['call_date'], ['incidents'], {'neighborhood_district': ['Mission', '']}),
+            [
+                {'call_date': datetime.date(2018, 1, 2), 'incidents': 4},
+                {'call_date': datetime.date(2018, 1, 3), 'incidents': 1},
+            ]
+        )
+        self.assertEqual(
+            query_cube(['unit_type'], ['incidents'], start_date=datetime.date(2018, 1, 2),
+                end_date=datetime.date(2018, 1, 2)),
+            [{'unit_type': 'ENGINE', 'incidents': 4}, {'unit_type': 'MEDIC', 'incidents': 1}]
+        )
+
+    def test_approx_incidents(self):
+        # Few incidents are counted exactly by linear counting
+        self.assertEqual(
+            query_cube(['neighborhood_district'], ['incidents'], approx=True),
+            query_cube(['neighborhood_district'], ['incidents'])
+        )
+
+    def test_sketch_encoding_matches_database(self):
+        incidents = list(range(1, 5001))
+        registers = {}
+
+        for incident in incidents:
+            register, rank = hll_entry(incident)
+            registers[register] = max(registers.get(register, 0), rank)
+
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT metrics_hll_sketch(%s)', [incidents])
+            sketch = cursor.fetchone()[0]
+
+        self.assertEqual(sketch, [r << 6 | registers[r] for r in sorted(registers)])
+
+class HyperLogLogTests(SimpleTestCase):
+
+    def estimate(self, values):
+        registers = {}
+
+        for value in values:
+            register, rank = hll_entry(value)
+            registers[register] = max(registers.get(register, 0), rank)
+
+        return hll_estimate(len(registers), sum(2.0 ** -rank for rank in registers.values()))
+
+    def test_estimates_within_error(self):
+        # Three standard errors of 1.04 / sqrt(m)
+        bound = 3 * 1.04 / HLL_REGISTERS ** 0.5
+
+        for count in (10, 1000, 10000, 100000):
+            with self.subTest(count=count):
+                estimate = self.estimate(range(1, count + 1))
+                self.assertLessEqual(abs(estimate - count) / count, bound)
+
+    def test_empty_sketch(self):
+        self.assertEqual(hll_estimate(0, 0.0), 0)
+
+    def test_approx_rejects_unsketched_dimensions(self):
+        for name in ('hour', 'unit_type', 'priority'):
+            with self.subTest(name=name):
+                with self.assertRaises(ValueError):
+                    query_cube([name], ['incidents'], approx=True)
+
+                with self.assertRaises(ValueError):
+                    query_cube([], ['incidents'], {name: ['1']}, approx=True)
+
+# A dispatch export with a quoted address, a multi-byte character and a
+# blank line
+CSV_TEXT = (
+    'call_number,incident_number,call_date,address,latitude,longitude,row_id\n'
+    + ''.join(
+        '{0},{1},2018-01-{2:02d},"{0} MARKET ST, {3}",37.77,-122.42,R{0}\n{4}'.format(
+            i, i // 2, 1 + i % 28, 'Peña' if i % 3 else 'SF', '\n' if i == 4 else ''
+        )
+        for i in range(1, 12)
+    )
+)
+
+class CallReaderTests(SimpleTestCase):
+
+    def read_all(self, offset=0, end=None):
+        return list(CallReader(io.BytesIO(CSV_TEXT.encode('utf-8')), offset, end).rows())
+
+    def test_resuming_from_batch_offsets(self):
+        rows = self.read_all()
+        self.assertEqual(len(rows), 11)
+
+        reader = CallReader(io.BytesIO(CSV_TEXT.encode('utf-8')))
+        read = []
+
+        for batch, offset in reader.batches(3):
+            read.extend(batch)
+
+            with self.subTest(offset=offset):
+                self.assertEqual(read + self.read_all(offset), rows)
+
+        self.assertEqual(read, rows)
+
+    def test_shards_cover_each_row_once(self):
+        rows = self.read_all()
+        with tempfile.NamedTemporaryFile(suffix='.csv', delete=False) as f:
+            f.write(CSV_TEXT.encode('utf-8'))
+            path = f.name
+
+        try:
+            for shards in (1, 2, 3, 5):
+                read = []
+                offsets = []
+
+                for start, end in shard_offsets(path, shards):
+                    with open(path, 'rb') as f:
+                        for row in CallReader(f, start, end).rows(offsets=True):
+                            read.append(row[:-1])
+                            offsets.append(row[-1])
+
+                with self.subTest(shards=shards):
+                    self.assertEqual(read, rows)
+                    self.assertEqual(offsets, sorted(set(offsets)))
+        finally:
+            os.remove(path)
+
+class CopyStreamTests(SimpleTestCase):
+
+    # Rows with values COPY escapes
+    ROWS = [('a\tb', i, None, 'line\nbreak', i % 2 == 0) for i in range(50)]
+
+    def test_sized_reads(self):
+        text = ''.join(copy_line(row) for row in self.ROWS)
+
+        for size in (1, 7, 64, 1000, len(text) + 1):
+            stream = CopyStream(self.ROWS)
+            chunks = list(iter(lambda: stream.read(size), ''))
+
+            with self.subTest(size=size):
+                self.assertTrue(all(len(chunk) <= size for chunk in chunks))
+                self.assertEqual(''.join(chunks), text)
+                self.assertEqual(stream.rows, len(self.ROWS))
+
+    def test_readline_after_sized_read(self):
+        lines = [copy_line(row) for row in self.ROWS]
+        stream = CopyStream(self.ROWS)
+
+        # A read ending part way through the second line
+        start = stream.read(len(lines[0]) + 3)
+        self.assertEqual(start, lines[0] + lines[1][:3])
+        self.assertEqual(stream.readline(), lines[1][3:])
+        self.assertEqual(stream.readline(), lines[2])
+
+        # Lines after a partly read one are whole
+        self.assertEqual(stream.read(1), lines[3][:1])
+        self.assertEqual(
+            list(iter(stream.readline, '')), [lines[3][1:]] + lines[4:]
+        )
@@ -2,13 +2,15 @@ from django.shortcuts import render
 from django.views.generic import View
 from django.http import JsonResponse
 from django.conf.urls.static import static
-from django.db.models import Avg, Count, F
-from django.db.models.functions import TruncDay, TruncHour
 
 import datetime
 import re
 
-from .models import Call
+import numpy as np
+
+from .columnar import get_snapshot
+from .cube import DIMENSIONS, MEASURES, query_cube
+from .filters import get_cube_filters, get_list_param, parse_date_param
 
 class Home(View):
     """
@@ -74,10 +76,17 @@ class AverageResponseTime(View):
         }
 
         # Get calls grouped by call_type_group and calculate the average
-        # dispatch time for each group.
-        calls = Call.objects.values('call_type_group').annotate(
-            avg_dispatch_time=Avg(F('dispatch_timestamp') - F('received_timestamp'))
-        ).order_by('-avg_dispatch_time')
+        # dispatch time for each group, from the columnar snapshot if enabled
+        # or else the cube.
+        snapshot = get_snapshot()
+        if snapshot:
+            calls = snapshot.average_dispatch_time()
+        else:
+            calls = sorted(
+                query_cube(['call_type_group'], ['avg_dispatch_time']),
+                key=lambda c: c["avg_dispatch_time"] or datetime.timedelta(0),
+                reverse=True
+            )
 
         # Add the data to the results list
         for call in calls:
@@ -105,18 +114,31 @@ class AverageCallsPerHour(View):
     """
     def get(self, request):
         """
-        Returns the average calls hour of day from the database.
+        Returns the average calls hour of day from the database. Calls can be
+        filtered by the battalion, neighborhood, start_date and end_date
+        parameters.
         """
         data = {
             "labels": [],
             "data": []
         }
 
-        # Get all calls grouped by day and hour, ordered by hour
-        day_calls = Call.objects.annotate(
-            hour=TruncHour('received_timestamp'),
-            day=TruncDay('received_timestamp'),
-        ).values('day', 'hour').annotate(count=Count('pk')).order_by('hour')
+        try:
+            filters, start_date, end_date = get_cube_filters(request.GET)
+        except ValueError as e:
+            # Invalid date provided, 400 Bad Request
+            return JsonResponse(
+                {
+                    'status': 'false',
+                    'message': str(e)
+                },
+                status=400
+            )
+
+        # Get the total calls for each hour of the day, and the number of
+        # days with calls, from the cube
+        hour_calls = query_cube(['hour'], ['calls'], filters, start_date=start_date, end_date=end_date)
+        total_days = query_cube([], ['days'], filters, start_date=start_date, end_date=end_date)[0]["days"]
 
         # Creates a list to hold the total calls for each hour of the day
         hours = [0] * 24
@@ -127,21 +149,12 @@ class AverageCallsPerHour(View):
             hour_label = str('0' + str(i) if i < 10 else i) + ':00'
             labels.append(hour_label)
 
-        days = [] # The days that have been accounted for
-        total_days = 0 # The total number of days in the data set
-
-        # Iterate through each day-hour call total and add the count of calls
-        # to the hours list. When encountering a new day value, increment the
-        # total days (used for calculating the average)
-        for call in day_calls:
-            if call["day"] not in days:
-                days.append(call["day"])
-                total_days += 1
-
-            hours[call["hour"].hour] += call["count"]
+        for call in hour_calls:
+            if call["hour"] >= 0:
+                hours[call["hour"]] = call["calls"]
 
         # Calculate average over each day of results
-        hours = [round(hour_count / total_days, 2) for hour_count in hours]
+        hours = [round(hour_count / total_days, 2) if total_days else 0 for hour_count in hours]
 
         # Add the data to the results list
         data["labels"] = labels
@@ -170,9 +183,14 @@ class BattalionDistribution(View):
         }
 
         # Get calls grouped by battalion and count that battalion's calls assigned
-        calls = Call.objects.values('battalion').annotate(
-            count=Count('battalion')
-        ).order_by('battalion')
+        snapshot = get_snapshot()
+        if snapshot:
+            calls = snapshot.battalion_counts()
+        else:
+            calls = [
+                {"battalion": c["battalion"], "count": c["calls"]}
+                for c in query_cube(['battalion'], ['calls'])
+            ]
 
         # Add the data to the results list
         for call in calls:
@@ -197,14 +215,17 @@ class BattalionDistribution(View):
 
         if battalion:
             # Gets calls grouped by type
-            calls = Call.objects.filter(battalion=battalion).values(
-                'call_type'
-            ).annotate(
-                call_count=Count('pk')
-            ).order_by('call_type')
+            snapshot = get_snapshot()
+            if snapshot:
+                calls = snapshot.battalion_call_types(battalion)
+            else:
+                calls = [
+                    {"call_type": c["call_type"], "call_count": c["calls"]}
+                    for c in query_cube(['call_type'], ['calls'], {'battalion': [battalion]})
+                ]
             
             # Populates the data list for the JSON response
-            colors = get_colors(calls.count(), 0.8)
+            colors = get_colors(len(calls), 0.8)
 
             # Create the basic dictionary structure
             data = {
@@ -249,22 +270,25 @@ class NeighborhoodTrends(View):
     def get(self, request):
         """
         Returns JSON representing a list of each neighborhood and the number
-        of calls per day over the data time period.
+        of calls per day over the data time period. With approx=true the
+        incidents are estimated from the incident sketches.
         """
+        approx = request.GET.get('approx') == 'true'
+
         # Top 5 most populous neighborhoods
         neighborhoods = [
             "Mission", "Western Addition", "Sunset/Parkside",
             "Financial District/South Beach", "South of Market"
         ]
         # Gets calls grouped by day and neighborhood
-        calls = Call.objects.filter(
-            neighborhood_district__in=neighborhoods
-        ).values(
-            'call_date', 'neighborhood_district'
-        ).annotate(
-            calls=Count('pk'),
-            incidents=Count('incident_number', distinct=True)
-        ).order_by('call_date')
+        snapshot = get_snapshot()
+        if snapshot and not approx:
+            calls = snapshot.neighborhood_daily_counts(neighborhoods)
+        else:
+            calls = query_cube(
+                ['call_date', 'neighborhood_district'], ['calls', 'incidents'],
+                {'neighborhood_district': neighborhoods}, approx=approx
+            )
         
         # Populates the data list for the JSON response
         data = {
@@ -313,88 +337,80 @@ class NeighborhoodTrends(View):
     def post(self, request):
         """
         Returns JSON representing a neighborhood's incidents per day by call
-        type and total incidents per day over the data time period.
+        type and total incidents per day over the data time period. Several
+        neighborhood values may be given, and the period can be limited with
+        the start_date and end_date parameters. With approx=true the
+        incidents are estimated from the incident sketches.
         """
         response = None
-        neighborhood = request.POST.get('neighborhood')
+        neighborhoods = get_list_param(request.POST, 'neighborhood')
 
         # Ensure neighborhood value provided
-        if neighborhood:
-            # Gets calls grouped by day and type
-            calls = Call.objects.filter(neighborhood_district=neighborhood).values(
-                'call_date', 'call_type'
-            ).annotate(
-                incidents=Count('incident_number', distinct=True)
-            ).order_by('call_date')
-            
-            # Populates the data list for the JSON response
-            data = {}
-            types = []
+        if neighborhoods:
+            try:
+                filters, start_date, end_date = get_cube_filters(request.POST)
+            except ValueError as e:
+                # Invalid date provided, 400 Bad Request
+                return JsonResponse(
+                    {
+                        'status': 'false',
+                        'message': str(e)
+                    },
+                    status=400
+                )
 
-            # Prepare data for Chart.js formatting
-            for call in calls:
-                call_date = str(call["call_date"])
-                call_type = call["call_type"]
-
-                if call_date not in data:
-                    data[call_date] = {
-                        "datasets": {},
-                        "total_incidents": 0
-                    }
+            # Gets calls grouped by day and type
+            calls = query_cube(
+                ['call_date', 'call_type'], ['incidents'], filters,
+                start_date=start_date, end_date=end_date,
+                approx=request.POST.get('approx') == 'true'
+            )
 
-                # Aggregate a list of call_type values
-                if call_type not in types:
-                    types.append(call_type)
+            # Pivot into a dense date x call_type matrix of incident counts
+            dates, types, incidents = pivot(calls, 'call_date', 'call_type', 'incidents')
 
-                data[call_date]["datasets"][call_type] = call["incidents"]
-                data[call_date]["total_incidents"] += call["incidents"]
+            if not dates:
+                # No calls found, 400 Bad Request
+                return JsonResponse(
+                    {
+                        'status': 'false',
+                        'message': 'No data found for given neighborhood.'
+                    },
+                    status=400
+                )
 
             colors = get_colors(len(types) + 1, 0.8)
-            dates = list(data.keys())
             response_data = {
-                "neighborhood_district": neighborhood,
-                "labels": dates,
+                "neighborhood_district": ", ".join(neighborhoods),
+                "labels": [str(date) for date in dates],
                 "datasets": []
             }
             
-            # Organize data into chart-compatible format
-            count = 0 # Index for unique chart colors
-            incident_count = None
-            total_incidents = []
-            for call_type in types:
-                dataset = {
-                    "label": call_type,
-                    "data": [],
-                    "backgroundColor": colors[count],
-                    "borderWidth": 0,
-                    "yAxisID": "bar-y-axis",
-                }
+            # Each column of the matrix is the incident count for each day of
+            # one call_type, or 0 if there were no incidents of that type
+            for count, call_type in enumerate(types):
+                response_data["datasets"].append(
+                    {
+                        "label": call_type,
+                        "data": incidents[:, count].tolist(),
+                        "backgroundColor": colors[count] if count < len(colors) else colors[-1],
+                        "borderWidth": 0,
+                        "yAxisID": "bar-y-axis",
+                    }
+                )
 
-                # Adds the incident count for each call type for each day
-                for date in dates:
-                    if call_type in data[date]["datasets"]:
-                        incident_count = data[date]["datasets"][call_type]
-                    else:
-                        incident_count = 0
-
-                    # Append incident count or 0 if there were no incidents
-                    # of that call_type for the given date
-                    dataset["data"].append(incident_count)
-                    total_incidents.append(data[date]["total_incidents"] if "total_incidents" else 0)
-                
-                response_data["datasets"].append(dataset)
-                count += 1
+            # Total incidents per day across all call types
+            total_incidents = incidents.sum(axis=1)
 
-            # Insert the total incidents per day data at the front of the
-            # the datasets list as the line chart
             response_data["limits"] = {
-                "min": min(total_incidents),
-                "max": max(total_incidents)
+                "min": int(total_incidents.min()),
+                "max": int(total_incidents.max())
             }
 
-            # Data required to create a line chart for total incidents
+            # Insert the total incidents per day data at the front of the
+            # the datasets list as the line chart
             total_incidents = {
-                "data": total_incidents,
+                "data": total_incidents.tolist(),
                 "type": "line",
                 "label": "Total Incidents",
                 "fill": "false",
@@ -422,6 +438,114 @@ class NeighborhoodTrends(View):
             )
 
         return response
+
+class MetricsQuery(View):
+    """
+    Class-based view answering any slice of the calls from the cube.
+    """
+
+    def get(self, request):
+        """
+        Returns JSON representing the measures of the calls grouped by the
+        group_by dimensions. Parameters:
+        group_by: comma separated dimensions, e.g. battalion,hour.
+        measures: comma separated measures (default: calls).
+        filter: dimension:value, repeated to filter by several dimensions or
+        to match any of several values of one.
+        exclude: dimension:value to leave out, repeatable.
+        start_date, end_date: inclusive call date bounds (YYYY-MM-DD).
+        approx: true to estimate incidents from the incident sketches.
+        Average times are returned in seconds.
+        """
+        group_by = split_param(request.GET, 'group_by')
+        measures = split_param(request.GET, 'measures') or ['calls']
+        approx = request.GET.get('approx') == 'true'
+
+        try:
+            filters = get_dimension_params(request.GET, 'filter')
+            exclude = get_dimension_params(request.GET, 'exclude')
+
+            rows = query_cube(
+                group_by, measures, filters, exclude,
+                parse_date_param(request.GET, 'start_date'),
+                parse_date_param(request.GET, 'end_date'), approx
+            )
+        except ValueError as e:
+            # Invalid dimension, measure or filter value, 400 Bad Request
+            return JsonResponse(
+                {
+                    'status': 'false',
+                    'message': str(e),
+                    'dimensions': list(DIMENSIONS),
+                    'measures': MEASURES
+                },
+                status=400
+            )
+
+        # Report average times as seconds
+        for row in rows:
+            for name in ('avg_dispatch_time', 'avg_response_time'):
+                if row.get(name) is not None:
+                    row[name] = round(row[name].total_seconds(), 3)
+
+        return JsonResponse(
+            {
+                'status': 'true',
+                'group_by': group_by,
+                'measures': measures,
+                'approx': approx,
+                'data': rows
+            }
+        )
+
+def split_param(params, name):
+    """
+    Returns the values of a comma separated request parameter that may also
+    be given more than once.
+    """
+    return [
+        value.strip()
+        for param in get_list_param(params, name)
+        for value in param.split(',') if value.strip()
+    ]
+
+def get_dimension_params(params, name):
+    """
+    Returns a dictionary of dimension name to values from the
+    dimension:value request parameters of a name. Raises a ValueError for a
+    value without a dimension.
+    """
+    dimensions = {}
+
+    for param in get_list_param(params, name):
+        dimension, separator, value = param.partition(':')
+
+        if not separator:
+            raise ValueError('Invalid {0} "{1}"; expected dimension:value.'.format(name, param))
+
+        dimensions.setdefault(dimension.strip(), []).append(value)
+
+    return dimensions
+
+def pivot(rows, row_key, column_key, value_key):
+    """
+    Pivots grouped query rows into a dense matrix.
+    @param rows: An iterable of dictionaries, at most one per row/column pair.
+    @return: a tuple of the sorted row labels, the sorted column labels and
+    an int64 NumPy matrix of the values, 0 where a pair has no row.
+    """
+    rows = list(rows)
+    row_labels = sorted({r[row_key] for r in rows})
+    column_labels = sorted({r[column_key] for r in rows}, key=lambda c: (c is None, c))
+
+    row_index = {label: i for i, label in enumerate(row_labels)}
+    column_index = {label: i for i, label in enumerate(column_labels)}
+
+    matrix = np.zeros((len(row_labels), len(column_labels)), dtype=np.int64)
+    for r in rows:
+        matrix[row_index[r[row_key]], column_index[r[column_key]]] = r[value_key]
+
+    return row_labels, column_labels, matrix
     
 def get_colors(amount, opacity):
     """